@@ -0,0 +1,58 @@
+"""Bulk vs. chunked application of a massive delta, against a local stand-in.
+
+Simulates enabling ``USE_DHCP``: a zone of 2,000 host records gains 60,000
+DHCP records. The delta is applied once in 500-rrset chunks and once as a
+single bulk PATCH, each against a fresh PowerDNS API stand-in
+(``tests/pdns_standin.py``). Reports request count and wall time.
+
+    python benchmarks/bench_bulk.py
+"""
+import os
+import sys
+import time
+
+from synthetic import HAMIP_AT
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "tests"))
+
+from hamipat.powerdns import PowerDnsClient  # noqa: E402
+from hamipat.records import ResourceRecord  # noqa: E402
+from hamipat.updater import ZoneUpdater  # noqa: E402
+from pdns_standin import PowerDnsStandIn  # noqa: E402
+
+HOSTS = 2_000
+DHCP = 60_000
+
+
+def records():
+    hosts = {f"h{i}.oe1x{i % 100:03d}{HAMIP_AT}": ResourceRecord("A", f"44.143.{i // 256}.{i % 256}")
+             for i in range(HOSTS)}
+    dhcp = {f"dhcp-44-144-{i // 256 % 256}-{i % 256}.oe3x{i % 100:03d}{HAMIP_AT}":
+            ResourceRecord("A", f"44.144.{i // 256 % 256}.{i % 256}") for i in range(DHCP)}
+    return hosts, hosts | dhcp
+
+
+def measure(bulk_ratio):
+    hosts, reference = records()
+    standin = PowerDnsStandIn()
+    try:
+        standin.load(hosts)
+        client = PowerDnsClient(standin.endpoint, "key", max_chunk_bytes=64 * 1024 * 1024)
+        start = time.perf_counter()
+        ZoneUpdater(client, bulk_ratio=bulk_ratio).sync(reference)
+        elapsed = time.perf_counter() - start
+        writes = sum(1 for method, _ in standin.requests if method != "GET")
+        return writes, elapsed
+    finally:
+        standin.close()
+
+
+def main():
+    print(f"zone of {HOSTS} records, delta adds {DHCP} DHCP records")
+    for label, ratio in (("chunked (500 rrsets)", None), ("bulk (one PATCH)", 0.5)):
+        writes, elapsed = measure(ratio)
+        print(f"{label:22s} {writes:5d} write requests {elapsed * 1000:9.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
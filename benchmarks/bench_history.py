@@ -0,0 +1,72 @@
+"""Reconstructing version N of a zone after 10k recorded runs.
+
+A 5,000-record zone gets 10,000 recorded deltas (the timestamp TXT plus a few
+changed hosts each, like a regular sync). Version N is then reconstructed
+from the history with periodic snapshots (``HISTORY_SNAPSHOT_EVERY``) and,
+for comparison, by replaying every delta from version 0. Reports the
+recording time, the size on disk (SQLite plus snapshot files) and the
+reconstruction times.
+
+    python benchmarks/bench_history.py
+"""
+import os
+import random
+import tempfile
+import time
+
+from synthetic import HAMIP_AT, best_of, synthetic_records
+
+from hamipat.config import HISTORY_SNAPSHOT_EVERY
+from hamipat.history import HistoryStore
+from hamipat.records import ResourceRecord
+
+ZONE = "hamip.at"
+RECORDS = 5_000
+RUNS = 10_000
+CHANGES_PER_RUN = 5
+
+
+def deltas():
+    rng = random.Random(1)
+    records = synthetic_records(RECORDS)
+    names = sorted(records)
+    stamp = {f"timestamp{HAMIP_AT}": ResourceRecord("TXT", '"run 0"', 60)}
+    for run in range(1, RUNS + 1):
+        picked = rng.sample(names, CHANGES_PER_RUN)
+        changed = {
+            name: ResourceRecord("A", f"44.143.{rng.randrange(256)}.{rng.randrange(256)}")
+            for name in picked
+        }
+        to_remove = {name: records[name] for name in picked} | stamp
+        stamp = {f"timestamp{HAMIP_AT}": ResourceRecord("TXT", f'"run {run}"', 60)}
+        records.update(changed)
+        yield to_remove, changed | stamp
+
+
+def fill(path, snapshot_every):
+    store = HistoryStore(path, snapshot_every=snapshot_every)
+    store.start(ZONE, synthetic_records(RECORDS))
+    start = time.perf_counter()
+    for to_remove, to_change in deltas():
+        store.record(ZONE, to_remove, to_change)
+    return store, time.perf_counter() - start
+
+
+def main():
+    print(f"{RECORDS} records, {RUNS} recorded runs of {CHANGES_PER_RUN + 1} changes")
+    with tempfile.TemporaryDirectory() as tmp:
+        for label, every in ((f"snapshot every {HISTORY_SNAPSHOT_EVERY}", HISTORY_SNAPSHOT_EVERY),
+                             ("deltas only", RUNS + 1)):
+            path = os.path.join(tmp, f"{every}.sqlite3")
+            store, elapsed = fill(path, every)
+            files = [os.path.join(store.snapshot_dir, f) for f in os.listdir(store.snapshot_dir)]
+            size = sum(map(os.path.getsize, [path] + files)) / 2**20
+            print(f"{label}: recorded in {elapsed:.2f} s, {size:.1f} MiB")
+            for version in (RUNS // 2 + 37, RUNS - 1):
+                seconds = best_of(lambda: store.version(ZONE, version), repeat=3)
+                print(f"  version {version:5d}: {seconds * 1000:8.1f} ms")
+            store.close()
+
+
+if __name__ == "__main__":
+    main()
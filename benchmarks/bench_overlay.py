@@ -0,0 +1,122 @@
+"""Split-horizon reference building: merged copies vs. LayeredRecordMap.
+
+Builds a HamnetDB record set with DHCP expansion enabled (through
+``HamnetDbClient`` and a fake session), then plans both targets the way
+``cli`` did before (``hamnetdb | overlay`` copied per target, diffed in full)
+and the way it does now (``LayeredRecordMap`` + ``SharedBaseDiff``). Reports
+time and the tracemalloc peak of each. The live zones already exist before
+measuring, so the peak is what planning allocates on top of them.
+
+    python benchmarks/bench_overlay.py
+"""
+import ipaddress
+import tracemalloc
+
+from synthetic import best_of, site_for
+
+from hamipat.hamnetdb import HamnetDbClient
+from hamipat.records import LayeredRecordMap, ResourceRecord
+from hamipat.updater import SharedBaseDiff, diff_records
+
+SUBNETS = 500  # each a /24 with a 10-250 DHCP range -> ~120k DHCP records
+
+
+class FakeResponse:
+    def __init__(self, payload):
+        self._payload = payload
+
+    def raise_for_status(self):
+        pass
+
+    def json(self):
+        return self._payload
+
+
+class FakeSession:
+    def __init__(self, hosts, subnets):
+        self._payloads = {"host": hosts, "subnet": subnets}
+
+    def get(self, url):
+        return FakeResponse(self._payloads["host" if "tab=host" in url else "subnet"])
+
+
+def hamnetdb_payloads():
+    hosts, subnets = [], []
+    for i in range(SUBNETS):
+        site = site_for(i)
+        network = ipaddress.IPv4Network(f"44.{128 + i // 256}.{i % 256}.0/24")
+        for j in (1, 2, 3, 4):
+            hosts.append({
+                "site": site, "name": f"h{j}.{site}", "ip": str(network[j]),
+                "deleted": 0, "aliases": f"a{j}.{site}" if j == 1 else "",
+            })
+        subnets.append({
+            "deleted": 0, "ip": str(network),
+            "begin_ip": int(network.network_address), "dhcp_range": "10-250",
+        })
+    return hosts, subnets
+
+
+def legacy_diff(current, reference):
+    """The diff as ``ZoneUpdater`` computed it before ``diff_records``."""
+    to_remove = {n: r for n, r in current.items() if reference.get(n) != r}
+    to_change = {n: r for n, r in reference.items() if current.get(n) != r}
+    return to_remove, to_change
+
+
+def live_copy(records):
+    """An independently parsed copy of ``records`` (distinct objects)."""
+    return {name: ResourceRecord(r.type, r.content, r.ttl) for name, r in records.items()}
+
+
+def main():
+    client = HamnetDbClient(session=FakeSession(*hamnetdb_payloads()))
+    hamnetdb = client.fetch_hosts()
+    hamnetdb |= client.fetch_dhcp(hamnetdb)
+
+    timestamp = {"timestamp.hamip.at.": ResourceRecord("TXT", '"now"', 60)}
+    static_isp = {"www.hamip.at.": ResourceRecord("A", "89.185.96.125", 600)}
+    static_hamnet = {"www.hamip.at.": ResourceRecord("A", "44.143.8.131", 600)}
+    overlays = [static_isp | timestamp, static_hamnet | timestamp]
+
+    # Live zones: last run's records, a handful of changes, parsed per target.
+    names = list(hamnetdb)
+    previous = dict(hamnetdb)
+    for name in names[::5000]:
+        previous[name] = ResourceRecord("A", "44.0.0.1", 600)
+    lives = [live_copy(previous | overlay) for overlay in overlays]
+
+    def legacy():
+        return [legacy_diff(live, hamnetdb | overlay) for live, overlay in zip(lives, overlays)]
+
+    def merged():
+        return [diff_records(live, hamnetdb | overlay) for live, overlay in zip(lives, overlays)]
+
+    def layered():
+        shared = SharedBaseDiff(hamnetdb, set().union(*overlays))
+        return [
+            diff_records(live, LayeredRecordMap(hamnetdb, overlay), shared)
+            for live, overlay in zip(lives, overlays)
+        ]
+
+    assert legacy() == merged() == layered()
+
+    def peak(func):
+        tracemalloc.start()
+        func()
+        _, top = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        return top
+
+    print(f"{len(hamnetdb)} HamnetDB records (DHCP expanded), 2 targets")
+    for label, func in (
+        ("merged copy, legacy diff", legacy),
+        ("merged copy, diff_records", merged),
+        ("LayeredRecordMap + shared", layered),
+    ):
+        print(f"{label:26s} {best_of(func, 3) * 1000:8.1f} ms "
+              f"peak {peak(func) / 2 ** 20:6.1f} MiB")
+
+
+if __name__ == "__main__":
+    main()
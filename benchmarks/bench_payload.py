@@ -0,0 +1,87 @@
+"""Encoding 100k-record deltas for two targets: per-chunk json.dumps vs. cache.
+
+The old path built a dict per rrset and ran ``json.dumps`` on every chunk,
+separately for each target. The new path encodes each rrset once per run with
+a shared ``RrsetEncoder`` and joins cached bytes. No HTTP is involved: the
+session only counts the bytes it is handed.
+
+    python benchmarks/bench_payload.py
+"""
+import json
+
+from synthetic import best_of, synthetic_records
+
+from hamipat.powerdns import PowerDnsClient, RrsetEncoder
+from hamipat.records import ResourceRecord
+
+COUNT = 100_000
+
+
+class NullResponse:
+    status_code = 204
+    text = ""
+
+
+class CountingSession:
+    def __init__(self):
+        self.bytes = 0
+
+    def patch(self, url, headers=None, data=None):
+        self.bytes += len(data)
+        return NullResponse()
+
+
+def rrset_dict(name, record, delete):
+    """The PowerDNS rrset object, as the old path built it."""
+    if delete:
+        return {"name": name, "type": record.type, "changetype": "DELETE"}
+    return {
+        "name": name,
+        "type": record.type,
+        "ttl": record.ttl,
+        "changetype": "REPLACE",
+        "records": [{"content": record.content, "disabled": False}],
+    }
+
+
+def legacy(deltas, chunk_size=500):
+    """How ``PowerDnsClient._patch`` encoded chunks before the payload cache."""
+    sent = 0
+    for to_remove, to_change in deltas:
+        for records, delete in ((to_remove, True), (to_change, False)):
+            items = list(records.items())
+            for start in range(0, len(items), chunk_size):
+                chunk = items[start:start + chunk_size]
+                rrsets = [rrset_dict(name, record, delete) for name, record in chunk]
+                sent += len(json.dumps({"rrsets": rrsets}))
+    return sent
+
+
+def cached(deltas):
+    encoder = RrsetEncoder()
+    sent = 0
+    for to_remove, to_change in deltas:
+        session = CountingSession()
+        client = PowerDnsClient("http://x/api", "key", session=session, encoder=encoder)
+        client.delete_records(to_remove)
+        client.replace_records(to_change)
+        sent += session.bytes
+    return sent
+
+
+def main():
+    reference = synthetic_records(COUNT)
+    # ISP and HamNet deltas: the same HamnetDB records, plus a few per-zone ones.
+    isp = dict(reference, **{"www.hamip.at.": ResourceRecord("A", "89.185.96.125")})
+    hamnet = dict(reference, **{"www.hamip.at.": ResourceRecord("A", "44.143.8.131")})
+    removed = {f"old{i}.hamip.at.": ResourceRecord("A", "44.0.0.1") for i in range(1000)}
+    deltas = [(removed, isp), (removed, hamnet)]
+
+    assert legacy(deltas) == cached(deltas)
+    print(f"2 targets x {COUNT} changed records ({legacy(deltas) / 2 ** 20:.1f} MiB of JSON)")
+    print(f"per-chunk json.dumps:   {best_of(lambda: legacy(deltas), 3) * 1000:8.1f} ms")
+    print(f"shared RrsetEncoder:    {best_of(lambda: cached(deltas), 3) * 1000:8.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
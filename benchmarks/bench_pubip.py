@@ -0,0 +1,53 @@
+"""Throughput of the public-IP stage over 100k synthetic names.
+
+Compares calling ``extract_ip_and_domain`` per name with the batch
+``PublicIpRecords`` stage, cold and on a rerun where 1 % of the names changed.
+
+    python benchmarks/bench_pubip.py
+"""
+from synthetic import best_of, synthetic_records
+
+from hamipat.pubip import PublicIpRecords, extract_ip_and_domain
+
+COUNT = 100_000
+
+
+def per_name(names):
+    records = {}
+    for name in names:
+        ip, domain = extract_ip_and_domain(name)
+        if ip:
+            records.setdefault(domain, ip)
+    return records
+
+
+def main():
+    names = list(synthetic_records(COUNT))
+    changed = names[: COUNT - COUNT // 100] + [
+        f"10-0-{i // 256 % 256}-{i % 256}-inetip.new{i}.hamip.at." for i in range(COUNT // 100)
+    ]
+
+    t_per_name = best_of(lambda: per_name(names))
+    t_cold = best_of(lambda: PublicIpRecords().build(names))
+
+    stage = PublicIpRecords()
+    stage.build(names)
+
+    def rerun():
+        stage.build(changed)
+        stage.build(names)
+
+    t_rerun = best_of(rerun) / 2
+
+    found = len(PublicIpRecords().build(names))
+    print(f"{COUNT} names, {found} inetip records")
+    print(f"per-name extract_ip_and_domain: {t_per_name * 1000:8.1f} ms "
+          f"({COUNT / t_per_name:,.0f} names/s)")
+    print(f"PublicIpRecords, cold:          {t_cold * 1000:8.1f} ms "
+          f"({COUNT / t_cold:,.0f} names/s)")
+    print(f"PublicIpRecords, 1% changed:    {t_rerun * 1000:8.1f} ms "
+          f"({COUNT / t_rerun:,.0f} names/s)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+"""Binary mmap snapshots vs. JSON for a 500k-record zone.
+
+Two states of a synthetic zone (the second with 1 % of the records changed,
+removed or added) are saved once as JSON (``{name: [type, content, ttl]}``)
+and once as :mod:`hamipat.snapshot` files. Compares:
+
+- diff: JSON load of both + ``ResourceRecord`` dicts + ``diff_records`` vs.
+  opening both snapshots + ``diff_snapshots``;
+- lookup of 1,000 names: JSON load + dict lookups vs. open + binary search.
+
+    python benchmarks/bench_snapshot.py
+"""
+import json
+import os
+import random
+import tempfile
+
+from synthetic import HAMIP_AT, best_of, synthetic_records
+
+from hamipat.records import ResourceRecord
+from hamipat.snapshot import Snapshot, diff_snapshots, write_snapshot
+from hamipat.updater import diff_records
+
+RECORDS = 500_000
+
+
+def states():
+    current = synthetic_records(RECORDS)
+    reference = dict(current)
+    rng = random.Random(7)
+    names = sorted(current)
+    for name in rng.sample(names, RECORDS // 300):
+        del reference[name]
+    for name in rng.sample(names, RECORDS // 300):
+        reference[name] = ResourceRecord("A", "44.143.250.1")
+    for i in range(RECORDS // 300):
+        reference[f"new{i}.oe5xnew{HAMIP_AT}"] = ResourceRecord("A", f"44.143.251.{i % 256}")
+    return current, reference
+
+
+def save_json(records, path):
+    with open(path, "w") as handle:
+        json.dump({n: [r.type, r.content, r.ttl] for n, r in records.items()}, handle)
+
+
+def load_json(path):
+    with open(path) as handle:
+        return {n: ResourceRecord(*v) for n, v in json.load(handle).items()}
+
+
+def main():
+    current, reference = states()
+    probes = random.Random(3).sample(sorted(current), 1000)
+    with tempfile.TemporaryDirectory() as tmp:
+        paths = {}
+        for label, records in (("current", current), ("reference", reference)):
+            paths[label, "json"] = os.path.join(tmp, f"{label}.json")
+            paths[label, "snap"] = os.path.join(tmp, f"{label}.snap")
+            save_json(records, paths[label, "json"])
+            write_snapshot(records, paths[label, "snap"])
+
+        def json_diff():
+            return diff_records(load_json(paths["current", "json"]),
+                                load_json(paths["reference", "json"]))
+
+        def snapshot_diff():
+            with Snapshot(paths["current", "snap"]) as old, \
+                    Snapshot(paths["reference", "snap"]) as new:
+                return diff_snapshots(old, new)
+
+        def json_lookup():
+            records = load_json(paths["current", "json"])
+            return [records[name] for name in probes]
+
+        def snapshot_lookup():
+            with Snapshot(paths["current", "snap"]) as snapshot:
+                return [snapshot[name] for name in probes]
+
+        assert json_diff() == snapshot_diff()
+        assert json_lookup() == snapshot_lookup()
+        print(f"{RECORDS} records; file size JSON "
+              f"{os.path.getsize(paths['current', 'json']) / 2**20:.1f} MiB, snapshot "
+              f"{os.path.getsize(paths['current', 'snap']) / 2**20:.1f} MiB")
+        for label, func in (("diff: JSON load + dict diff", json_diff),
+                            ("diff: mmap snapshots, merge pass", snapshot_diff),
+                            ("1k lookups: JSON load + dict", json_lookup),
+                            ("1k lookups: mmap snapshot", snapshot_lookup)):
+            print(f"{label:34s} {best_of(func, repeat=3) * 1000:9.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
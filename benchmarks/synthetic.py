@@ -0,0 +1,48 @@
+"""Synthetic HamnetDB-like record sets for the benchmarks."""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from hamipat.records import DEFAULT_TTL, ResourceRecord  # noqa: E402
+
+HAMIP_AT = ".hamip.at."
+
+
+def site_for(index):
+    """A plausible site name, spread over the nine regions (oe1..oe9)."""
+    return f"oe{index % 9 + 1}x{index // 9 % 676:03d}"
+
+
+def synthetic_records(count, inetip_every=50):
+    """``count`` records shaped like HamnetDB output.
+
+    Mostly A records for hosts, every fourth name an alias CNAME, and every
+    ``inetip_every``-th name an ``<a-b-c-d>-inetip.<domain>`` host.
+    """
+    records = {}
+    for i in range(count):
+        site = site_for(i)
+        ip = f"44.143.{i // 256 % 256}.{i % 256}"
+        if inetip_every and i % inetip_every == 0:
+            name = f"185-236-{i // 256 % 256:03d}-{i % 256:03d}-inetip.h{i}.{site}{HAMIP_AT}"
+            records[name] = ResourceRecord("A", ip, DEFAULT_TTL)
+        elif i % 4 == 3:
+            records[f"alias{i}.{site}{HAMIP_AT}"] = ResourceRecord(
+                "CNAME", f"h{i - 1}.{site}{HAMIP_AT}", DEFAULT_TTL
+            )
+        else:
+            records[f"h{i}.{site}{HAMIP_AT}"] = ResourceRecord("A", ip, DEFAULT_TTL)
+    return records
+
+
+def best_of(func, repeat=5):
+    """Best wall-clock time of ``repeat`` calls, in seconds."""
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
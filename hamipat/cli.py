@@ -1,32 +1,66 @@
 """Command-line entry point: update the hamip.at zone(s) from HamnetDB."""
+import argparse
 import logging
+import os
 import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 
+from . import profiling
 from .config import (
     DEFAULT_TARGETS,
+    HISTORY_LOCATION,
+    HISTORY_SNAPSHOT_EVERY,
     STATIC_ZONES_LOCATION,
+    TRIGGER_DEBOUNCE,
+    TRIGGER_MAX_DELAY,
     USE_DHCP,
+    ZONE_NAME,
+    ZONE_WORKERS,
     read_api_key,
 )
 from .hamnetdb import HamnetDbClient
-from .powerdns import PowerDnsClient
-from .records import ResourceRecord
+from .history import HistoryError, HistoryStore
+from .notify import SecondaryNotifier, log_reports
+from .plan import ZonePlan, dump_plans, load_plans
+from .powerdns import PowerDnsClient, RrsetEncoder
+from .pubip import PublicIpRecords
+from .ratelimit import RequestBudget, TokenBucket
+from .records import LayeredRecordMap, ResourceRecord
+from .shard import child_zones, split_records
 from .static_records import load_static_records
-from .updater import ZoneUpdater
+from .trigger import SyncScheduler, read_triggers, serve_http
+from .updater import DeltaLimitError, SharedBaseDiff, StalePlanError, ZoneUpdater
+from .validate import validate_records
 
 log = logging.getLogger(__name__)
 
+# Kept for the life of the process so repeated runs only rescan new names.
+_PUBLIC_IP_STAGE = PublicIpRecords()
+
 
 def build_hamnetdb_records(client=None):
     """Build the HamnetDB-derived record set (hosts and, optionally, DHCP)."""
     client = client or HamnetDbClient()
-    records = client.fetch_hosts()
+    with profiling.phase("fetch_hosts"):
+        records = client.fetch_hosts()
     if USE_DHCP:
-        records |= client.fetch_dhcp(records)
+        with profiling.phase("fetch_dhcp"):
+            records |= client.fetch_dhcp(records)
     return records
 
 
+def _validated(source, records):
+    """``records`` minus what :func:`validate_records` quarantines (logged)."""
+    with profiling.phase("validate"):
+        valid, quarantined = validate_records(records)
+    for item in quarantined:
+        log.warning("Quarantined %s record %s %s: %s",
+                    source, item.name, item.record.type, item.reason)
+    return valid
+
+
 def _timestamp_record():
     """A TXT record that changes every run, ensuring the serial advances."""
     now = datetime.now()
@@ -34,28 +68,520 @@ def _timestamp_record():
     return {"timestamp.hamip.at.": ResourceRecord(type="TXT", content=f'"{stamp}"', ttl=60)}
 
 
-def run(targets=DEFAULT_TARGETS, static_path=STATIC_ZONES_LOCATION):
-    """Update every target zone from HamnetDB + static records."""
-    hamnetdb_records = build_hamnetdb_records()
-    static_isp, static_hamnet = load_static_records(static_path)
+def _client_factory(encoder=None):
+    """A factory of per-zone PowerDNS clients sharing one ``encoder``.
+
+    The zones of one target share its rate limiter and write budget.
+    """
+    pacing = {}
+
+    def factory(target, api_key, zone=ZONE_NAME):
+        if target.name not in pacing:
+            limits = target.write_limits
+            pacing[target.name] = (
+                TokenBucket(limits.requests_per_second, limits.burst),
+                RequestBudget(limits.max_requests, limits.max_bytes),
+            )
+        rate_limiter, budget = pacing[target.name]
+        return PowerDnsClient(
+            target.endpoint,
+            api_key,
+            zone=zone,
+            rate_limiter=rate_limiter,
+            budget=budget,
+            encoder=encoder,
+            max_chunk_bytes=target.write_limits.max_body_bytes,
+        )
+
+    return factory
+
 
+def _client_for(target, client_factory, zone=ZONE_NAME):
+    api_key = read_api_key(target.api_key_path)
+    if api_key is None:
+        log.error("Key not found at %s or could not be read.", target.api_key_path)
+        sys.exit(1)
+    return client_factory(target, api_key, zone)
+
+
+def plan(
+    targets=DEFAULT_TARGETS,
+    static_path=STATIC_ZONES_LOCATION,
+    hamnetdb_client=None,
+    client_factory=None,
+    enforce_limits=True,
+    cold_start=False,
+):
+    """Compute the plan for every zone of every target, concurrently, without writing.
+
+    Returns the list of :class:`~hamipat.plan.ZonePlan`, in target and zone
+    order. Raises :class:`~hamipat.updater.DeltaLimitError` if any zone's delta
+    exceeds its target's ``limits`` (unless ``enforce_limits`` is false). An
+    empty zone is only accepted with ``cold_start``. For a target with
+    ``shards``, the forward zone is planned as the parent plus one plan per
+    child zone, and its limits apply to their deltas together. Zones without
+    changes (unchanged child and reverse zones; the forward zone always
+    changes its timestamp) get no plan, so their serials stay and their
+    secondaries are not notified.
+    """
+    hamnetdb_client = hamnetdb_client or HamnetDbClient()
+    hamnetdb_records = _validated("HamnetDB", build_hamnetdb_records(hamnetdb_client))
+    # Public addresses encoded in "<a-b-c-d>-inetip.<domain>" names only
+    # belong in the Internet zone.
+    public_ip_records = _PUBLIC_IP_STAGE.build(hamnetdb_records)
+    log.info("Public-IP records: %d (%d names scanned)",
+             len(public_ip_records), _PUBLIC_IP_STAGE.last_scanned)
+    with profiling.phase("static_load"):
+        static_isp, static_hamnet = load_static_records(static_path)
+    static_isp = _validated("static isp", static_isp)
+    static_hamnet = _validated("static hamnet", static_hamnet)
+    timestamp = _timestamp_record()
+    # Reverse zones are derived from the same host (and DHCP) records.
+    reverse = {
+        zone: hamnetdb_client.build_reverse(hamnetdb_records, zone)
+        for target in targets for zone in target.zones if zone != ZONE_NAME
+    }
+    for zone, records in reverse.items():
+        log.info("Reverse zone %s: %d PTR records", zone, len(records))
+    client_factory = client_factory or _client_factory()
+
+    # Every target's forward reference is the shared HamnetDB base plus a
+    # small per-target overlay; the base is neither copied nor diffed per target.
+    overlays = {
+        target.name: static_hamnet | timestamp if target.is_hamnet
+        else public_ip_records | static_isp | timestamp
+        for target in targets
+    }
+    base_diff = SharedBaseDiff(
+        hamnetdb_records, set().union(*overlays.values()) if overlays else ()
+    )
+
+    # (target, zone, reference, shared base diff, is a child zone, delegations)
+    jobs = []
     for target in targets:
-        api_key = read_api_key(target.api_key_path)
-        if api_key is None:
-            log.error("Key not found at %s or could not be read.", target.api_key_path)
+        for zone in target.zones:
+            if zone != ZONE_NAME:
+                jobs.append((target, zone, reverse[zone], None, False, ()))
+                continue
+            reference = LayeredRecordMap(hamnetdb_records, overlays[target.name])
+            if target.shards is None:
+                jobs.append((target, zone, reference, base_diff, False, ()))
+                continue
+            existing = _client_for(target, client_factory, zone).list_zones()
+            parent, children = split_records(reference, zone, target.shards, existing)
+            log.info("%s zone %s: %d records in the parent, %d child zones",
+                     target.name, zone, len(parent), len(children))
+            delegations = frozenset(child + "." for child in children)
+            jobs.append((target, zone, parent, None, False, delegations))
+            jobs.extend((target, child, records, None, True, ())
+                        for child, records in sorted(children.items()))
+    clients = [_client_for(target, client_factory, zone) for target, zone, *_ in jobs]
+
+    def plan_zone(job, client):
+        target, zone, reference, shared, child, delegations = job
+        log.info("Planning %s zone %s (%s)", target.name, zone, target.endpoint)
+        limits = target.limits if enforce_limits and not _sharded(job) else None
+        # A new child zone starts out empty.
+        updater = ZoneUpdater(
+            client, target.name, limits, shared,
+            bulk_ratio=target.bulk_ratio, allow_empty=cold_start or child,
+            delegations=delegations,
+        )
+        return updater.plan(reference), updater.last_zone_size
+
+    with ThreadPoolExecutor(max_workers=min(max(len(jobs), 1), ZONE_WORKERS)) as pool:
+        results = list(pool.map(plan_zone, jobs, clients))
+    if enforce_limits:
+        _check_sharded_limits(jobs, results)
+    plans = [zone_plan for zone_plan, _ in results]
+    changed = [zone_plan for zone_plan in plans if not zone_plan.is_empty]
+    if len(changed) < len(plans):
+        log.info("%d unchanged zones left alone.", len(plans) - len(changed))
+    return changed
+
+
+def _sharded(job) -> bool:
+    """Whether a plan job is the parent or a child zone of a sharded forward zone."""
+    target, zone, _, _, child, _ = job
+    return target.shards is not None and (child or zone == ZONE_NAME)
+
+
+def _check_sharded_limits(jobs, results):
+    """Check each sharded forward zone's limits over the parent and its child zones.
+
+    Judged together, a record moving between the parent and a child zone is a
+    change rather than a removal, and a site losing all its records is a small
+    part of the zone rather than all of its child zone.
+    """
+    groups = {}
+    for job, (zone_plan, size) in zip(jobs, results):
+        if _sharded(job):
+            groups.setdefault(job[0], []).append((zone_plan, size))
+    for target, members in groups.items():
+        # The parent is planned first; its serial labels the combined plan.
+        combined = ZonePlan(target.name, ZONE_NAME, members[0][0].serial)
+        for zone_plan, _ in members:
+            combined.to_remove.update(zone_plan.to_remove)
+            combined.to_change.update(zone_plan.to_change)
+        ZoneUpdater.check_limits(combined, sum(size for _, size in members), target.limits)
+
+
+def _delegations(target, zone, client):
+    """Names in ``zone`` whose NS records delegate ``target``'s child zones."""
+    if target.shards is None or zone != ZONE_NAME:
+        return frozenset()
+    existing = client.list_zones()
+    return frozenset(child + "." for child in child_zones(existing, zone, target.shards))
+
+
+def _history_for(target, history_dir):
+    return HistoryStore.for_target(
+        history_dir, target.name, snapshot_every=HISTORY_SNAPSHOT_EVERY
+    )
+
+
+def apply_plans(plans, targets=DEFAULT_TARGETS, client_factory=None, history_dir=None,
+                check_serial=False):
+    """Apply previously computed plans to their zones, concurrently (no fetch, no diff).
+
+    With ``check_serial`` (saved plans), every zone's serial is compared with
+    its plan's first and a :class:`~hamipat.updater.StalePlanError` is raised,
+    before anything is written, if any zone changed since. With
+    ``history_dir``, every applied delta is recorded in the target's
+    :class:`~hamipat.history.HistoryStore`. Returns the non-empty deferred
+    plans: what a target's write budget did not allow in this run.
+    """
+    # The targets' deltas mostly hold the same records: encode each rrset once.
+    client_factory = client_factory or _client_factory(RrsetEncoder())
+    by_name = {target.name: target for target in targets}
+    clients = []
+    for zone_plan in plans:
+        target = by_name.get(zone_plan.target)
+        if target is None:
+            log.error("Plan refers to unknown target %r.", zone_plan.target)
             sys.exit(1)
+        clients.append(_client_for(target, client_factory, zone_plan.zone))
+    workers = min(max(len(plans), 1), ZONE_WORKERS)
+    if check_serial:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            list(pool.map(lambda p, c: ZoneUpdater(c, p.target).check_serial(p), plans, clients))
+    histories = {}
+    if history_dir:
+        for zone_plan in plans:
+            if zone_plan.target not in histories:
+                histories[zone_plan.target] = _history_for(by_name[zone_plan.target], history_dir)
+
+    def apply_zone(zone_plan, client):
+        log.info("Updating %s zone %s", zone_plan.target, zone_plan.zone)
+        history = histories.get(zone_plan.target)
+        delegations = ()
+        if history is not None:
+            # The first recorded version is a snapshot of the zone, delegations included.
+            delegations = _delegations(by_name[zone_plan.target], zone_plan.zone, client)
+        updater = ZoneUpdater(client, zone_plan.target, history=history,
+                              delegations=delegations)
+        return updater.apply(zone_plan)
 
-        static = static_hamnet if target.is_hamnet else static_isp
-        reference = hamnetdb_records | static | _timestamp_record()
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            remaining = list(pool.map(apply_zone, plans, clients))
+    finally:
+        for history in histories.values():
+            history.close()
+    return [zone_plan for zone_plan in remaining if not zone_plan.is_empty]
 
-        log.info("Updating %s zone (%s)", target.name, target.endpoint)
-        client = PowerDnsClient(target.endpoint, api_key)
-        ZoneUpdater(client).sync(reference)
 
+def rollback(target, zone, version, history_dir=HISTORY_LOCATION, client_factory=None,
+             enforce_limits=True):
+    """Bring ``zone`` of ``target`` back to ``version`` of its history.
 
-def main():
+    The recorded version is diffed against the live zone, so only the minimal
+    delta is written; the rollback itself is recorded as a new version.
+    Returns ``(plan, deferred)``: the planned :class:`~hamipat.plan.ZonePlan`
+    and the part of it the target's write budget deferred (empty when the
+    rollback is complete).
+    """
+    client_factory = client_factory or _client_factory()
+    history = _history_for(target, history_dir)
+    try:
+        reference = history.version(zone, version)
+        client = _client_for(target, client_factory, zone)
+        limits = target.limits if enforce_limits else None
+        updater = ZoneUpdater(client, target.name, limits, bulk_ratio=target.bulk_ratio,
+                              allow_empty=True, history=history,
+                              delegations=_delegations(target, zone, client))
+        zone_plan = updater.plan(reference)
+        log.info("Rolling %s zone %s back to version %d: %d removals, %d changes",
+                 target.name, zone, version, len(zone_plan.to_remove), len(zone_plan.to_change))
+        deferred = updater.apply(zone_plan)
+        return zone_plan, deferred
+    finally:
+        history.close()
+
+
+def notify_secondaries(plans, targets=DEFAULT_TARGETS, client_factory=None):
+    """NOTIFY the secondaries of every applied zone and wait for the new serial.
+
+    Only targets with ``notify.secondaries`` take part. The new serial is read
+    from the target's API; all zones and secondaries are handled concurrently.
+    Returns ``{(target, zone): [PropagationReport, ...]}``.
+    """
+    client_factory = client_factory or _client_factory()
+    by_name = {target.name: target for target in targets}
+    jobs = [
+        (zone_plan, by_name[zone_plan.target]) for zone_plan in plans
+        if zone_plan.target in by_name and by_name[zone_plan.target].notify.secondaries
+    ]
+
+    def notify_zone(job):
+        zone_plan, target = job
+        serial = _client_for(target, client_factory, zone_plan.zone).fetch_serial()
+        settings = target.notify
+        notifier = SecondaryNotifier(
+            settings.secondaries, settings.deadline, settings.poll_interval, settings.timeout
+        )
+        reports = notifier.notify(zone_plan.zone, serial)
+        log_reports(zone_plan.zone, serial, reports)
+        return (target.name, zone_plan.zone), reports
+
+    with ThreadPoolExecutor(max_workers=max(len(jobs), 1)) as pool:
+        return dict(pool.map(notify_zone, jobs))
+
+
+def run(
+    targets=DEFAULT_TARGETS,
+    static_path=STATIC_ZONES_LOCATION,
+    hamnetdb_client=None,
+    client_factory=None,
+    enforce_limits=True,
+    cold_start=False,
+    history_dir=None,
+):
+    """Update every target zone from HamnetDB + static records.
+
+    Every target is planned before anything is written, so a delta that trips
+    a target's limits leaves all zones as they were. Anything deferred by a
+    write budget is picked up by the next run's diff. Targets with configured
+    secondaries are sent a NOTIFY afterwards.
+    """
+    plans = plan(
+        targets, static_path, hamnetdb_client, client_factory, enforce_limits, cold_start
+    )
+    apply_plans(plans, targets, client_factory, history_dir)
+    notify_secondaries(plans, targets, client_factory)
+    return plans
+
+
+def _parse_args(argv):
+    parser = argparse.ArgumentParser(
+        prog="hamip-update", description="Update the hamip.at zone(s) from HamnetDB."
+    )
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument(
+        "--plan", metavar="FILE",
+        help="compute the changes without applying them; write NDJSON to FILE ('-' for stdout)",
+    )
+    mode.add_argument(
+        "--apply-plan", metavar="FILE",
+        help="apply a plan written by --plan ('-' for stdin) without re-fetching;"
+             " FILE is left as it is (see --deferred-plan)",
+    )
+    mode.add_argument(
+        "--rollback", metavar="VERSION", type=int,
+        help="bring --target's --zone back to VERSION of its history (minimal delta)",
+    )
+    mode.add_argument(
+        "--versions", action="store_true",
+        help="list the recorded versions of --target's --zone",
+    )
+    parser.add_argument("--target", metavar="NAME", help="target for --rollback/--versions")
+    parser.add_argument(
+        "--zone", default=ZONE_NAME, help=f"zone for --rollback/--versions (default {ZONE_NAME})"
+    )
+    parser.add_argument(
+        "--history", metavar="DIR",
+        help="record applied deltas under DIR (off by default; --rollback/--versions"
+             f" read {HISTORY_LOCATION} unless given)",
+    )
+    parser.add_argument(
+        "--listen", metavar="[HOST:]PORT",
+        help="keep running and sync on POST /sync or /sync/TARGET to this address"
+             " (default host 127.0.0.1)",
+    )
+    parser.add_argument(
+        "--trigger-file", metavar="FILE",
+        help="keep running and sync for every line read from FILE, e.g. a FIFO"
+             " ('-' for stdin); a line names targets, empty or 'all' means all",
+    )
+    parser.add_argument(
+        "--debounce", type=float, default=TRIGGER_DEBOUNCE, metavar="SECONDS",
+        help=f"coalesce triggers until none arrived for SECONDS (default {TRIGGER_DEBOUNCE:g})",
+    )
+    parser.add_argument(
+        "--profile", metavar="DIR", default=os.environ.get("HAMIP_PROFILE") or None,
+        help="profile each phase; write per-phase pstats files and merged collapsed"
+             " stacks (profile.collapsed) to DIR (default: $HAMIP_PROFILE)",
+    )
+    parser.add_argument(
+        "--deferred-plan", metavar="FILE",
+        help="with --apply-plan or --rollback: write the part a write budget deferred"
+             " to FILE (only if something was deferred)",
+    )
+    parser.add_argument(
+        "--force", action="store_true",
+        help="with --apply-plan: apply even if a zone changed since the plan was made",
+    )
+    parser.add_argument(
+        "--no-limits", action="store_true",
+        help="apply the delta even if it exceeds the targets' delta limits",
+    )
+    parser.add_argument(
+        "--cold-start", action="store_true",
+        help="accept an empty (new or wiped) zone and fill it in one bulk request;"
+             " usually combined with --no-limits",
+    )
+    args = parser.parse_args(argv)
+    if (args.listen or args.trigger_file) and (
+        args.plan or args.apply_plan or args.rollback is not None or args.versions
+    ):
+        parser.error("--listen/--trigger-file cannot be combined with another mode")
+    if args.deferred_plan and not (args.apply_plan or args.rollback is not None):
+        parser.error("--deferred-plan needs --apply-plan or --rollback")
+    if (args.rollback is not None or args.versions) and not args.target:
+        parser.error("--rollback and --versions need --target")
+    return args
+
+
+def main(argv=None):
+    args = _parse_args(argv)
     logging.basicConfig(level=logging.INFO, format="%(message)s")
-    run()
+    if args.profile:
+        profiling.enable(args.profile)
+    try:
+        _run_mode(args)
+    except DeltaLimitError as exc:
+        log.error("%s", exc)
+        log.error("Delta per type: %s", exc.plan.counts())
+        sys.exit(2)
+    except StalePlanError as exc:
+        log.error("%s (or use --force).", exc)
+        sys.exit(2)
+    finally:
+        profiler = profiling.disable()
+        if profiler is not None:
+            paths = profiler.write()
+            log.info("Profile: %d files written to %s", len(paths), profiler.directory)
+
+
+def _run_mode(args):
+    enforce_limits = not args.no_limits
+    history_dir = args.history
+    if args.rollback is not None or args.versions:
+        _history_mode(args, enforce_limits)
+    elif args.plan:
+        plans = plan(enforce_limits=enforce_limits, cold_start=args.cold_start)
+        if args.plan == "-":
+            dump_plans(plans, sys.stdout)
+        else:
+            with open(args.plan, "w") as handle:
+                dump_plans(plans, handle)
+    elif args.apply_plan:
+        if args.apply_plan == "-":
+            plans = load_plans(sys.stdin)
+        else:
+            with open(args.apply_plan, "r") as handle:
+                plans = load_plans(handle)
+        deferred = apply_plans(plans, history_dir=history_dir, check_serial=not args.force)
+        notify_secondaries(plans)
+        if deferred and not _write_deferred(deferred, args.deferred_plan):
+            removals, changes = _deferred_counts(deferred)
+            log.warning("%d removals and %d changes deferred to the next run.",
+                        removals, changes)
+    elif args.listen or args.trigger_file:
+        _serve_triggers(args, enforce_limits, history_dir)
+    else:
+        run(enforce_limits=enforce_limits, cold_start=args.cold_start, history_dir=history_dir)
+
+
+def _deferred_counts(deferred):
+    return (sum(len(zone_plan.to_remove) for zone_plan in deferred),
+            sum(len(zone_plan.to_change) for zone_plan in deferred))
+
+
+def _write_deferred(deferred, path) -> bool:
+    """Write the deferred plans to ``path`` (``--deferred-plan``), if given."""
+    if not path:
+        return False
+    with open(path, "w") as handle:
+        dump_plans(deferred, handle)
+    log.warning("%d removals and %d changes deferred; written to %s.",
+                *_deferred_counts(deferred), path)
+    return True
+
+
+def _history_mode(args, enforce_limits, targets=DEFAULT_TARGETS):
+    target = {t.name: t for t in targets}.get(args.target)
+    if target is None:
+        log.error("Unknown target %r.", args.target)
+        sys.exit(1)
+    history_dir = args.history or HISTORY_LOCATION
+    try:
+        if args.versions:
+            history = _history_for(target, history_dir)
+            try:
+                for info in history.versions(args.zone):
+                    applied = datetime.fromtimestamp(info.applied_at).isoformat(" ", "seconds")
+                    print(f"{info.version:>6}  {applied}  serial {info.serial}"
+                          f"  -{info.removed} +{info.changed}")
+            finally:
+                history.close()
+        else:
+            _, deferred = rollback(target, args.zone, args.rollback, history_dir,
+                                   enforce_limits=enforce_limits)
+            if not deferred.is_empty:
+                # The next regular sync would not finish a rollback but undo it.
+                _write_deferred([deferred], args.deferred_plan)
+                log.error("Rollback of %s to version %d is incomplete: %d removals and %d"
+                          " changes deferred by the write budget; run --rollback again.",
+                          args.zone, args.rollback, *_deferred_counts([deferred]))
+                sys.exit(1)
+    except HistoryError as exc:
+        log.error("%s", exc)
+        sys.exit(1)
+
+
+def _serve_triggers(args, enforce_limits, history_dir, targets=DEFAULT_TARGETS):
+    """Sync on triggers until the trigger file ends (or forever with --listen)."""
+
+    def sync(due):
+        run(due, enforce_limits=enforce_limits, cold_start=args.cold_start,
+            history_dir=history_dir)
+
+    scheduler = SyncScheduler(sync, targets, args.debounce, TRIGGER_MAX_DELAY)
+    stop = threading.Event()
+    server = None
+    if args.listen:
+        host, _, port = args.listen.rpartition(":")
+        server = serve_http(scheduler, host or "127.0.0.1", int(port))
+    if args.trigger_file:
+
+        def feed():
+            if args.trigger_file == "-":
+                read_triggers(scheduler, sys.stdin)
+            else:
+                with open(args.trigger_file, "r") as handle:
+                    read_triggers(scheduler, handle)
+            if server is None:
+                stop.set()
+
+        threading.Thread(target=feed, daemon=True).start()
+    try:
+        scheduler.run_forever(stop)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if server is not None:
+            server.shutdown()
 
 
 if __name__ == "__main__":
@@ -1,9 +1,12 @@
 """Static configuration and small configuration helpers."""
 import os
 from dataclasses import dataclass
+from typing import Optional, Tuple
 
 # DNS zone served by this tooling.
 ZONE_NAME = "hamip.at"
+# Reverse zone for the Austrian HamNet address space (44.143.0.0/16).
+REVERSE_ZONE_NAME = "143.44.in-addr.arpa"
 # Suffix appended to bare HamnetDB names to form an FQDN (note leading/trailing dot).
 HAMIP_AT = ".hamip.at."
 
@@ -14,25 +17,138 @@ HAMNETDB_SUBNET_URL = "https://hamnetdb.net/csv.cgi?tab=subnet&json=1"
 # Locally maintained static records (YAML with `isp:` and `hamnet:` sections).
 STATIC_ZONES_LOCATION = "/etc/hamip/static_records.yaml"
 
+# Per-target history of applied deltas (one SQLite file per target), with a
+# full snapshot every HISTORY_SNAPSHOT_EVERY versions. Recording is opt-in
+# (--history DIR); --rollback/--versions read from here unless given one.
+HISTORY_LOCATION = "/var/lib/hamip/history"
+HISTORY_SNAPSHOT_EVERY = 100
+
 # Whether to expand HamnetDB DHCP ranges into individual A records.
 USE_DHCP = False
 
+# Above this share of the zone changing (e.g. after enabling USE_DHCP), the
+# delta is applied in one bulk request instead of 500-rrset chunks, on targets
+# that opt in (Target.bulk_ratio).
+BULK_REPLACE_RATIO = 0.5
+
+# Triggered syncs (hamip-update --listen / --trigger-file) start once no
+# trigger arrived for this many seconds, and at most this long after the first.
+TRIGGER_DEBOUNCE = 10.0
+TRIGGER_MAX_DELAY = 60.0
+
+# At most this many zones are planned or applied at once (sharded targets
+# can have hundreds of child zones).
+ZONE_WORKERS = 16
+
+
+@dataclass(frozen=True)
+class DeltaLimits:
+    """Upper bounds on the delta a single sync may apply.
+
+    A sync whose delta exceeds any limit is refused rather than applied, so a
+    truncated-but-parseable HamnetDB response cannot wipe the zone. ``None``
+    disables a limit.
+    """
+
+    # Absolute number of names removed (changed names excluded).
+    max_removals: Optional[int] = None
+    # Names removed as a fraction of the current zone (0.25 = 25 %).
+    max_removal_ratio: Optional[float] = None
+    # Names removed or modified (not added), per record type.
+    max_changes_per_type: Optional[int] = None
+
+
+DEFAULT_DELTA_LIMITS = DeltaLimits(
+    max_removals=250,
+    max_removal_ratio=0.2,
+    max_changes_per_type=1000,
+)
+
+
+@dataclass(frozen=True)
+class WriteLimits:
+    """Pacing and per-run budget for writes to a PowerDNS API.
+
+    When the budget runs out, the rest of the delta is left for the next run.
+    ``None`` disables a limit.
+    """
+
+    requests_per_second: Optional[float] = None
+    burst: int = 1
+    max_requests: Optional[int] = None
+    max_bytes: Optional[int] = None
+    # Largest request body; a bulk delta above it is applied in chunks.
+    max_body_bytes: int = 1024 * 1024
+
+
+@dataclass(frozen=True)
+class NotifySettings:
+    """Secondaries to NOTIFY after a sync, and how long to wait for them.
+
+    ``secondaries`` holds ``(address, port)`` pairs; empty disables the step.
+    """
+
+    secondaries: Tuple[Tuple[str, int], ...] = ()
+    # Seconds from the NOTIFY until a secondary counts as not propagated.
+    deadline: float = 60.0
+    poll_interval: float = 1.0
+    # Per-query timeout.
+    timeout: float = 2.0
+
+
+@dataclass(frozen=True)
+class ShardSettings:
+    """Split the forward zone into one delegated child zone per site.
+
+    Every site whose label starts with one of ``regions`` (``oe3xnr`` for
+    ``oe3``) and whose zone ``<site>.hamip.at`` exists on the target is served
+    from that child zone. The parent delegates every child to ``nameservers``,
+    ``(name, address)`` pairs (RFC 1034 asks for at least two); ``address`` is
+    the glue A record of a nameserver inside the zone, or ``None``.
+    """
+
+    nameservers: Tuple[Tuple[str, Optional[str]], ...]
+    regions: Tuple[str, ...] = tuple(f"oe{digit}" for digit in range(1, 10))
+    ttl: int = 3600
+
 
 @dataclass(frozen=True)
 class Target:
-    """A PowerDNS instance to update."""
+    """A PowerDNS instance to update, and the zones it serves.
+
+    ``zones`` may hold the forward zone (``ZONE_NAME``) and ``in-addr.arpa``
+    reverse zones (e.g. ``REVERSE_ZONE_NAME``); all are built from the same
+    HamnetDB pass. To add a reverse zone, create it in PowerDNS, list it
+    here, then run ``hamip-update --cold-start --no-limits`` once to fill it.
+    PTR records are only managed in ``in-addr.arpa`` zones. With ``shards``
+    (a :class:`ShardSettings`) the forward zone is split into per-site child
+    zones.
+    """
 
     name: str
     endpoint: str
     api_key_path: str
     is_hamnet: bool
+    limits: DeltaLimits = DEFAULT_DELTA_LIMITS
+    write_limits: WriteLimits = WriteLimits()
+    bulk_ratio: Optional[float] = None
+    zones: Tuple[str, ...] = (ZONE_NAME,)
+    notify: NotifySettings = NotifySettings()
+    shards: Optional[ShardSettings] = None
 
 
+# The ISP API is shared infrastructure: pace writes and cap each run.
 ISP_TARGET = Target(
     name="ISP",
     endpoint="https://dnsapi.netplanet.at/api",
     api_key_path="/etc/hamip/key.asc",
     is_hamnet=False,
+    write_limits=WriteLimits(
+        requests_per_second=2.0,
+        burst=4,
+        max_requests=100,
+        max_bytes=8 * 1024 * 1024,
+    ),
 )
 
 HAMNET_TARGET = Target(
@@ -40,6 +156,9 @@ HAMNET_TARGET = Target(
     endpoint="http://127.0.0.1:8081/api",
     api_key_path="/etc/hamip/key_hamnet.asc",
     is_hamnet=True,
+    # The local instance accepts large bodies (webserver-max-bodysize=64).
+    write_limits=WriteLimits(max_body_bytes=64 * 1024 * 1024),
+    bulk_ratio=BULK_REPLACE_RATIO,
 )
 
 DEFAULT_TARGETS = (ISP_TARGET, HAMNET_TARGET)
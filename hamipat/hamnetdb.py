@@ -4,8 +4,9 @@ import logging
 
 import requests
 
-from .config import HAMIP_AT, HAMNETDB_HOST_URL, HAMNETDB_SUBNET_URL
-from .records import DEFAULT_TTL, RecordMap, ResourceRecord
+from . import profiling
+from .config import HAMIP_AT, HAMNETDB_HOST_URL, HAMNETDB_SUBNET_URL, REVERSE_ZONE_NAME
+from .records import DEFAULT_TTL, RecordMap, ResourceRecord, ipv4_to_int
 
 log = logging.getLogger(__name__)
 
@@ -84,6 +85,43 @@ class HamnetDbClient:
 
         return dhcp
 
+    def build_reverse(self, records: RecordMap, zone: str = REVERSE_ZONE_NAME) -> RecordMap:
+        """PTR records for the ``A`` records in ``records`` that fall in ``zone``.
+
+        ``records`` is the forward record set (hosts and, optionally, DHCP), so
+        the reverse zone needs no second HamnetDB download. Addresses are
+        indexed as integers; when several names share an address, the first
+        one wins (hosts come before DHCP names). ``-inetip.`` names are skipped.
+        """
+        prefix, shift = self._reverse_prefix(zone)
+        index = {}
+        for name, record in records.items():
+            if record.type != "A" or "-inetip." in name:
+                continue
+            address = ipv4_to_int(record.content)
+            if address is None or address >> shift != prefix:
+                continue
+            index.setdefault(address, name)
+
+        suffix = "." + zone.rstrip(".") + "."
+        host_octets = shift // 8
+        reverse: RecordMap = {}
+        for address in sorted(index):
+            labels = [str(address >> (8 * i) & 0xFF) for i in range(host_octets)]
+            reverse[".".join(labels) + suffix] = ResourceRecord("PTR", index[address], DEFAULT_TTL)
+        return reverse
+
+    @staticmethod
+    def _reverse_prefix(zone: str):
+        """``(prefix, shift)`` such that ``address >> shift == prefix`` in ``zone``."""
+        labels = zone.rstrip(".").split(".")
+        if labels[-2:] != ["in-addr", "arpa"] or not 1 <= len(labels) - 2 <= 3:
+            raise ValueError(f"Not an IPv4 reverse zone: {zone}")
+        prefix = 0
+        for label in reversed(labels[:-2]):
+            prefix = prefix << 8 | int(label)
+        return prefix, 32 - 8 * (len(labels) - 2)
+
     # -- host helpers -------------------------------------------------------
 
     def _add_host(self, records: RecordMap, entry: dict):
@@ -176,6 +214,7 @@ class HamnetDbClient:
     # -- http ---------------------------------------------------------------
 
     def _get_json(self, url):
-        response = self.session.get(url)
-        response.raise_for_status()
-        return response.json()
+        with profiling.phase("hamnetdb_fetch"):
+            response = self.session.get(url)
+            response.raise_for_status()
+            return response.json()
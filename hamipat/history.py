@@ -0,0 +1,188 @@
+"""Versioned history of the deltas applied to a target's zones.
+
+One SQLite file per :class:`~hamipat.config.Target` holds, per zone, every
+applied ``(to_remove, to_change)`` delta as a new version plus a full snapshot
+every ``snapshot_every`` versions. Rows are append-only; deltas are stored as
+zlib-compressed, sorted JSON. Snapshots are :mod:`~hamipat.snapshot` files in
+a directory beside the SQLite file (``ISP.sqlite3`` -> ``ISP.snapshots/``),
+listed in the ``snapshots`` table. A version is reconstructed from the nearest
+snapshot at or below it and at most ``snapshot_every - 1`` deltas.
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from dataclasses import dataclass
+from typing import List, Optional
+
+from .records import RecordMap, ResourceRecord
+from .snapshot import Snapshot, write_snapshot
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS deltas (
+    zone TEXT NOT NULL,
+    version INTEGER NOT NULL,
+    applied_at REAL NOT NULL,
+    serial INTEGER,
+    removed INTEGER NOT NULL,
+    changed INTEGER NOT NULL,
+    data BLOB NOT NULL,
+    PRIMARY KEY (zone, version)
+);
+CREATE TABLE IF NOT EXISTS snapshots (
+    zone TEXT NOT NULL,
+    version INTEGER NOT NULL,
+    file TEXT NOT NULL,
+    PRIMARY KEY (zone, version)
+);
+"""
+
+
+class HistoryError(Exception):
+    """Raised for a version that is not in the history."""
+
+
+@dataclass(frozen=True)
+class VersionInfo:
+    """One entry of the history: the delta that produced ``version``.
+
+    ``serial`` is the zone's SOA serial once the delta was applied.
+    """
+
+    version: int
+    applied_at: float
+    serial: Optional[int]
+    removed: int
+    changed: int
+
+
+class HistoryStore:
+    """Append-only zone history of one target (see module docstring).
+
+    Version 0 of a zone is a snapshot of the zone before the first recorded
+    delta (:meth:`start`); version ``n`` is the zone after the ``n``-th one.
+    Safe to share between the threads syncing the target's zones.
+    """
+
+    def __init__(self, path: str, snapshot_every: int = 100, clock=time.time):
+        self.path = path
+        self.snapshot_every = max(snapshot_every, 1)
+        self.clock = clock
+        self.snapshot_dir = os.path.splitext(path)[0] + ".snapshots"
+        os.makedirs(self.snapshot_dir, exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.executescript(_SCHEMA)
+
+    @classmethod
+    def for_target(cls, directory: str, target_name: str, **kwargs) -> "HistoryStore":
+        os.makedirs(directory, exist_ok=True)
+        return cls(os.path.join(directory, f"{target_name}.sqlite3"), **kwargs)
+
+    def close(self):
+        self._db.close()
+
+    # -- writes -------------------------------------------------------------
+
+    def start(self, zone: str, records: RecordMap):
+        """Record ``records`` as version 0 of ``zone`` unless it has a history."""
+        with self._lock, self._db:
+            if self._latest(zone) is None:
+                self._snapshot(zone, 0, records)
+
+    def record(self, zone: str, to_remove: RecordMap, to_change: RecordMap,
+               serial: Optional[int] = None) -> int:
+        """Append an applied delta as the next version of ``zone``; returns it.
+
+        ``zone`` must have been :meth:`start`-ed.
+        """
+        with self._lock, self._db:
+            latest = self._latest(zone)
+            if latest is None:
+                raise HistoryError(f"No history for {zone}; start() it first")
+            version = latest + 1
+            self._db.execute(
+                "INSERT INTO deltas VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (zone, version, self.clock(), serial, len(to_remove), len(to_change),
+                 _pack_delta(to_remove, to_change)),
+            )
+            if version % self.snapshot_every == 0:
+                self._snapshot(zone, version, self._reconstruct(zone, version))
+            return version
+
+    def record_applied(self, plan, deferred, serial: Optional[int]) -> int:
+        """Append the part of ``plan`` that was applied (``plan`` minus ``deferred``).
+
+        ``serial`` is the zone's serial after the apply, i.e. that of the new version.
+        """
+        to_remove = {n: r for n, r in plan.to_remove.items() if n not in deferred.to_remove}
+        to_change = {n: r for n, r in plan.to_change.items() if n not in deferred.to_change}
+        return self.record(plan.zone, to_remove, to_change, serial)
+
+    # -- reads --------------------------------------------------------------
+
+    def latest_version(self, zone: str) -> Optional[int]:
+        """The newest version of ``zone``, or ``None`` if it has no history."""
+        with self._lock:
+            return self._latest(zone)
+
+    def version(self, zone: str, number: int) -> RecordMap:
+        """The records of ``zone`` at version ``number``."""
+        with self._lock:
+            latest = self._latest(zone)
+            if latest is None or not 0 <= number <= latest:
+                raise HistoryError(f"{zone} has no version {number} (latest: {latest})")
+            return self._reconstruct(zone, number)
+
+    def versions(self, zone: str) -> List[VersionInfo]:
+        """Every recorded delta of ``zone``, oldest first."""
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT version, applied_at, serial, removed, changed FROM deltas"
+                " WHERE zone = ? ORDER BY version", (zone,),
+            )
+            return [VersionInfo(*row) for row in rows]
+
+    def _latest(self, zone) -> Optional[int]:
+        delta, snapshot = self._db.execute(
+            "SELECT (SELECT MAX(version) FROM deltas WHERE zone = ?),"
+            " (SELECT MAX(version) FROM snapshots WHERE zone = ?)", (zone, zone),
+        ).fetchone()
+        return delta if delta is not None else snapshot
+
+    def _snapshot(self, zone, version, records: RecordMap):
+        # The file is written first: a snapshot row always has its file.
+        file = f"{zone}.{version}.hips"
+        write_snapshot(records, os.path.join(self.snapshot_dir, file))
+        self._db.execute("INSERT INTO snapshots VALUES (?, ?, ?)", (zone, version, file))
+
+    def _reconstruct(self, zone, number) -> RecordMap:
+        base, file = self._db.execute(
+            "SELECT version, file FROM snapshots WHERE zone = ? AND version <= ?"
+            " ORDER BY version DESC LIMIT 1", (zone, number),
+        ).fetchone()
+        with Snapshot(os.path.join(self.snapshot_dir, file)) as snapshot:
+            records = dict(snapshot.items())
+        for (data,) in self._db.execute(
+            "SELECT data FROM deltas WHERE zone = ? AND version > ? AND version <= ?"
+            " ORDER BY version", (zone, base, number),
+        ):
+            removed, changed = json.loads(zlib.decompress(data))
+            for name in removed:
+                records.pop(name, None)
+            for name, rrtype, content, ttl in changed:
+                records[name] = ResourceRecord(rrtype, content, ttl)
+        return records
+
+
+# Removed names need no record: a delta is [[names removed], [[name, type,
+# content, ttl] changed]].
+
+def _pack_delta(to_remove: RecordMap, to_change: RecordMap) -> bytes:
+    rows = [
+        [name, record.type, record.content, record.ttl]
+        for name, record in sorted(to_change.items())
+    ]
+    return zlib.compress(json.dumps([sorted(to_remove), rows], separators=(",", ":")).encode())
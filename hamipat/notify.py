@@ -0,0 +1,139 @@
+"""DNS NOTIFY fan-out to secondaries and SOA-serial propagation tracking."""
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import List, Optional, Sequence, Tuple
+
+import dns.exception
+import dns.flags
+import dns.message
+import dns.opcode
+import dns.query
+import dns.rcode
+import dns.rdataclass
+import dns.rdatatype
+
+log = logging.getLogger(__name__)
+
+
+def serial_reached(serial: int, target: int) -> bool:
+    """Whether SOA ``serial`` is at or past ``target`` (RFC 1982 arithmetic)."""
+    return (serial - target) % 2**32 < 2**31
+
+
+@dataclass
+class PropagationReport:
+    """What one secondary did after the NOTIFY.
+
+    ``latency`` is the time from the NOTIFY until the secondary served the new
+    serial, or ``None`` if it did not within the deadline. ``serial`` is the
+    last serial seen, ``error`` the last failure.
+    """
+
+    address: str
+    port: int
+    notified: bool = False
+    serial: Optional[int] = None
+    latency: Optional[float] = None
+    error: Optional[str] = None
+
+    @property
+    def converged(self) -> bool:
+        return self.latency is not None
+
+
+class SecondaryNotifier:
+    """Sends NOTIFY for a zone to secondaries in parallel and waits for them.
+
+    Each secondary is handled on its own thread: NOTIFY over UDP (sent up to
+    ``NOTIFY_ATTEMPTS`` times until acknowledged), then SOA queries every
+    ``poll_interval`` seconds until it serves the expected serial or the
+    deadline passes. ``clock`` and ``sleep`` are injectable.
+    """
+
+    NOTIFY_ATTEMPTS = 3
+
+    def __init__(self, secondaries: Sequence[Tuple[str, int]], deadline: float = 60.0,
+                 poll_interval: float = 1.0, timeout: float = 2.0,
+                 clock=time.monotonic, sleep=time.sleep):
+        self.secondaries = list(secondaries)
+        self.deadline = deadline
+        self.poll_interval = poll_interval
+        self.timeout = timeout
+        self.clock = clock
+        self.sleep = sleep
+
+    def notify(self, zone: str, serial: int) -> List[PropagationReport]:
+        """NOTIFY every secondary of ``zone`` and wait for ``serial``.
+
+        Returns one report per secondary, in configuration order.
+        """
+        if not self.secondaries:
+            return []
+        started = self.clock()
+        with ThreadPoolExecutor(max_workers=len(self.secondaries)) as pool:
+            futures = [
+                pool.submit(self._propagate, zone, serial, address, port, started)
+                for address, port in self.secondaries
+            ]
+            return [future.result() for future in futures]
+
+    def _propagate(self, zone, serial, address, port, started) -> PropagationReport:
+        report = PropagationReport(address, port)
+        stop = started + self.deadline
+        for _ in range(self.NOTIFY_ATTEMPTS):
+            if report.notified or self.clock() >= stop:
+                break
+            try:
+                report.notified = self._send_notify(zone, address, port, stop)
+            except (dns.exception.DNSException, OSError) as exc:
+                report.error = f"NOTIFY: {exc}"
+        while True:
+            try:
+                report.serial = self._query_serial(zone, address, port, stop)
+            except (dns.exception.DNSException, OSError) as exc:
+                report.error = f"SOA: {exc}"
+            if report.serial is not None and serial_reached(report.serial, serial):
+                report.latency = self.clock() - started
+                return report
+            if self.clock() + self.poll_interval > stop:
+                return report
+            self.sleep(self.poll_interval)
+
+    def _send_notify(self, zone, address, port, stop) -> bool:
+        message = dns.message.make_query(zone, dns.rdatatype.SOA)
+        message.flags = dns.flags.AA
+        message.set_opcode(dns.opcode.NOTIFY)  # after the flags, which hold the opcode
+        response = dns.query.udp(message, address, port=port, timeout=self._timeout(stop))
+        if response.rcode() != dns.rcode.NOERROR:
+            raise dns.exception.DNSException(
+                f"answered {dns.rcode.to_text(response.rcode())}"
+            )
+        return True
+
+    def _query_serial(self, zone, address, port, stop) -> Optional[int]:
+        query = dns.message.make_query(zone, dns.rdatatype.SOA)
+        query.flags = 0  # ask the secondary itself, no recursion
+        response = dns.query.udp(query, address, port=port, timeout=self._timeout(stop))
+        for rrset in response.answer:
+            if rrset.rdtype == dns.rdatatype.SOA and rrset.rdclass == dns.rdataclass.IN:
+                return rrset[0].serial
+        return None
+
+    def _timeout(self, stop) -> float:
+        return max(min(self.timeout, stop - self.clock()), 0.01)
+
+
+def log_reports(zone: str, serial: int, reports: List[PropagationReport]):
+    """Log per-secondary propagation latency for ``zone``."""
+    for report in reports:
+        node = f"{report.address}:{report.port}"
+        if report.converged:
+            log.info("%s: %s at serial %d after %.2f s", zone, node, serial, report.latency)
+        else:
+            log.warning(
+                "%s: %s not at serial %d by the deadline (last seen %s, notified: %s%s)",
+                zone, node, serial, report.serial, report.notified,
+                f", {report.error}" if report.error else "",
+            )
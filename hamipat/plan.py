@@ -0,0 +1,106 @@
+"""Zone change plans: a computed delta that can be saved and applied later.
+
+A :class:`ZonePlan` is what :meth:`~hamipat.updater.ZoneUpdater.plan` computes
+for one zone of one target: the records to remove and the records to add or
+change. Plans are serialized as NDJSON, one compact JSON object per line and
+zone, so a plan can be reviewed (``hamip-update --plan``) and then applied
+verbatim (``hamip-update --apply-plan``) without re-fetching and re-diffing.
+"""
+import json
+from dataclasses import dataclass, field
+from typing import Dict, Iterable, List, Optional
+
+from .records import RecordMap, ResourceRecord
+
+
+@dataclass
+class ZonePlan:
+    """The delta for one zone of one target.
+
+    ``to_remove`` maps names to the *current* records that are deleted (this
+    includes names whose record changes); ``to_change`` maps names to the
+    records that are (re)applied afterwards. ``bulk`` asks for the whole delta
+    to be applied in one request rather than in chunks.
+    """
+
+    target: str
+    zone: str
+    serial: Optional[int] = None
+    to_remove: RecordMap = field(default_factory=dict)
+    to_change: RecordMap = field(default_factory=dict)
+    bulk: bool = False
+
+    @property
+    def is_empty(self) -> bool:
+        return not self.to_remove and not self.to_change
+
+    def counts(self) -> Dict[str, Dict[str, int]]:
+        """Number of removals and changes per record type."""
+        counts: Dict[str, Dict[str, int]] = {}
+        for key, records in (("remove", self.to_remove), ("change", self.to_change)):
+            for record in records.values():
+                per_type = counts.setdefault(record.type, {"remove": 0, "change": 0})
+                per_type[key] += 1
+        return counts
+
+    def changes(self) -> List[dict]:
+        """Per-name ``before``/``after`` entries, sorted by name."""
+        names = sorted(set(self.to_remove) | set(self.to_change))
+        return [
+            {
+                "name": name,
+                "before": _encode(self.to_remove.get(name)),
+                "after": _encode(self.to_change.get(name)),
+            }
+            for name in names
+        ]
+
+    def to_dict(self) -> dict:
+        return {
+            "target": self.target,
+            "zone": self.zone,
+            "serial": self.serial,
+            "bulk": self.bulk,
+            "counts": self.counts(),
+            "changes": self.changes(),
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "ZonePlan":
+        plan = cls(
+            target=data["target"],
+            zone=data["zone"],
+            serial=data.get("serial"),
+            bulk=data.get("bulk", False),
+        )
+        for change in data.get("changes", []):
+            name = change["name"]
+            if change.get("before") is not None:
+                plan.to_remove[name] = _decode(change["before"])
+            if change.get("after") is not None:
+                plan.to_change[name] = _decode(change["after"])
+        return plan
+
+
+def dump_plans(plans: Iterable[ZonePlan], handle):
+    """Write ``plans`` to ``handle`` as NDJSON (one zone per line)."""
+    for plan in plans:
+        handle.write(json.dumps(plan.to_dict(), separators=(",", ":")))
+        handle.write("\n")
+
+
+def load_plans(handle) -> List[ZonePlan]:
+    """Read plans written by :func:`dump_plans`."""
+    return [ZonePlan.from_dict(json.loads(line)) for line in handle if line.strip()]
+
+
+def _encode(record: Optional[ResourceRecord]):
+    # Compact positional form: [type, content, ttl].
+    if record is None:
+        return None
+    return [record.type, record.content, record.ttl]
+
+
+def _decode(value) -> ResourceRecord:
+    rrtype, content, ttl = value
+    return ResourceRecord(rrtype, content, ttl)
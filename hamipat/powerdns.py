@@ -1,10 +1,15 @@
 """Client for the PowerDNS authoritative HTTP API."""
 import json
 import logging
+from bisect import bisect_right
+from itertools import accumulate
+from json.encoder import encode_basestring_ascii as _json_string
+from typing import Collection
 
 import requests
 
 from .config import ZONE_NAME
+from .ratelimit import BudgetExhausted, RequestBudget, TokenBucket, retry_after
 from .records import RecordMap, ResourceRecord
 
 log = logging.getLogger(__name__)
@@ -14,18 +19,98 @@ class PowerDnsError(Exception):
     """Raised when the PowerDNS API returns an unexpected response."""
 
 
+# A PATCH body is these bytes around the comma-separated rrsets; the result is
+# byte-for-byte what json.dumps({"rrsets": [...]}) produces.
+_PATCH_HEAD = b'{"rrsets": ['
+_PATCH_SEP = b", "
+_PATCH_TAIL = b"]}"
+
+
+# Strings are quoted by json's own (C) escaper, as json.dumps would.
+_DELETE_TEMPLATE = '{"name": %s, "type": %s, "changetype": "DELETE"}'
+_REPLACE_TEMPLATE = (
+    '{"name": %s, "type": %s, "ttl": %d, "changetype": "REPLACE", "records": [%s]}'
+)
+_RECORD_TEMPLATE = '{"content": %s, "disabled": false}'
+
+# A record of these types stands for its whole rrset: the content lists the
+# rrset's records, sorted and space-separated.
+RRSET_TYPES = ("NS",)
+
+
+class RrsetEncoder:
+    """Encodes rrset patch entries to JSON bytes, memoized by record value.
+
+    The ISP and HamNet deltas mostly consist of the same HamnetDB records;
+    sharing one encoder between the clients of a run encodes each rrset once.
+    DELETEs are keyed by name and type only (their content is not sent). The
+    output is byte-for-byte what ``json.dumps`` makes of the PowerDNS rrset
+    object (``name``, ``type``, ``changetype`` and, for REPLACE, ``ttl`` and
+    ``records``, in the order of the templates above).
+    """
+
+    def __init__(self):
+        self._cache = {}
+
+    def encode(self, name, record: ResourceRecord, delete: bool) -> bytes:
+        key = (name, record.type) if delete else (name, record.type, record.content, record.ttl)
+        data = self._cache.get(key)
+        if data is None:
+            if delete:
+                text = _DELETE_TEMPLATE % (_json_string(name), _json_string(record.type))
+            else:
+                if record.type in RRSET_TYPES:
+                    records = ", ".join(
+                        _RECORD_TEMPLATE % _json_string(c) for c in record.content.split(" ")
+                    )
+                else:
+                    records = _RECORD_TEMPLATE % _json_string(record.content)
+                text = _REPLACE_TEMPLATE % (
+                    _json_string(name), _json_string(record.type), record.ttl, records,
+                )
+            data = self._cache[key] = text.encode()
+        return data
+
+    def __len__(self):
+        return len(self._cache)
+
+
 class PowerDnsClient:
-    """Thin object wrapper around the PowerDNS zone API for a single zone."""
+    """Thin object wrapper around the PowerDNS zone API for a single zone.
+
+    Writes are paced by ``rate_limiter`` (a :class:`~hamipat.ratelimit.TokenBucket`)
+    and capped by ``budget`` (a :class:`~hamipat.ratelimit.RequestBudget`); both
+    default to unlimited. Responses with a status in ``RETRY_STATUSES`` are
+    retried up to ``max_retries`` times, waiting for ``Retry-After`` or else an
+    exponential backoff starting at ``backoff`` seconds.
 
-    # Record types this tooling manages; SOA/NS and others are left untouched.
-    MANAGED_TYPES = ("A", "CNAME", "TXT")
+    A PATCH carries at most ``chunk_size`` rrsets and, unless a single rrset is
+    larger, at most ``max_chunk_bytes`` bytes. Rrsets are encoded by
+    ``encoder``, an :class:`RrsetEncoder` that may be shared between clients.
+    """
 
-    def __init__(self, endpoint, api_key, zone=ZONE_NAME, session=None, chunk_size=500):
+    # Record types this tooling manages; SOA, the apex NS and others are left
+    # untouched (NS records only where they delegate sharded child zones).
+    MANAGED_TYPES = ("A", "CNAME", "TXT", "NS")
+    # Also managed in reverse zones only; elsewhere such rrsets are not ours.
+    REVERSE_TYPES = ("PTR",)
+    # Responses that mean "slow down and try again".
+    RETRY_STATUSES = (429, 503)
+
+    def __init__(self, endpoint, api_key, zone=ZONE_NAME, session=None, chunk_size=500,
+                 rate_limiter=None, budget=None, max_retries=5, backoff=1.0,
+                 encoder=None, max_chunk_bytes=1024 * 1024):
         self.endpoint = endpoint.rstrip("/")
         self.api_key = api_key
         self.zone = zone
         self.session = session or requests
         self.chunk_size = chunk_size
+        self.rate_limiter = rate_limiter or TokenBucket()
+        self.budget = budget or RequestBudget()
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.encoder = encoder if encoder is not None else RrsetEncoder()
+        self.max_chunk_bytes = max_chunk_bytes
 
     @property
     def zone_url(self):
@@ -48,39 +133,163 @@ class PowerDnsClient:
             )
         return response.json()
 
-    @classmethod
-    def parse_records(cls, zone: dict) -> RecordMap:
-        """Extract the managed records from a raw zone document."""
+    def list_zones(self):
+        """Names of all zones on the server, without the trailing dot."""
+        response = self.session.get(
+            f"{self.endpoint}/v1/servers/localhost/zones", headers=self._headers()
+        )
+        if not response.ok:
+            raise PowerDnsError(
+                f"Error listing zones ({response.status_code}): {response.text}"
+            )
+        return [zone["name"].rstrip(".") for zone in response.json()]
+
+    @property
+    def managed_types(self):
+        """``MANAGED_TYPES``, plus ``REVERSE_TYPES`` in an ``in-addr.arpa`` zone."""
+        if f".{self.zone.rstrip('.')}".endswith(".in-addr.arpa"):
+            return self.MANAGED_TYPES + self.REVERSE_TYPES
+        return self.MANAGED_TYPES
+
+    def parse_records(self, zone: dict, delegations: Collection[str] = ()) -> RecordMap:
+        """Extract the :attr:`managed_types` records from a raw zone document.
+
+        NS records are only managed at ``delegations``, the names (with the
+        trailing dot) of the child zones this tooling delegates. An rrset of
+        one of ``RRSET_TYPES`` becomes a single record listing all its
+        contents; of other rrsets, the last record is kept.
+        """
+        managed = self.managed_types
         records: RecordMap = {}
         for rrset in zone.get("rrsets", []):
             rrtype = rrset.get("type")
-            if rrtype not in cls.MANAGED_TYPES:
+            if rrtype not in managed:
                 continue
             name = rrset.get("name")
-            ttl = rrset.get("ttl")
-            for record in rrset.get("records", []):
-                records[name] = ResourceRecord(rrtype, record.get("content"), ttl)
+            if rrtype == "NS" and name not in delegations:
+                continue
+            contents = [record.get("content") for record in rrset.get("records", [])]
+            if not contents:
+                continue
+            content = " ".join(sorted(contents)) if rrtype in RRSET_TYPES else contents[-1]
+            records[name] = ResourceRecord(rrtype, content, rrset.get("ttl"))
         return records
 
-    def fetch_records(self) -> RecordMap:
-        return self.parse_records(self.fetch_zone())
+    def fetch_records(self, delegations: Collection[str] = ()) -> RecordMap:
+        return self.parse_records(self.fetch_zone(), delegations)
+
+    def fetch_serial(self) -> int:
+        """Return the zone's SOA serial (the zone document without rrsets)."""
+        response = self.session.get(
+            self.zone_url, headers=self._headers(), params={"rrsets": "false"}
+        )
+        if not response.ok:
+            raise PowerDnsError(
+                f"Error fetching zone serial ({response.status_code}): {response.text}"
+            )
+        return response.json()["serial"]
 
     # -- writes -------------------------------------------------------------
 
-    def replace_records(self, records: RecordMap):
-        """REPLACE (add/update) the given records, in chunks."""
-        self._patch(records, delete=False)
+    def replace_records(self, records: RecordMap) -> RecordMap:
+        """REPLACE (add/update) the given records, in chunks.
+
+        Returns the records that were not sent because the budget ran out.
+        """
+        return self._patch(records, delete=False)
+
+    def delete_records(self, records: RecordMap) -> RecordMap:
+        """DELETE the given records, in chunks.
+
+        Returns the records that were not sent because the budget ran out.
+        """
+        return self._patch(records, delete=True)
+
+    def apply_delta(self, to_remove: RecordMap, to_change: RecordMap):
+        """Apply a whole delta in chunks, never leaving a changed name missing.
+
+        Names that are only removed are deleted first. A changed name's
+        REPLACE travels in the same PATCH as the DELETE of its old record, and
+        that DELETE is only sent when the type changes (a REPLACE of the same
+        type overwrites). If the budget runs out, every name is either as it
+        was or as planned.
+
+        Returns the ``(to_remove, to_change)`` maps that were not sent because
+        the budget ran out (both empty on success).
+        """
+        encode = self.encoder.encode
+        removed = [name for name in to_remove if name not in to_change]
+        units = [encode(name, to_remove[name], True) for name in removed]
+        counts = [1] * len(units)
+        changed = list(to_change)
+        for name in changed:
+            record = to_change[name]
+            old = to_remove.get(name)
+            if old is not None and old.type != record.type:
+                units.append(encode(name, old, True) + _PATCH_SEP + encode(name, record, False))
+                counts.append(2)
+            else:
+                units.append(encode(name, record, False))
+                counts.append(1)
+        sent = self._send_units(units, counts)
+        if sent == len(units):
+            return {}, {}
+        deferred_remove = {name: to_remove[name] for name in removed[sent:]}
+        deferred_change = {}
+        for name in changed[max(sent - len(removed), 0):]:
+            deferred_change[name] = to_change[name]
+            if name in to_remove:
+                deferred_remove[name] = to_remove[name]
+        log.warning("%d removals and %d changes deferred to the next run.",
+                    len(deferred_remove), len(deferred_change))
+        return deferred_remove, deferred_change
+
+    def apply_bulk(self, to_remove: RecordMap, to_change: RecordMap):
+        """Apply a whole delta as a single PATCH.
+
+        PowerDNS applies one PATCH as one transaction, so the zone never shows
+        a half-applied delta. Deletes come first. A delete is dropped when the
+        same name and type is REPLACEd anyway, because PowerDNS rejects a patch
+        that names an rrset twice. SOA and the apex NS are never part of the delta.
 
-    def delete_records(self, records: RecordMap):
-        """DELETE the given records, in chunks."""
-        self._patch(records, delete=True)
+        A body larger than ``max_chunk_bytes`` or than what is left of the
+        budget would never be accepted, so such a delta falls back to
+        :meth:`apply_delta` (chunks) and makes progress every run.
+
+        Returns the ``(to_remove, to_change)`` maps that were not sent because
+        the budget ran out (both empty on success).
+        """
+        encode = self.encoder.encode
+        replaced = {(name, record.type) for name, record in to_change.items()}
+        rrsets = [
+            encode(name, record, True)
+            for name, record in to_remove.items()
+            if (name, record.type) not in replaced
+        ]
+        rrsets.extend(encode(name, record, False) for name, record in to_change.items())
+        if not rrsets:
+            return {}, {}
+        size = len(_PATCH_HEAD) + len(_PATCH_TAIL) + sum(map(len, rrsets)) \
+            + len(_PATCH_SEP) * (len(rrsets) - 1)
+        if size > self.max_chunk_bytes or not self.budget.allows(size):
+            log.info("Bulk body of %d bytes exceeds the body size cap or the budget;"
+                     " applying the delta in chunks.", size)
+            return self.apply_delta(to_remove, to_change)
+        try:
+            self._send_patch(rrsets)
+        except BudgetExhausted as exc:
+            log.warning("%s; bulk update of %d rrsets deferred to the next run.", exc, len(rrsets))
+            return dict(to_remove), dict(to_change)
+        return {}, {}
 
     def increase_serial(self):
-        """Bump the zone's SOA serial via the API."""
+        """Bump the zone's SOA serial via the API.
+
+        This request is paced but not charged to the budget: it publishes
+        whatever was applied, even when the budget is spent.
+        """
         payload = {"soa_edit_api": "INCREASE"}
-        response = self.session.put(
-            self.zone_url, headers=self._headers(True), data=json.dumps(payload)
-        )
+        response = self._send(self.session.put, json.dumps(payload), budgeted=False)
         if response.status_code != 204:
             raise PowerDnsError(
                 f"Failed to update serial ({response.status_code}): {response.text}"
@@ -89,32 +298,80 @@ class PowerDnsClient:
 
     # -- internals ----------------------------------------------------------
 
-    def _patch(self, records: RecordMap, delete: bool):
+    def _patch(self, records: RecordMap, delete: bool) -> RecordMap:
         items = list(records.items())
-        for start in range(0, len(items), self.chunk_size):
-            chunk = items[start:start + self.chunk_size]
-            rrsets = [self._rrset(name, record, delete) for name, record in chunk]
-            if rrsets:
-                self._send_patch({"rrsets": rrsets})
-
-    @staticmethod
-    def _rrset(name, record: ResourceRecord, delete: bool):
-        if delete:
-            return {"name": name, "type": record.type, "changetype": "DELETE"}
-        return {
-            "name": name,
-            "type": record.type,
-            "ttl": record.ttl,
-            "changetype": "REPLACE",
-            "records": [{"content": record.content, "disabled": False}],
-        }
-
-    def _send_patch(self, payload):
-        response = self.session.patch(
-            self.zone_url, headers=self._headers(True), data=json.dumps(payload)
-        )
+        encode = self.encoder.encode
+        sent = self._send_units([encode(name, record, delete) for name, record in items])
+        if sent == len(items):
+            return {}
+        remaining = dict(items[sent:])
+        log.warning("%d records deferred to the next run.", len(remaining))
+        return remaining
+
+    def _send_units(self, units, counts=None) -> int:
+        """PATCH ``units`` in chunks; a unit is never split across two PATCHes.
+
+        A unit is one encoded rrset, or several already joined by
+        ``_PATCH_SEP``; ``counts`` holds the number of rrsets per unit (one
+        each if omitted). Returns the number of units sent before the budget
+        ran out.
+        """
+        separator = len(_PATCH_SEP)
+        # Running totals, so that each chunk's end is found by bisection.
+        sizes = list(accumulate(len(unit) + separator for unit in units))
+        rrsets = list(accumulate(counts)) if counts is not None else None
+        room = self.max_chunk_bytes - len(_PATCH_HEAD) - len(_PATCH_TAIL) + separator
+        start = 0
+        while start < len(units):
+            end = self._chunk_end(start, sizes, rrsets, room)
+            try:
+                self._send_patch(units[start:end])
+            except BudgetExhausted as exc:
+                log.warning("%s.", exc)
+                return start
+            start = end
+        return start
+
+    def _chunk_end(self, start, sizes, rrsets, room):
+        """End index of the chunk starting at ``start``, by rrset count and size.
+
+        ``sizes`` and ``rrsets`` are running totals per unit. A chunk holds
+        at least one unit, even if that unit alone is larger.
+        """
+        before = sizes[start - 1] if start else 0
+        end = bisect_right(sizes, before + room, start)
+        if rrsets is None:
+            end = min(end, start + self.chunk_size)
+        else:
+            before = rrsets[start - 1] if start else 0
+            end = min(end, bisect_right(rrsets, before + self.chunk_size, start))
+        return max(end, start + 1)
+
+    def _send_patch(self, rrsets):
+        """PATCH the zone with already-encoded ``rrsets`` (a list of bytes)."""
+        body = _PATCH_HEAD + _PATCH_SEP.join(rrsets) + _PATCH_TAIL
+        response = self._send(self.session.patch, body)
         if response.status_code != 204:
             raise PowerDnsError(
                 f"Failed to patch ({response.status_code}): {response.text}"
             )
         return response
+
+    def _send(self, method, data, budgeted=True):
+        """Send a write, paced by the rate limiter and retried on 429/503.
+
+        Every attempt is charged to the budget (if ``budgeted``), so
+        :class:`BudgetExhausted` may be raised before or between attempts.
+        """
+        for attempt in range(self.max_retries + 1):
+            if budgeted:
+                self.budget.spend(len(data))
+            self.rate_limiter.acquire()
+            response = method(self.zone_url, headers=self._headers(True), data=data)
+            if response.status_code not in self.RETRY_STATUSES or attempt == self.max_retries:
+                return response
+            delay = retry_after(response)
+            if delay is None:
+                delay = self.backoff * 2 ** attempt
+            log.warning("PowerDNS returned %d; retrying in %.1fs.", response.status_code, delay)
+            self.rate_limiter.pause(delay)
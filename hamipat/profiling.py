@@ -0,0 +1,146 @@
+"""Opt-in per-phase profiling (``hamip-update --profile DIR`` / ``HAMIP_PROFILE``).
+
+The pipeline marks its phases with :func:`phase` (HamnetDB fetch,
+``fetch_hosts``, ``fetch_dhcp``, static load, validation, and per target and zone
+``fetch_zone``, ``diff`` and ``patch``). Unless :func:`enable` was called,
+:func:`phase` returns a shared no-op context, so nothing is profiled or
+recorded. When enabled, every phase runs under its own ``cProfile.Profile``
+and :meth:`PhaseProfiler.write` saves one pstats file per phase plus all
+phases merged into one collapsed-stack file (``profile.collapsed``; one
+``frame;frame;... microseconds`` line per stack, as read by flamegraph.pl
+and speedscope).
+"""
+import cProfile
+import os
+import pstats
+import re
+import threading
+from contextlib import contextmanager, nullcontext
+from typing import Dict, List, Optional
+
+COLLAPSED_FILE = "profile.collapsed"
+
+_NO_PHASE = nullcontext()
+_profiler: Optional["PhaseProfiler"] = None
+
+
+def phase(name: str):
+    """Context manager profiling ``name`` if profiling is enabled (else a no-op)."""
+    if _profiler is None:
+        return _NO_PHASE
+    return _profiler.phase(name)
+
+
+def enable(directory: str) -> "PhaseProfiler":
+    """Profile every phase from now on; results go to ``directory``."""
+    global _profiler
+    _profiler = PhaseProfiler(directory)
+    return _profiler
+
+
+def disable() -> Optional["PhaseProfiler"]:
+    """Stop profiling; returns the profiler (call its ``write()``)."""
+    global _profiler
+    profiler, _profiler = _profiler, None
+    return profiler
+
+
+class PhaseProfiler:
+    """Collects one ``cProfile.Profile`` per phase name.
+
+    A phase entered inside another one (e.g. the HamnetDB fetch within
+    ``fetch_hosts``) pauses the outer profile. Profiled phases run one at a
+    time, also across threads: Python allows only one active profiler.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self.profiles: Dict[str, cProfile.Profile] = {}
+        self._lock = threading.RLock()
+        self._stack: List[cProfile.Profile] = []
+
+    @contextmanager
+    def phase(self, name: str):
+        with self._lock:
+            profile = self.profiles.get(name)
+            if profile is None:
+                profile = self.profiles[name] = cProfile.Profile()
+            if self._stack:
+                self._stack[-1].disable()
+            self._stack.append(profile)
+            profile.enable()
+            try:
+                yield profile
+            finally:
+                profile.disable()
+                self._stack.pop()
+                if self._stack:
+                    self._stack[-1].enable()
+
+    def write(self) -> List[str]:
+        """Write ``<phase>.pstats`` per phase and the merged collapsed stacks.
+
+        Returns the paths written.
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        paths = []
+        lines = []
+        with self._lock:
+            for name, profile in sorted(self.profiles.items()):
+                path = os.path.join(self.directory, _file_name(name) + ".pstats")
+                profile.dump_stats(path)
+                paths.append(path)
+                stats = pstats.Stats(profile)
+                lines.extend(collapsed_stacks(stats, root=name))
+        path = os.path.join(self.directory, COLLAPSED_FILE)
+        with open(path, "w") as handle:
+            handle.writelines(line + "\n" for line in lines)
+        paths.append(path)
+        return paths
+
+
+def collapsed_stacks(stats: pstats.Stats, root: str, min_microseconds: int = 1) -> List[str]:
+    """Approximate collapsed stacks (``a;b;c microseconds``) from ``stats``.
+
+    cProfile records caller/callee edges, not whole stacks, so the call graph
+    is unfolded from its roots. A function's time on one path is split
+    between its own code and its callees in proportion to the recorded
+    times. Recursion is cut where a function reappears on its path.
+    """
+    entries = stats.stats  # func -> (cc, nc, tt, ct, callers)
+    callees: Dict[tuple, Dict[tuple, float]] = {}
+    for func, (_, _, _, _, callers) in entries.items():
+        for caller, (_, _, _, edge_ct) in callers.items():
+            callees.setdefault(caller, {})[func] = edge_ct
+    totals: Dict[str, int] = {}
+
+    def walk(func, path, seconds):
+        _, _, own, cumulative, _ = entries[func]
+        path = path + (_label(func),)
+        share = seconds / cumulative if cumulative else 0.0
+        micros = int(own * share * 1e6)
+        if micros >= min_microseconds:
+            key = ";".join(path)
+            totals[key] = totals.get(key, 0) + micros
+        for callee, edge_ct in callees.get(func, {}).items():
+            if _label(callee) in path or callee not in entries:
+                continue
+            child = edge_ct * share
+            if child * 1e6 >= min_microseconds:
+                walk(callee, path, child)
+
+    for func, (_, _, _, cumulative, callers) in entries.items():
+        if not callers:
+            walk(func, (root,), cumulative)
+    return [f"{stack} {micros}" for stack, micros in totals.items()]
+
+
+def _label(func) -> str:
+    filename, line, name = func
+    if filename == "~":
+        return name  # built-in, e.g. <method 'join' of 'str' objects>
+    return f"{name} ({os.path.basename(filename)}:{line})"
+
+
+def _file_name(name: str) -> str:
+    return re.sub(r"[^A-Za-z0-9_.-]+", "_", name)
@@ -1,12 +1,27 @@
-"""Parse a public IP embedded in a HamnetDB name (prototype).
+"""Parse a public IP embedded in a HamnetDB name.
 
 A name of the form ``185-236-164-044-inetip.wx.oe3gwu.hamip.at.`` encodes the
 public IP ``185.236.164.44`` for the domain ``wx.oe3gwu.hamip.at.``.
+:func:`extract_ip_and_domain` parses a single string;
+:class:`PublicIpRecords` turns all such names of a record set into public
+``A`` records for the Internet (ISP) zone.
 """
+import logging
 import re
+import threading
+from typing import Dict, Iterable, Optional, Tuple
+
+from .records import DEFAULT_TTL, RecordMap, ResourceRecord
+
+log = logging.getLogger(__name__)
 
 # Each octet may be 1 to 3 digits (zero-padded or not).
 _INETIP_RE = re.compile(r"(\d{1,3})-(\d{1,3})-(\d{1,3})-(\d{1,3})-inetip\.([\w.-]+)")
+# The same pattern anchored to whole names, for scanning many names joined by
+# newlines in one pass.
+_INETIP_BATCH_RE = re.compile(
+    r"^(\d{1,3})-(\d{1,3})-(\d{1,3})-(\d{1,3})-inetip\.([\w.-]+)$", re.MULTILINE
+)
 
 
 def extract_ip_and_domain(input_string):
@@ -27,6 +42,61 @@ def extract_ip_and_domain(input_string):
     return ip_address, domain
 
 
+class PublicIpRecords:
+    """Batch stage: public ``A`` records for ``<a-b-c-d>-inetip.<domain>`` names.
+
+    :meth:`build` scans all names with one precompiled regex over the names
+    joined by newlines. Results are cached per name, so an instance kept
+    across runs only scans names it has not seen before. Concurrent builds
+    (triggered syncs of different targets) are serialized.
+    """
+
+    def __init__(self, ttl: int = DEFAULT_TTL):
+        self.ttl = ttl
+        # name -> (domain, record), or None for names that do not match.
+        self._cache: Dict[str, Optional[Tuple[str, ResourceRecord]]] = {}
+        # Number of names scanned by the last build() (for logging/tests).
+        self.last_scanned = 0
+        self._lock = threading.Lock()
+
+    def build(self, names: Iterable[str]) -> RecordMap:
+        """Return ``domain -> A record`` for every inetip name in ``names``.
+
+        ``names`` is typically a :data:`RecordMap` (hosts and aliases). If two
+        names encode the same domain, the first one wins.
+        """
+        names = list(names)
+        with self._lock:
+            new = [name for name in names if name not in self._cache]
+            self.last_scanned = len(new)
+            if new:
+                self._scan(new)
+            if len(self._cache) > len(names):
+                # Forget names that disappeared so the cache tracks the input.
+                current = set(names)
+                self._cache = {n: v for n, v in self._cache.items() if n in current}
+
+            records: RecordMap = {}
+            for name in names:
+                hit = self._cache[name]
+                if hit is not None:
+                    records.setdefault(*hit)
+            return records
+
+    def _scan(self, names):
+        for name in names:
+            self._cache[name] = None
+        for match in _INETIP_BATCH_RE.finditer("\n".join(names)):
+            octets = [int(part) for part in match.groups()[:4]]
+            if any(octet > 255 for octet in octets):
+                log.warning("Ignoring %s: octet out of range", match.group(0))
+                continue
+            ip = ".".join(map(str, octets))
+            self._cache[match.group(0)] = (
+                match.group(5), ResourceRecord("A", ip, self.ttl)
+            )
+
+
 def main():
     example = "185-236-164-044-inetip.wx.oe3gwu.hamip.at."
     ip, domain = extract_ip_and_domain(example)
@@ -0,0 +1,110 @@
+"""Request pacing and per-run budgets for writes to a shared PowerDNS API."""
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from typing import Optional
+
+
+class BudgetExhausted(Exception):
+    """Raised when a request would exceed the :class:`RequestBudget`."""
+
+
+class TokenBucket:
+    """A token-bucket rate limiter.
+
+    Allows bursts of up to ``burst`` requests and ``rate`` requests per second
+    on average; ``rate=None`` disables pacing. :meth:`pause` additionally holds
+    back all requests for a while (e.g. for a ``Retry-After``). ``clock`` and
+    ``sleep`` are injectable so pacing can be tested without waiting.
+    """
+
+    def __init__(self, rate: Optional[float] = None, burst: int = 1,
+                 clock=time.monotonic, sleep=time.sleep):
+        self.rate = rate
+        self.burst = max(burst, 1)
+        self.clock = clock
+        self.sleep = sleep
+        self._tokens = float(self.burst)
+        self._updated = clock()
+        self._resume_at = None
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Block until a request may be sent, then consume one token."""
+        with self._lock:
+            now = self.clock()
+            if self._resume_at is not None and now < self._resume_at:
+                self.sleep(self._resume_at - now)
+                now = self.clock()
+            if not self.rate:
+                return
+            self._refill(now)
+            if self._tokens < 1:
+                self.sleep((1 - self._tokens) / self.rate)
+                self._refill(self.clock())
+            self._tokens -= 1
+
+    def pause(self, seconds: float):
+        """Hold back every request for at least ``seconds`` from now."""
+        with self._lock:
+            resume_at = self.clock() + seconds
+            if self._resume_at is None or resume_at > self._resume_at:
+                self._resume_at = resume_at
+
+    def _refill(self, now):
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+
+class RequestBudget:
+    """Caps the number of requests and request-body bytes sent in one run.
+
+    ``None`` disables a cap. One budget may be shared by the clients of all
+    zones of a target.
+    """
+
+    def __init__(self, max_requests: Optional[int] = None, max_bytes: Optional[int] = None):
+        self.max_requests = max_requests
+        self.max_bytes = max_bytes
+        self.requests = 0
+        self.bytes = 0
+        self._lock = threading.Lock()
+
+    def allows(self, size: int) -> bool:
+        if self.max_requests is not None and self.requests + 1 > self.max_requests:
+            return False
+        if self.max_bytes is not None and self.bytes + size > self.max_bytes:
+            return False
+        return True
+
+    def spend(self, size: int):
+        """Account for one request of ``size`` bytes.
+
+        Raises :class:`BudgetExhausted` (without accounting) if it does not fit.
+        """
+        with self._lock:
+            if not self.allows(size):
+                raise BudgetExhausted(
+                    f"request budget exhausted ({self.requests} requests, {self.bytes} bytes sent)"
+                )
+            self.requests += 1
+            self.bytes += size
+
+
+def retry_after(response, now=time.time) -> Optional[float]:
+    """Seconds to wait according to ``response``'s ``Retry-After`` header.
+
+    Handles both the delta-seconds and the HTTP-date form; returns ``None`` if
+    the header is missing or malformed.
+    """
+    value = (getattr(response, "headers", None) or {}).get("Retry-After")
+    if not value:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        return max(parsedate_to_datetime(value).timestamp() - now(), 0.0)
+    except (TypeError, ValueError):
+        return None
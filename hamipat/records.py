@@ -1,6 +1,7 @@
 """The DNS resource-record value object."""
+from collections.abc import Mapping
 from dataclasses import dataclass
-from typing import Dict
+from typing import Dict, Optional
 
 DEFAULT_TTL = 600
 
@@ -20,3 +21,58 @@ class ResourceRecord:
 
 # A zone is represented throughout the package as a mapping of FQDN -> record.
 RecordMap = Dict[str, ResourceRecord]
+
+
+def ipv4_to_int(text: str) -> Optional[int]:
+    """Dotted-quad to integer, or ``None`` if ``text`` is not an IPv4 address."""
+    parts = text.split(".")
+    if len(parts) != 4:
+        return None
+    value = 0
+    for part in parts:
+        if not (part.isascii() and part.isdigit()) or int(part) > 255:
+            return None
+        value = value << 8 | int(part)
+    return value
+
+
+class LayeredRecordMap(Mapping):
+    """A read-only :data:`RecordMap` view of ``overlay`` on top of ``base``.
+
+    Lookups try ``overlay`` first; iteration yields the base names that are not
+    overlaid, then the overlay names. ``base`` is never copied, so several
+    targets can share one large HamnetDB record set and differ only in a small
+    per-target overlay (static records, timestamp, ...).
+    """
+
+    def __init__(self, base: RecordMap, overlay: RecordMap):
+        self.base = base
+        self.overlay = overlay
+
+    def __getitem__(self, name):
+        try:
+            return self.overlay[name]
+        except KeyError:
+            return self.base[name]
+
+    def get(self, name, default=None):
+        record = self.overlay.get(name)
+        if record is None:
+            record = self.base.get(name, default)
+        return record
+
+    def __contains__(self, name):
+        return name in self.overlay or name in self.base
+
+    def __iter__(self):
+        overlay = self.overlay
+        for name in self.base:
+            if name not in overlay:
+                yield name
+        yield from overlay
+
+    def __len__(self):
+        return len(self.base) + sum(1 for name in self.overlay if name not in self.base)
+
+    def __repr__(self):
+        return f"LayeredRecordMap(base={len(self.base)} records, overlay={self.overlay!r})"
@@ -0,0 +1,94 @@
+"""Per-site child zones delegated from the forward zone.
+
+With one ``hamip.at`` zone, any change anywhere (and the timestamp of every
+run) makes each AnyCast secondary transfer the whole zone. A zone can only be
+cut at a label boundary, and HamNet hosts are named ``<host>.<site>.hamip.at``,
+so :func:`split_records` moves every ``oe1``..``oe9`` site into its own child
+zone ``<site>.hamip.at`` and leaves NS (and glue) records for them in the
+parent. A run then only bumps the serial, and so only triggers transfers, of
+the parent and of the sites that actually changed.
+"""
+import logging
+from typing import Collection, Dict, List, Mapping, Optional, Tuple
+
+from .config import ShardSettings
+from .records import RecordMap, ResourceRecord
+
+log = logging.getLogger(__name__)
+
+# CNAME hops followed when flattening a site's apex record.
+_MAX_CNAME_HOPS = 8
+
+
+def site_zone(name: str, zone: str, settings: ShardSettings) -> Optional[str]:
+    """The child zone ``name`` belongs to, or ``None`` if it stays in ``zone``."""
+    suffix = "." + zone + "."
+    if not name.endswith(suffix):
+        return None
+    site = name[:-len(suffix)].rpartition(".")[2]
+    if not site.startswith(settings.regions):
+        return None
+    return f"{site}.{zone}"
+
+
+def child_zones(existing: Collection[str], zone: str, settings: ShardSettings) -> List[str]:
+    """The zones in ``existing`` that are site zones below ``zone``, sorted."""
+    return sorted(name for name in existing if site_zone(name + ".", zone, settings) == name)
+
+
+def split_records(records: Mapping[str, ResourceRecord], zone: str,
+                  settings: ShardSettings, existing: Collection[str]
+                  ) -> Tuple[RecordMap, Dict[str, RecordMap]]:
+    """Split ``records`` into the parent zone's and each child zone's records.
+
+    Every child zone in ``existing`` (the zones on the target) is split off,
+    even one without records, so its stale records are removed; other sites
+    stay in the parent until their zone is created. A CNAME at a site's own
+    name is not allowed at a zone apex, so it is flattened into the A record
+    it resolves to, or left out if it does not resolve within ``records``.
+    The parent gets an NS record for every child zone, listing all
+    nameservers (see :meth:`~hamipat.powerdns.PowerDnsClient.parse_records`),
+    and their glue A records where configured.
+
+    Returns ``(parent, {child zone: records})``.
+    """
+    delegation = ResourceRecord(
+        "NS", " ".join(sorted(name for name, _ in settings.nameservers)), settings.ttl
+    )
+    parent: RecordMap = {}
+    children: Dict[str, RecordMap] = {child: {} for child in child_zones(existing, zone, settings)}
+    for name, record in records.items():
+        child = site_zone(name, zone, settings)
+        if child in children:
+            children[child][name] = record
+        else:
+            parent[name] = record
+
+    for child, shard in children.items():
+        apex = child + "."
+        record = shard.get(apex)
+        if record is not None and record.type == "CNAME":
+            address = _resolve(record, records)
+            if address is None:
+                log.warning("Leaving out %s CNAME %s: it does not resolve to an A record.",
+                            apex, record.content)
+                del shard[apex]
+            else:
+                shard[apex] = ResourceRecord("A", address.content, record.ttl)
+        parent[apex] = delegation
+
+    if children:
+        for nameserver, address in settings.nameservers:
+            if address and nameserver.endswith("." + zone + "."):
+                parent.setdefault(nameserver, ResourceRecord("A", address, settings.ttl))
+    return parent, children
+
+
+def _resolve(record: ResourceRecord, records: Mapping[str, ResourceRecord]):
+    for _ in range(_MAX_CNAME_HOPS):
+        if record is None or record.type != "CNAME":
+            break
+        record = records.get(record.content)
+    if record is None or record.type != "A":
+        return None
+    return record
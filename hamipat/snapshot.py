@@ -0,0 +1,260 @@
+"""Binary, memory-mapped snapshots of a :data:`~hamipat.records.RecordMap`.
+
+Layout (little-endian)::
+
+    header   magic "HIPS", format version, type count, record count,
+             offset of the record array, offset of the string table,
+             file size
+    types    the record types, each as <length byte><ascii>
+    records  one fixed-width entry per record, sorted by name (UTF-8 bytes):
+             name offset/length, content offset/length, ttl, type index
+    strings  UTF-8 string table; names and contents are stored once each,
+             so a CNAME pointing at a name in the zone reuses that name
+
+The sorted record array is the index: :class:`Snapshot` finds a name by
+binary search in O(log n) and iterates without building the whole map.
+:func:`diff_snapshots` walks two snapshots' arrays in one merge pass and only
+builds :class:`~hamipat.records.ResourceRecord` objects for the differences.
+"""
+import mmap
+import os
+import struct
+import weakref
+from collections.abc import ItemsView, Mapping, ValuesView
+from typing import Iterator, Mapping as MappingType, Tuple
+
+from .records import RecordMap, ResourceRecord
+
+MAGIC = b"HIPS"
+FORMAT_VERSION = 2
+
+_HEADER = struct.Struct("<4sHHIQQQ")
+# name offset, name length, content offset, content length, ttl, type index
+_RECORD = struct.Struct("<IHIHIB")
+
+
+def write_snapshot(records: MappingType[str, ResourceRecord], path: str):
+    """Write ``records`` to ``path`` (atomically, via a temporary file)."""
+    types = sorted({record.type for record in records.values()})
+    type_index = {rrtype: index for index, rrtype in enumerate(types)}
+    strings = bytearray()
+    offsets = {}
+
+    def intern(text):
+        offset = offsets.get(text)
+        if offset is None:
+            data = text.encode()
+            offset = offsets[text] = (len(strings), len(data))
+            strings.extend(data)
+        return offset
+
+    names = sorted(records)
+    for name in names:
+        intern(name)
+    entries = bytearray()
+    for name in names:
+        record = records[name]
+        name_offset, name_length = offsets[name]
+        if not isinstance(record.ttl, int) or not 0 <= record.ttl <= 0xFFFFFFFF:
+            raise ValueError(f"{name}: TTL {record.ttl!r} is not a 32-bit unsigned integer")
+        content_offset, content_length = intern(record.content)
+        if name_length > 0xFFFF or content_length > 0xFFFF:
+            raise ValueError(f"{name}: name or content too long for a snapshot")
+        entries += _RECORD.pack(
+            name_offset, name_length, content_offset, content_length,
+            record.ttl, type_index[record.type],
+        )
+
+    type_table = b"".join(bytes([len(t)]) + t.encode("ascii") for t in types)
+    records_offset = _HEADER.size + len(type_table)
+    strings_offset = records_offset + len(entries)
+    temporary = f"{path}.tmp"
+    with open(temporary, "wb") as handle:
+        handle.write(_HEADER.pack(
+            MAGIC, FORMAT_VERSION, len(types), len(names), records_offset, strings_offset,
+            strings_offset + len(strings),
+        ))
+        handle.write(type_table)
+        handle.write(entries)
+        handle.write(strings)
+    os.replace(temporary, path)
+
+
+class Snapshot(Mapping):
+    """A read-only :data:`RecordMap` backed by a memory-mapped snapshot file.
+
+    Lookups decode only the entries the binary search touches; iteration
+    streams names (or, via :meth:`items` / :meth:`rows`, records) one at a
+    time. Use as a context manager or call :meth:`close`; closing ends any
+    iteration still in progress.
+    """
+
+    def __init__(self, path: str):
+        with open(path, "rb") as handle:
+            if os.fstat(handle.fileno()).st_size < _HEADER.size:
+                raise ValueError(f"{path} is not a version {FORMAT_VERSION} record snapshot")
+            self._map = mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, type_count, count, records_offset, strings_offset, size = (
+            _HEADER.unpack_from(self._map, 0)
+        )
+        if magic != MAGIC or version != FORMAT_VERSION:
+            self._map.close()
+            raise ValueError(f"{path} is not a version {FORMAT_VERSION} record snapshot")
+        self.types = []
+        position = _HEADER.size
+        end = min(records_offset, len(self._map))
+        while len(self.types) < type_count and position < end:
+            length = self._map[position]
+            self.types.append(self._map[position + 1:position + 1 + length].decode("ascii"))
+            position += 1 + length
+        if (len(self.types) != type_count or position != records_offset
+                or strings_offset - records_offset != count * _RECORD.size
+                or not strings_offset <= size == len(self._map)):
+            self._map.close()
+            raise ValueError(f"{path} is a truncated or corrupt record snapshot")
+        self._count = count
+        self._records = memoryview(self._map)[records_offset:strings_offset]
+        self._strings = strings_offset
+        # Live rows() generators; each holds an export of _records.
+        self._rows = weakref.WeakSet()
+
+    def close(self):
+        for rows in list(self._rows):
+            rows.close()
+        self._records.release()
+        self._map.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    # -- raw access ---------------------------------------------------------
+
+    def rows(self) -> Iterator[Tuple[bytes, str, bytes, int]]:
+        """Stream ``(name, type, content, ttl)`` in name order, as raw UTF-8 bytes."""
+        rows = self._iter_rows()
+        self._rows.add(rows)
+        return rows
+
+    def _iter_rows(self):
+        data, base, types = self._map, self._strings, self.types
+        for name_offset, name_length, content_offset, content_length, ttl, rrtype in (
+            _RECORD.iter_unpack(self._records)
+        ):
+            name_offset += base
+            content_offset += base
+            yield (
+                data[name_offset:name_offset + name_length],
+                types[rrtype],
+                data[content_offset:content_offset + content_length],
+                ttl,
+            )
+
+    def _name(self, index) -> bytes:
+        name_offset, name_length = struct.unpack_from("<IH", self._records, index * _RECORD.size)
+        start = self._strings + name_offset
+        return self._map[start:start + name_length]
+
+    def _record(self, index) -> ResourceRecord:
+        _, _, content_offset, content_length, ttl, rrtype = _RECORD.unpack_from(
+            self._records, index * _RECORD.size
+        )
+        start = self._strings + content_offset
+        return ResourceRecord(
+            self.types[rrtype], self._map[start:start + content_length].decode(), ttl
+        )
+
+    def _find(self, name: str) -> int:
+        key = name.encode()
+        low, high = 0, self._count
+        while low < high:
+            middle = (low + high) // 2
+            if self._name(middle) < key:
+                low = middle + 1
+            else:
+                high = middle
+        if low < self._count and self._name(low) == key:
+            return low
+        return -1
+
+    # -- Mapping ------------------------------------------------------------
+
+    def __getitem__(self, name) -> ResourceRecord:
+        index = self._find(name) if isinstance(name, str) else -1
+        if index < 0:
+            raise KeyError(name)
+        return self._record(index)
+
+    def __contains__(self, name):
+        return isinstance(name, str) and self._find(name) >= 0
+
+    def __iter__(self) -> Iterator[str]:
+        for name, _, _, _ in self.rows():
+            yield name.decode()
+
+    def __len__(self):
+        return self._count
+
+    def items(self):
+        return _SnapshotItems(self)
+
+    def values(self):
+        return _SnapshotValues(self)
+
+    def __repr__(self):
+        return f"Snapshot({self._count} records)"
+
+
+class _SnapshotItems(ItemsView):
+    def __iter__(self):
+        for name, rrtype, content, ttl in self._mapping.rows():
+            yield name.decode(), ResourceRecord(rrtype, content.decode(), ttl)
+
+
+class _SnapshotValues(ValuesView):
+    def __iter__(self):
+        for _, rrtype, content, ttl in self._mapping.rows():
+            yield ResourceRecord(rrtype, content.decode(), ttl)
+
+
+def diff_snapshots(current: Snapshot, reference: Snapshot) -> Tuple[RecordMap, RecordMap]:
+    """``(to_remove, to_change)`` turning ``current`` into ``reference``.
+
+    Same result as :func:`~hamipat.updater.diff_records`, computed in one
+    merge pass over both sorted record arrays; unchanged records are compared
+    as raw bytes and never decoded.
+    """
+    to_remove: RecordMap = {}
+    to_change: RecordMap = {}
+    old_rows, new_rows = current.rows(), reference.rows()
+    old = next(old_rows, None)
+    new = next(new_rows, None)
+    while old is not None and new is not None:
+        if old == new:
+            old = next(old_rows, None)
+            new = next(new_rows, None)
+        elif old[0] == new[0]:
+            _add(to_remove, old)
+            _add(to_change, new)
+            old = next(old_rows, None)
+            new = next(new_rows, None)
+        elif old[0] < new[0]:
+            _add(to_remove, old)
+            old = next(old_rows, None)
+        else:
+            _add(to_change, new)
+            new = next(new_rows, None)
+    while old is not None:
+        _add(to_remove, old)
+        old = next(old_rows, None)
+    while new is not None:
+        _add(to_change, new)
+        new = next(new_rows, None)
+    return to_remove, to_change
+
+
+def _add(records: RecordMap, row):
+    name, rrtype, content, ttl = row
+    records[name.decode()] = ResourceRecord(rrtype, content.decode(), ttl)
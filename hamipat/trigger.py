@@ -0,0 +1,193 @@
+"""Event-driven sync triggers: debounce, coalesce, one sync in flight at a time.
+
+Triggers arrive over a local HTTP endpoint (:func:`serve_http`) or as lines on
+a file or stdin (:func:`read_triggers`) and are handed to a
+:class:`SyncScheduler`, which decides when to actually run a sync.
+"""
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Iterable, List, Optional
+
+log = logging.getLogger(__name__)
+
+
+class _TargetState:
+    __slots__ = ("pending", "first", "last")
+
+    def __init__(self):
+        self.pending = False
+        self.first = None  # first trigger since the last sync started
+        self.last = None  # latest trigger
+
+
+class SyncScheduler:
+    """Coalesces sync requests per target.
+
+    A target is due once no trigger arrived for ``debounce`` seconds, or
+    ``max_delay`` seconds after the first of a burst. Due targets are synced
+    together in one ``sync(targets)`` call on ``executor``. Only one sync runs
+    at a time, so HamnetDB is never downloaded twice at once: targets that
+    become due meanwhile are merged into the next sync, and triggers for a
+    target being synced queue exactly one follow-up. ``clock`` and
+    ``executor`` are injectable.
+    """
+
+    def __init__(self, sync, targets, debounce: float = 10.0, max_delay: float = 60.0,
+                 clock=time.monotonic, executor=None):
+        self.sync = sync
+        self.targets = {target.name: target for target in targets}
+        self.debounce = debounce
+        self.max_delay = max(max_delay, debounce)
+        self.clock = clock
+        self.executor = executor or ThreadPoolExecutor(max_workers=1)
+        self.syncs = 0
+        self._state: Dict[str, _TargetState] = {name: _TargetState() for name in self.targets}
+        self._running = False
+        self._cond = threading.Condition()
+
+    def trigger(self, names: Optional[Iterable[str]] = None) -> List[str]:
+        """Request a sync of ``names`` (all targets if empty or ``None``).
+
+        Raises :class:`KeyError` for an unknown target; nothing is requested
+        then.
+        """
+        names = list(names or self.targets)
+        for name in names:
+            if name not in self._state:
+                raise KeyError(name)
+        with self._cond:
+            now = self.clock()
+            for name in names:
+                state = self._state[name]
+                if not state.pending:
+                    state.pending, state.first = True, now
+                state.last = now
+            self._cond.notify_all()
+        return names
+
+    def next_due(self) -> Optional[float]:
+        """Clock time at which the next pending target is due, or ``None``
+        while a sync runs or nothing is pending."""
+        with self._cond:
+            return self._next_due()
+
+    def start_due(self) -> List[str]:
+        """Start one sync of every target that is due now; returns their names.
+
+        Starts nothing while a sync is still running.
+        """
+        with self._cond:
+            if self._running:
+                return []
+            now = self.clock()
+            due = [
+                name for name, state in self._state.items()
+                if state.pending and self._due_at(state) <= now
+            ]
+            for name in due:
+                state = self._state[name]
+                state.pending = False
+                state.first = state.last = None
+            if due:
+                self._running = True
+                self.syncs += 1
+        if due:
+            self.executor.submit(self._run, due)
+        return due
+
+    def idle(self) -> bool:
+        """Whether no sync is pending or running."""
+        with self._cond:
+            return not self._running and not any(
+                state.pending for state in self._state.values()
+            )
+
+    def run_forever(self, stop: threading.Event):
+        """Start syncs as they become due.
+
+        Returns once ``stop`` is set (no more triggers will come) and every
+        pending and running sync has finished.
+        """
+        while not (stop.is_set() and self.idle()):
+            self.start_due()
+            with self._cond:
+                due = self._next_due()
+                timeout = 1.0 if due is None else min(max(due - self.clock(), 0.0), 1.0)
+                self._cond.wait(timeout)
+
+    def _run(self, names):
+        log.info("Triggered sync of %s", ", ".join(names))
+        try:
+            self.sync(tuple(self.targets[name] for name in names))
+        except Exception:  # noqa: BLE001 - keep serving triggers
+            log.exception("Triggered sync of %s failed", ", ".join(names))
+        finally:
+            with self._cond:
+                self._running = False
+                self._cond.notify_all()
+
+    def _due_at(self, state) -> float:
+        return min(state.last + self.debounce, state.first + self.max_delay)
+
+    def _next_due(self) -> Optional[float]:
+        if self._running:
+            return None
+        times = [self._due_at(state) for state in self._state.values() if state.pending]
+        return min(times) if times else None
+
+
+class _TriggerHandler(BaseHTTPRequestHandler):
+
+    def do_POST(self):
+        # POST /sync requests all targets, POST /sync/<target> one of them.
+        parts = [part for part in self.path.split("?")[0].split("/") if part]
+        if not parts or parts[0] != "sync" or len(parts) > 2:
+            self._reply(404, "unknown path\n")
+            return
+        try:
+            names = self.server.scheduler.trigger(parts[1:])
+        except KeyError as exc:
+            self._reply(404, f"unknown target {exc}\n")
+            return
+        self._reply(202, "sync requested: " + ", ".join(names) + "\n")
+
+    def _reply(self, status, text):
+        data = text.encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "text/plain")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+
+def serve_http(scheduler: SyncScheduler, host: str, port: int):
+    """Start the trigger endpoint on a background thread; returns the server.
+
+    Call ``shutdown()`` on the returned server to stop it.
+    """
+    server = ThreadingHTTPServer((host, port), _TriggerHandler)
+    server.daemon_threads = True
+    server.scheduler = scheduler
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    log.info("Listening for sync triggers on http://%s:%d/sync", *server.server_address[:2])
+    return server
+
+
+def read_triggers(scheduler: SyncScheduler, handle):
+    """Request a sync per line of ``handle`` until it ends.
+
+    An empty line (or ``all``) requests every target; otherwise the line holds
+    whitespace-separated target names.
+    """
+    for line in handle:
+        names = [name for name in line.split() if name != "all"]
+        try:
+            scheduler.trigger(names)
+        except KeyError as exc:
+            log.warning("Ignoring trigger for unknown target %s", exc)
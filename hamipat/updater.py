@@ -1,52 +1,325 @@
 """Diff a desired record set against a live zone and apply the changes."""
 import logging
+import threading
+from itertools import compress
+from operator import ne
+from typing import Collection, Iterable, Optional
 
+from . import profiling
+from .config import ZONE_NAME, DeltaLimits
+from .plan import ZonePlan
 from .powerdns import PowerDnsError
-from .records import RecordMap
+from .records import LayeredRecordMap, RecordMap
 
 log = logging.getLogger(__name__)
 
 
+class DeltaLimitError(PowerDnsError):
+    """Raised when a computed delta exceeds the configured :class:`DeltaLimits`.
+
+    Nothing has been written when this is raised; ``plan`` is the refused
+    :class:`~hamipat.plan.ZonePlan` and ``violations`` lists what tripped.
+    """
+
+    def __init__(self, plan: ZonePlan, violations):
+        self.plan = plan
+        self.violations = list(violations)
+        super().__init__(
+            f"Refusing to update {plan.target or plan.zone}: " + "; ".join(self.violations)
+        )
+
+
+class StalePlanError(PowerDnsError):
+    """Raised when a saved plan's serial no longer matches the live zone.
+
+    The zone changed after the plan was computed, so its ``before`` state is
+    outdated; nothing has been written. ``serial`` is the live serial.
+    """
+
+    def __init__(self, plan: ZonePlan, serial):
+        self.plan = plan
+        self.serial = serial
+        super().__init__(
+            f"Plan for {plan.target or 'zone'} {plan.zone} was computed at serial "
+            f"{plan.serial}, but the zone is at {serial}; plan again"
+        )
+
+
+def diff_records(current: RecordMap, reference: RecordMap, base_diff=None):
+    """Return ``(to_remove, to_change)`` turning ``current`` into ``reference``.
+
+    Anything in ``current`` that is absent from or differs from the reference
+    is removed; anything new or changed in the reference is (re)applied. A
+    :class:`~hamipat.records.LayeredRecordMap` reference is diffed layer by
+    layer via ``base_diff`` (a :class:`SharedBaseDiff`), without materializing
+    the merged map.
+    """
+    if isinstance(reference, LayeredRecordMap):
+        if base_diff is None or base_diff.base is not reference.base:
+            base_diff = SharedBaseDiff(reference.base, reference.overlay)
+        return base_diff.diff(current, reference)
+
+    to_remove = {name: current[name] for name in _differing(current, reference)}
+    to_change = {name: reference[name] for name in _differing(reference, current)}
+    return to_remove, to_change
+
+
+def _differing(records: RecordMap, other: RecordMap):
+    """Names in ``records`` whose record is missing from or differs in ``other``.
+
+    Equivalent to ``(n for n, r in records.items() if other.get(n) != r)``, but
+    the loop runs in C.
+    """
+    return compress(records, map(ne, map(other.get, records), records.values()))
+
+
+class SharedBaseDiff:
+    """Diffs layered references that share one base against live zones.
+
+    ``shadow`` is every name any target overlays. The base is diffed against a
+    live zone once, ignoring the ``shadow`` names. If a later zone agrees with
+    an earlier one outside ``shadow``, the earlier result is reused, and only
+    the ``shadow`` names are compared for that target. The ISP and HamNet zones
+    normally carry the same HamnetDB records, so the large base is diffed once
+    rather than once per target. Neither the base nor the live zones are copied.
+    """
+
+    def __init__(self, base: RecordMap, shadow: Iterable[str]):
+        self.base = base
+        self.shadow = frozenset(shadow)
+        self.hits = 0
+        self._seen = []
+        self._lock = threading.Lock()
+
+    def diff(self, current: RecordMap, reference: LayeredRecordMap):
+        base_remove, base_change = self._base_diff(current)
+
+        to_remove = dict(base_remove)
+        to_change = dict(base_change)
+        for name in self.shadow:
+            wanted = reference.get(name)
+            have = current.get(name)
+            if have is not None and have != wanted:
+                to_remove[name] = have
+            if wanted is not None and wanted != have:
+                to_change[name] = wanted
+        return to_remove, to_change
+
+    def _base_diff(self, current: RecordMap):
+        with self._lock:
+            for seen, result in self._seen:
+                if self._agree(seen, current):
+                    self.hits += 1
+                    return result
+            base, shadow = self.base, self.shadow
+            result = (
+                {name: current[name] for name in _differing(current, base)
+                 if name not in shadow},
+                {name: base[name] for name in _differing(base, current)
+                 if name not in shadow},
+            )
+            self._seen.append((current, result))
+            return result
+
+    def _agree(self, seen: RecordMap, current: RecordMap) -> bool:
+        """Whether two live zones hold the same records outside ``shadow``."""
+        shadow = self.shadow
+        outside_seen = len(seen) - sum(1 for name in shadow if name in seen)
+        outside_current = len(current) - sum(1 for name in shadow if name in current)
+        if outside_seen != outside_current:
+            return False
+        # Same size and every outside name of ``current`` matches in ``seen``.
+        return all(name in shadow for name in _differing(current, seen))
+
+
 class ZoneUpdater:
-    """Reconciles a live PowerDNS zone with a desired set of records."""
+    """Reconciles a live PowerDNS zone with a desired set of records.
+
+    ``target`` is only a label; it is recorded in the plans this updater
+    produces so a saved plan can be matched back to its target. ``limits``
+    (a :class:`~hamipat.config.DeltaLimits`) bounds the delta :meth:`plan` will
+    accept; ``None`` means unlimited. ``base_diff`` is a :class:`SharedBaseDiff`
+    shared with the updaters of other targets whose references have the same
+    base layer.
+
+    A plan touching more than ``bulk_ratio`` times the zone's size is marked
+    ``bulk`` and applied in a single request (``None`` never switches).
+    ``allow_empty`` permits planning against an empty zone, i.e. a cold start;
+    such a plan is always bulk. ``history`` (a
+    :class:`~hamipat.history.HistoryStore`) records every applied delta.
+    ``delegations`` are the names whose NS records are part of the zone's
+    records (the apexes of sharded child zones); NS records elsewhere are
+    left alone. After :meth:`plan`, ``last_zone_size`` is the number of
+    managed records the zone held.
+    """
 
-    def __init__(self, client):
+    def __init__(self, client, target="", limits: Optional[DeltaLimits] = None,
+                 base_diff: Optional[SharedBaseDiff] = None,
+                 bulk_ratio: Optional[float] = None, allow_empty: bool = False,
+                 history=None, delegations: Collection[str] = ()):
         self.client = client
+        self.target = target
+        self.limits = limits
+        self.base_diff = base_diff
+        self.bulk_ratio = bulk_ratio
+        self.allow_empty = allow_empty
+        self.history = history
+        self.delegations = frozenset(delegations)
+        self.last_zone_size = 0
 
     def sync(self, reference: RecordMap):
         """Make the zone match ``reference``.
 
         Returns the ``(to_remove, to_change)`` maps that were applied.
         """
-        zone = self.client.fetch_zone()
+        plan = self.plan(reference)
+        self.apply(plan)
+        return plan.to_remove, plan.to_change
+
+    def plan(self, reference: RecordMap) -> ZonePlan:
+        """Compute the changes needed to make the zone match ``reference``.
+
+        Only reads the zone; nothing is written.
+        """
+        label = self._label()
+        with profiling.phase(f"fetch_zone.{label}"):
+            zone = self.client.fetch_zone()
         serial = zone.get("serial")
         if serial is None:
             raise PowerDnsError("Zone metadata has no serial")
         log.info("Current serial: %s", serial)
 
-        current = self.client.parse_records(zone)
+        current = self.client.parse_records(zone, self.delegations)
+        self.last_zone_size = len(current)
         if not current:
-            raise PowerDnsError("No records returned from server")
-
-        # Anything on the server that is absent from or differs from the
-        # reference is removed; anything new or changed in the reference is
-        # (re)applied.
-        to_remove = {
-            name: record
-            for name, record in current.items()
-            if reference.get(name) != record
-        }
-        to_change = {
-            name: record
-            for name, record in reference.items()
-            if current.get(name) != record
-        }
-
-        log.info("Keys to be removed: %d", len(to_remove))
-        self.client.delete_records(to_remove)
-
-        log.info("Keys to be changed or added: %d", len(to_change))
-        self.client.replace_records(to_change)
+            if not self.allow_empty:
+                raise PowerDnsError("No records returned from server")
+            log.info("Zone is empty; planning a cold start.")
+
+        # Deltas are kept in name order so that a plan applies identically
+        # whether live or after a round trip through NDJSON.
+        with profiling.phase(f"diff.{label}"):
+            to_remove, to_change = diff_records(current, reference, self.base_diff)
+        plan = ZonePlan(
+            target=self.target,
+            zone=getattr(self.client, "zone", ZONE_NAME),
+            serial=serial,
+            to_remove=dict(sorted(to_remove.items())),
+            to_change=dict(sorted(to_change.items())),
+        )
+        if self.limits is not None:
+            self.check_limits(plan, len(current), self.limits)
+        plan.bulk = self._use_bulk(plan, len(current))
+        return plan
+
+    def _use_bulk(self, plan: ZonePlan, zone_size: int) -> bool:
+        if not zone_size:
+            return not plan.is_empty
+        if self.bulk_ratio is None:
+            return False
+        touched = len(plan.to_remove.keys() | plan.to_change.keys())
+        return touched > self.bulk_ratio * zone_size
+
+    @staticmethod
+    def check_limits(plan: ZonePlan, zone_size: int, limits: DeltaLimits):
+        """Raise :class:`DeltaLimitError` if ``plan`` exceeds ``limits``.
+
+        Only the delta is inspected (``zone_size`` is the number of managed
+        records currently in the zone), so the check is O(delta).
+        """
+        violations = []
+        removals = sum(1 for name in plan.to_remove if name not in plan.to_change)
+        if limits.max_removals is not None and removals > limits.max_removals:
+            violations.append(f"{removals} removals > {limits.max_removals}")
+        if limits.max_removal_ratio is not None and zone_size:
+            ratio = removals / zone_size
+            if ratio > limits.max_removal_ratio:
+                violations.append(
+                    f"{ratio:.1%} of {zone_size} records removed > {limits.max_removal_ratio:.1%}"
+                )
+        if limits.max_changes_per_type is not None:
+            # Pure additions cannot wipe anything, and a large one (e.g. after
+            # enabling USE_DHCP) is what bulk plans are for: only names that
+            # lose or change their record count, once per type involved.
+            touched = {}
+            for name, record in plan.to_remove.items():
+                touched.setdefault(record.type, set()).add(name)
+                new = plan.to_change.get(name)
+                if new is not None:
+                    touched.setdefault(new.type, set()).add(name)
+            for rrtype, names in sorted(touched.items()):
+                total = len(names)
+                if total > limits.max_changes_per_type:
+                    violations.append(
+                        f"{total} {rrtype} changes > {limits.max_changes_per_type}"
+                    )
+        if violations:
+            raise DeltaLimitError(plan, violations)
 
+    def check_serial(self, plan: ZonePlan):
+        """Raise :class:`StalePlanError` unless the zone is still at ``plan.serial``.
+
+        One ``rrsets=false`` read; used before applying a saved plan.
+        """
+        serial = self.client.fetch_serial()
+        if serial != plan.serial:
+            raise StalePlanError(plan, serial)
+
+    def apply(self, plan: ZonePlan) -> ZonePlan:
+        """Apply a plan computed by :meth:`plan`: deletes, then changes, then
+        bump the serial.
+
+        Returns the part of the plan that was deferred because the client's
+        request budget ran out (empty when everything was applied), with the
+        serial after this run's bump so it can be applied as a saved plan. The
+        client's ``apply_delta`` sends a changed name's delete and change in
+        the same request, so a deferral never leaves a name missing. A
+        ``bulk`` plan is sent as one request via the client's ``apply_bulk``.
+        The first plan applied with a ``history`` snapshots the zone
+        beforehand (one extra read).
+        """
+        if self.history is not None and self.history.latest_version(plan.zone) is None:
+            self.history.start(plan.zone, self.client.fetch_records(self.delegations))
+
+        with profiling.phase(f"patch.{self._label()}"):
+            return self._apply(plan)
+
+    def _label(self) -> str:
+        return f"{self.target or 'zone'}.{getattr(self.client, 'zone', ZONE_NAME)}"
+
+    def _apply(self, plan: ZonePlan) -> ZonePlan:
+        if plan.bulk:
+            log.info(
+                "Bulk update: %d removals and %d changes in one request",
+                len(plan.to_remove), len(plan.to_change),
+            )
+            deferred_remove, deferred_change = self.client.apply_bulk(
+                plan.to_remove, plan.to_change
+            )
+            return self._finish(plan, deferred_remove, deferred_change)
+
+        log.info("Keys to be removed: %d, changed or added: %d",
+                 len(plan.to_remove), len(plan.to_change))
+        deferred_remove, deferred_change = self.client.apply_delta(
+            plan.to_remove, plan.to_change
+        )
+        return self._finish(plan, deferred_remove, deferred_change)
+
+    def _finish(self, plan: ZonePlan, deferred_remove, deferred_change) -> ZonePlan:
         self.client.increase_serial()
-        return to_remove, to_change
+        serial = plan.serial
+        recorded = self.history is not None and not plan.is_empty
+        if recorded or deferred_remove or deferred_change:
+            serial = self.client.fetch_serial()
+        deferred = ZonePlan(
+            plan.target, plan.zone, serial, deferred_remove, deferred_change, plan.bulk
+        )
+        if recorded:
+            version = self.history.record_applied(plan, deferred, serial)
+            log.info("Recorded %s version %d.", plan.zone, version)
+        if not deferred.is_empty:
+            log.warning(
+                "Budget exhausted: %d removals and %d changes deferred to the next run.",
+                len(deferred_remove), len(deferred_change),
+            )
+        return deferred
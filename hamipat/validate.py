@@ -0,0 +1,111 @@
+"""Validation and normalization of records before they are diffed and sent.
+
+PowerDNS rejects a whole PATCH (HTTP 422) for a single malformed rrset,
+which would abort a sync halfway through its chunks. :func:`validate_records`
+runs between :class:`~hamipat.hamnetdb.HamnetDbClient` (and the static
+records) and :class:`~hamipat.updater.ZoneUpdater`: it normalizes what can be
+normalized and quarantines, with a reason, what cannot.
+"""
+import re
+from dataclasses import dataclass
+from typing import Dict, List, Mapping, Tuple
+
+from .config import ZONE_NAME
+from .records import RecordMap, ResourceRecord, ipv4_to_int
+
+# One or more labels of letters, digits, "_" and inner "-", each ending in a
+# dot; an optional leading "*" label. Names are lowercased first.
+_LABEL = r"[a-z0-9_](?:[a-z0-9_-]{0,61}[a-z0-9_])?"
+_NAME_RE = re.compile(rf"(?:\*\.)?(?:{_LABEL}\.)+\Z")
+_MAX_NAME_LENGTH = 254  # presentation form with the trailing dot
+_MAX_TTL = 2**31 - 1
+
+
+@dataclass(frozen=True)
+class Quarantined:
+    """A record left out of the zone, and why."""
+
+    name: str
+    record: ResourceRecord
+    reason: str
+
+
+def validate_records(records: Mapping[str, ResourceRecord], zone: str = ZONE_NAME
+                     ) -> Tuple[RecordMap, List[Quarantined]]:
+    """Split ``records`` into valid, normalized records and quarantined ones.
+
+    Names and CNAME/PTR targets are stripped, lowercased and given their
+    trailing dot, then checked label by label; names must lie in ``zone``.
+    ``A`` contents must parse as IPv4 integers (and are rewritten in
+    canonical form), TXT contents must be quoted, TTLs must be in range and
+    contents must be strings (YAML may hand over numbers or ``None``). A
+    name index catches names that collide after normalization, such as a
+    CNAME next to other data; the first record wins. One pass, in input order.
+    """
+    apex = zone.rstrip(".").lower() + "."
+    suffix = "." + apex
+    valid: RecordMap = {}
+    index: Dict[str, str] = {}  # normalized name -> original name
+    quarantined: List[Quarantined] = []
+
+    for name, record in records.items():
+        normalized = _normalize_name(name)
+        reason = None
+        if not _valid_name(normalized):
+            reason = "invalid name"
+        elif normalized != apex and not normalized.endswith(suffix):
+            reason = f"name outside zone {apex}"
+        else:
+            record, reason = _check_record(record)
+            if reason is None and record.type == "CNAME" and normalized == apex:
+                reason = "CNAME at the zone apex"
+        if reason is None and normalized in index:
+            other = valid[normalized]
+            if "CNAME" in (record.type, other.type):
+                reason = f"{record.type} conflicts with {other.type} at {index[normalized]}"
+            else:
+                reason = f"duplicate of {index[normalized]}"
+        if reason is not None:
+            quarantined.append(Quarantined(name, record, reason))
+            continue
+        index[normalized] = name
+        valid[normalized] = record
+    return valid, quarantined
+
+
+def _normalize_name(name: str) -> str:
+    name = name.strip().lower()
+    return name if name.endswith(".") else name + "."
+
+
+def _valid_name(name: str) -> bool:
+    return len(name) <= _MAX_NAME_LENGTH and _NAME_RE.match(name) is not None
+
+
+def _check_record(record: ResourceRecord):
+    """``(normalized record, None)`` or ``(record, reason)``."""
+    ttl = record.ttl
+    if not isinstance(ttl, int) or not 0 <= ttl <= _MAX_TTL:
+        return record, f"invalid TTL {ttl!r}"
+    rrtype, content = record.type, record.content
+    if not isinstance(content, str):
+        return record, f"{rrtype} content {content!r} is not a string"
+    if rrtype == "A":
+        address = ipv4_to_int(content.strip())
+        if address is None:
+            return record, f"invalid IPv4 address {content!r}"
+        canonical = f"{address >> 24}.{address >> 16 & 255}.{address >> 8 & 255}.{address & 255}"
+        if canonical != content:
+            record = ResourceRecord(rrtype, canonical, ttl)
+    elif rrtype in ("CNAME", "PTR"):
+        target = _normalize_name(content)
+        if not _valid_name(target):
+            return record, f"invalid {rrtype} target {content!r}"
+        if target != content:
+            record = ResourceRecord(rrtype, target, ttl)
+    elif rrtype == "TXT":
+        if len(content) < 2 or content[0] != '"' or content[-1] != '"':
+            return record, "TXT content not quoted"
+    else:
+        return record, f"unsupported type {rrtype}"
+    return record, None
@@ -0,0 +1,73 @@
+"""A local stand-in for a secondary DNS server, for tests.
+
+Answers SOA queries for one zone over UDP on 127.0.0.1 with its current
+serial. A NOTIFY is acknowledged and, ``lag`` seconds later, the stand-in
+"transfers" the zone by taking over ``primary_serial``. With
+``answer_notify=False`` NOTIFYs are dropped and the serial never moves.
+"""
+import socket
+import threading
+
+import dns.flags
+import dns.message
+import dns.opcode
+import dns.rrset
+
+
+class SecondaryStandIn:
+
+    def __init__(self, zone="hamip.at", serial=1, lag=0.0, answer_notify=True):
+        self.zone = zone
+        self.serial = serial
+        self.primary_serial = serial
+        self.lag = lag
+        self.answer_notify = answer_notify
+        self.notifies = 0
+        self.queries = 0
+        self._socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._socket.bind(("127.0.0.1", 0))
+        self._socket.settimeout(0.05)
+        self._closed = threading.Event()
+        self._thread = threading.Thread(target=self._serve, daemon=True)
+        self._thread.start()
+
+    @property
+    def address(self):
+        return self._socket.getsockname()
+
+    def _serve(self):
+        while not self._closed.is_set():
+            try:
+                wire, peer = self._socket.recvfrom(65535)
+            except socket.timeout:
+                continue
+            except OSError:
+                return
+            query = dns.message.from_wire(wire)
+            if query.opcode() == dns.opcode.NOTIFY:
+                self.notifies += 1
+                if not self.answer_notify:
+                    continue
+                timer = threading.Timer(self.lag, self._transfer)
+                timer.daemon = True
+                timer.start()
+                response = dns.message.make_response(query)
+                response.flags |= dns.flags.AA
+            else:
+                self.queries += 1
+                response = dns.message.make_response(query)
+                response.flags |= dns.flags.AA
+                apex = self.zone + "."
+                response.answer.append(dns.rrset.from_text(
+                    apex, 3600, "IN", "SOA",
+                    f"ns.{apex} hostmaster.{apex} {self.serial} 10800 3600 604800 3600",
+                ))
+            self._socket.sendto(response.to_wire(), peer)
+
+    def _transfer(self):
+        self.serial = self.primary_serial
+
+    def close(self):
+        self._closed.set()
+        self._thread.join()
+        self._socket.close()
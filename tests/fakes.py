@@ -0,0 +1,90 @@
+"""Fake HTTP sessions and target helpers for tests that drive ``cli`` runs.
+
+:class:`ZoneSession` stands in for a PowerDNS zone and :class:`HamnetDbSession`
+for HamnetDB; both are plain ``requests``-like objects handed to the real
+clients. :func:`make_target` writes the API key file a target needs, and
+:func:`client_factory` builds the ``client_factory`` that ``cli`` takes.
+"""
+import json
+import os
+
+from hamipat.config import DeltaLimits, Target
+from hamipat.powerdns import PowerDnsClient
+
+
+class FakeResponse:
+    def __init__(self, status_code=200, payload=None):
+        self.status_code = status_code
+        self.ok = status_code < 400
+        self.text = ""
+        self._payload = payload
+
+    def json(self):
+        return self._payload
+
+
+class ZoneSession:
+    """Serves a canned zone document and records every write."""
+
+    def __init__(self, records, serial=7):
+        self.zone = {"serial": serial, "rrsets": [
+            {"name": name, "type": record.type, "ttl": record.ttl,
+             "records": [{"content": record.content}]}
+            for name, record in records.items()
+        ]}
+        self.writes = []
+
+    def get(self, url, headers=None, params=None):
+        return FakeResponse(200, self.zone)
+
+    def patch(self, url, headers=None, data=None):
+        self.writes.append(("PATCH", json.loads(data)))
+        return FakeResponse(204)
+
+    def put(self, url, headers=None, data=None):
+        self.writes.append(("PUT", json.loads(data)))
+        return FakeResponse(204)
+
+
+class HamnetDbSession:
+    """Serves canned HamnetDB host and subnet lists."""
+
+    def __init__(self, hosts, subnets=()):
+        self.hosts = hosts
+        self.subnets = list(subnets)
+
+    def get(self, url, timeout=None):
+        response = FakeResponse(200, self.hosts if "host" in url else self.subnets)
+        response.raise_for_status = lambda: None
+        return response
+
+
+def make_target(directory, name="HamNet", endpoint=None, limits=DeltaLimits(),
+                **kwargs) -> Target:
+    """A :class:`Target` whose API key file is written into ``directory``.
+
+    The endpoint defaults to ``http://<name>/api`` and only "HamNet" is the
+    HamNet target. The limits default to none; ``kwargs`` go to ``Target``.
+    """
+    key_path = os.path.join(directory, "key.asc")
+    with open(key_path, "w") as handle:
+        handle.write("secret\n")
+    return Target(name, endpoint or f"http://{name.lower()}/api", key_path,
+                  name == "HamNet", limits, **kwargs)
+
+
+def client_factory(sessions=None, **kwargs):
+    """A ``cli`` client factory building :class:`PowerDnsClient` objects.
+
+    ``sessions`` maps a zone or a target name to the session of its clients,
+    or is one session for all of them; without it, the clients talk HTTP to
+    the target's endpoint (e.g. a ``PowerDnsStandIn``). ``kwargs`` go to
+    ``PowerDnsClient``.
+    """
+    def factory(target, api_key, zone):
+        session = sessions
+        if isinstance(sessions, dict):
+            session = sessions[zone] if zone in sessions else sessions[target.name]
+        return PowerDnsClient(target.endpoint, api_key, zone=zone, session=session, **kwargs)
+
+    return factory
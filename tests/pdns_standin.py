@@ -0,0 +1,141 @@
+"""A local stand-in for the PowerDNS zone API, for tests and benchmarks.
+
+Serves one zone over HTTP on 127.0.0.1: GET returns the zone document, PATCH
+applies REPLACE/DELETE rrsets (rejecting a patch that names an rrset twice, as
+PowerDNS does), PUT with ``soa_edit_api`` bumps the serial. Responses can be
+overridden by queueing ``(status, retry_after)`` pairs.
+"""
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class _Handler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        with self.server.lock:
+            self.server.requests.append(("GET", None))
+            self._reply(200, self.server.zone_document())
+
+    def do_PATCH(self):
+        self._write(self.server.apply_patch)
+
+    def do_PUT(self):
+        self._write(self.server.apply_put)
+
+    def _write(self, handler):
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        with self.server.lock:
+            self.server.requests.append((self.command, body))
+            if self.server.responses:
+                status, retry = self.server.responses.pop(0)
+                self._reply(status, None, retry)
+                return
+            error = handler(body)
+        if error:
+            self._reply(422, {"error": error})
+        else:
+            self._reply(204)
+
+    def _reply(self, status, payload=None, retry_after=None):
+        data = json.dumps(payload).encode() if payload is not None else b""
+        self.send_response(status)
+        if retry_after is not None:
+            self.send_header("Retry-After", retry_after)
+        if data:
+            self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, zone):
+        super().__init__(("127.0.0.1", 0), _Handler)
+        self.zone = zone
+        self.serial = 1
+        self.lock = threading.Lock()
+        self.requests = []
+        self.responses = []
+        # (name, type) -> {"ttl": ..., "records": [...]}; SOA/NS at the apex.
+        apex = zone + "."
+        self.rrsets = {
+            (apex, "SOA"): {"ttl": 3600, "records": [
+                {"content": f"ns.{apex} hostmaster.{apex} 1 10800 3600 604800 3600"}]},
+            (apex, "NS"): {"ttl": 3600, "records": [{"content": f"ns.{apex}"}]},
+        }
+
+    def zone_document(self):
+        return {
+            "name": self.zone + ".",
+            "serial": self.serial,
+            "rrsets": [
+                {"name": name, "type": rrtype, "ttl": rrset["ttl"], "records": rrset["records"]}
+                for (name, rrtype), rrset in self.rrsets.items()
+            ],
+        }
+
+    def apply_patch(self, body):
+        keys = [(r["name"], r["type"]) for r in body["rrsets"]]
+        if len(keys) != len(set(keys)):
+            return "Duplicate RRset in patch"
+        for rrset in body["rrsets"]:
+            key = (rrset["name"], rrset["type"])
+            if rrset["changetype"] == "DELETE":
+                self.rrsets.pop(key, None)
+            else:
+                self.rrsets[key] = {"ttl": rrset["ttl"], "records": rrset["records"]}
+        return None
+
+    def apply_put(self, body):
+        if body.get("soa_edit_api") == "INCREASE":
+            self.serial += 1
+        return None
+
+
+class PowerDnsStandIn:
+    """Runs the stand-in server on a background thread."""
+
+    def __init__(self, zone="hamip.at"):
+        self.server = _Server(zone)
+        self.thread = threading.Thread(
+            target=self.server.serve_forever, kwargs={"poll_interval": 0.05}, daemon=True)
+        self.thread.start()
+
+    @property
+    def endpoint(self):
+        return f"http://127.0.0.1:{self.server.server_address[1]}/api"
+
+    @property
+    def requests(self):
+        return self.server.requests
+
+    @property
+    def serial(self):
+        return self.server.serial
+
+    def queue(self, *responses):
+        """Answer the next writes with ``(status, retry_after)`` instead."""
+        self.server.responses.extend(responses)
+
+    def load(self, records):
+        """Put a ``RecordMap`` into the zone (bypassing the API)."""
+        for name, record in records.items():
+            self.server.rrsets[(name, record.type)] = {
+                "ttl": record.ttl, "records": [{"content": record.content, "disabled": False}]}
+
+    def rrsets(self):
+        """The zone's rrsets as ``{(name, type): (ttl, [contents])}``."""
+        return {
+            key: (rrset["ttl"], [r["content"] for r in rrset["records"]])
+            for key, rrset in self.server.rrsets.items()
+        }
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
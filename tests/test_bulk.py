@@ -0,0 +1,127 @@
+"""Bulk (single-request) updates against a local PowerDNS API stand-in."""
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from hamipat.config import HAMNET_TARGET  # noqa: E402
+from hamipat.powerdns import PowerDnsClient, PowerDnsError  # noqa: E402
+from hamipat.ratelimit import RequestBudget  # noqa: E402
+from hamipat.records import ResourceRecord  # noqa: E402
+from hamipat.updater import ZoneUpdater  # noqa: E402
+from pdns_standin import PowerDnsStandIn  # noqa: E402
+
+
+def hosts(count, prefix="h", net=0):
+    return {f"{prefix}{i}.hamip.at.": ResourceRecord("A", f"44.143.{net}.{i % 256}", 600)
+            for i in range(count)}
+
+
+class TestBulkUpdates(unittest.TestCase):
+
+    def setUp(self):
+        self.standin = PowerDnsStandIn()
+
+    def tearDown(self):
+        self.standin.close()
+
+    def client(self):
+        return PowerDnsClient(self.standin.endpoint, "key", chunk_size=10)
+
+    def writes(self):
+        return [method for method, _ in self.standin.requests if method != "GET"]
+
+    def managed(self):
+        return {key: value for key, value in self.standin.rrsets().items()
+                if key[1] not in ("SOA", "NS")}
+
+    def test_empty_zone_is_refused_without_cold_start(self):
+        with self.assertRaises(PowerDnsError):
+            ZoneUpdater(self.client()).sync(hosts(5))
+
+    def test_cold_start_fills_zone_in_one_request(self):
+        reference = hosts(25)
+        plan = ZoneUpdater(self.client(), allow_empty=True).plan(reference)
+        self.assertTrue(plan.bulk)
+        ZoneUpdater(self.client()).apply(plan)
+
+        self.assertEqual(self.writes(), ["PATCH", "PUT"])
+        self.assertEqual(len(self.managed()), 25)
+        # SOA and NS are left intact.
+        self.assertIn(("hamip.at.", "SOA"), self.standin.rrsets())
+        self.assertIn(("hamip.at.", "NS"), self.standin.rrsets())
+        self.assertEqual(self.standin.serial, 2)
+
+    def test_large_delta_switches_to_bulk(self):
+        self.standin.load(hosts(20))
+        reference = hosts(10) | hosts(30, prefix="dhcp-", net=1)
+        reference["h0.hamip.at."] = ResourceRecord("CNAME", "h1.hamip.at.", 600)
+        reference["h1.hamip.at."] = ResourceRecord("A", "44.143.9.9", 600)
+
+        to_remove, to_change = ZoneUpdater(self.client(), bulk_ratio=0.5).sync(reference)
+
+        self.assertEqual(self.writes(), ["PATCH", "PUT"])
+        expected = {(name, r.type): (r.ttl, [r.content]) for name, r in reference.items()}
+        self.assertEqual(self.managed(), expected)
+
+    def test_enabling_dhcp_is_bulk_with_the_shipped_hamnet_settings(self):
+        self.standin.load(hosts(3000))
+        reference = hosts(3000) | hosts(2000, prefix="dhcp-", net=1)
+        plan = ZoneUpdater(self.client(), "HamNet", HAMNET_TARGET.limits,
+                           bulk_ratio=HAMNET_TARGET.bulk_ratio).plan(reference)
+        self.assertEqual(len(plan.to_change), 2000)
+        self.assertTrue(plan.bulk)
+
+    def test_bulk_and_chunked_reach_the_same_zone(self):
+        reference = hosts(10) | hosts(30, prefix="dhcp-", net=1)
+
+        self.standin.load(hosts(20))
+        ZoneUpdater(self.client()).sync(reference)
+        chunked_writes = self.writes()
+        chunked_zone = self.managed()
+
+        self.standin.close()
+        self.standin = PowerDnsStandIn()
+        self.standin.load(hosts(20))
+        ZoneUpdater(self.client(), bulk_ratio=0.5).sync(reference)
+
+        self.assertEqual(self.managed(), chunked_zone)
+        self.assertEqual(len(self.writes()), 2)
+        self.assertEqual(len(chunked_writes), 1 + 3 + 1)  # deletes, changes, serial
+
+    def test_bulk_over_body_cap_falls_back_to_chunks(self):
+        reference = hosts(25)
+        plan = ZoneUpdater(self.client(), allow_empty=True).plan(reference)
+        client = PowerDnsClient(self.standin.endpoint, "key", chunk_size=10,
+                                max_chunk_bytes=1500)
+        deferred = ZoneUpdater(client).apply(plan)
+        self.assertTrue(deferred.is_empty)
+        self.assertEqual(len(self.managed()), 25)
+        self.assertGreater(self.writes().count("PATCH"), 1)
+
+    def test_bulk_over_budget_makes_progress_every_run(self):
+        self.standin.load(hosts(10))
+        reference = hosts(10, net=1)
+        for run in range(10):
+            plan = ZoneUpdater(self.client(), bulk_ratio=0.5).plan(reference)
+            if plan.is_empty:
+                break
+            self.assertTrue(plan.bulk or run > 0)
+            client = PowerDnsClient(self.standin.endpoint, "key", chunk_size=2,
+                                    budget=RequestBudget(max_bytes=500))
+            ZoneUpdater(client).apply(plan)
+        self.assertGreater(run, 1)
+        self.assertEqual(self.managed(), {(name, "A"): (600, [r.content])
+                                          for name, r in reference.items()})
+
+    def test_small_delta_stays_chunked(self):
+        self.standin.load(hosts(20))
+        reference = hosts(19)
+        plan = ZoneUpdater(self.client(), bulk_ratio=0.5).plan(reference)
+        self.assertFalse(plan.bulk)
+
+
+if __name__ == "__main__":
+    unittest.main()
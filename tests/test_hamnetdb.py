@@ -117,5 +117,42 @@ class TestFetchDhcp(unittest.TestCase):
         self.assertEqual(len(dhcp), 3)
 
 
+class TestBuildReverse(unittest.TestCase):
+
+    def test_ptr_records_for_hamnet_addresses(self):
+        records = {
+            "web.oe3xnr.hamip.at.": ResourceRecord("A", "44.143.60.66", 600),
+            "www.oe3xnr.hamip.at.": ResourceRecord("CNAME", "web.oe3xnr.hamip.at.", 600),
+            "gw.oe1xar.hamip.at.": ResourceRecord("A", "44.143.8.1", 600),
+            "elsewhere.hamip.at.": ResourceRecord("A", "44.128.0.1", 600),
+        }
+        reverse = client_for([]).build_reverse(records)
+        self.assertEqual(reverse, {
+            "1.8.143.44.in-addr.arpa.": ResourceRecord("PTR", "gw.oe1xar.hamip.at.", 600),
+            "66.60.143.44.in-addr.arpa.": ResourceRecord("PTR", "web.oe3xnr.hamip.at.", 600),
+        })
+
+    def test_first_name_wins_and_inetip_names_are_skipped(self):
+        records = {
+            "185-1-2-3-inetip.oe3xnr.hamip.at.": ResourceRecord("A", "44.143.60.1", 600),
+            "router.oe3xnr.hamip.at.": ResourceRecord("A", "44.143.60.1", 600),
+            "dhcp-44-143-60-1.oe3xnr.hamip.at.": ResourceRecord("A", "44.143.60.1", 600),
+        }
+        reverse = client_for([]).build_reverse(records)
+        self.assertEqual(reverse["1.60.143.44.in-addr.arpa."].content, "router.oe3xnr.hamip.at.")
+
+    def test_narrower_zone(self):
+        records = {
+            "a.oe3xnr.hamip.at.": ResourceRecord("A", "44.143.60.66", 600),
+            "b.oe1xar.hamip.at.": ResourceRecord("A", "44.143.8.1", 600),
+        }
+        reverse = client_for([]).build_reverse(records, "60.143.44.in-addr.arpa")
+        self.assertEqual(list(reverse), ["66.60.143.44.in-addr.arpa."])
+
+    def test_rejects_forward_zone(self):
+        with self.assertRaises(ValueError):
+            client_for([]).build_reverse({}, "hamip.at")
+
+
 if __name__ == "__main__":
     unittest.main()
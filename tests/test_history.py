@@ -0,0 +1,194 @@
+"""Tests for the zone history store and rollback."""
+import os
+import sqlite3
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from hamipat import cli  # noqa: E402
+from hamipat.history import HistoryError, HistoryStore  # noqa: E402
+from hamipat.plan import ZonePlan, load_plans  # noqa: E402
+from hamipat.powerdns import PowerDnsClient  # noqa: E402
+from hamipat.ratelimit import RequestBudget  # noqa: E402
+from hamipat.records import ResourceRecord  # noqa: E402
+from hamipat.snapshot import Snapshot  # noqa: E402
+from hamipat.updater import ZoneUpdater  # noqa: E402
+from fakes import client_factory, make_target  # noqa: E402
+from pdns_standin import PowerDnsStandIn  # noqa: E402
+
+ZONE = "hamip.at"
+
+
+def a(ip):
+    return ResourceRecord("A", ip, 600)
+
+
+def delta(before, after):
+    """The ``(to_remove, to_change)`` that ZoneUpdater would apply."""
+    to_remove = {n: r for n, r in before.items() if after.get(n) != r}
+    to_change = {n: r for n, r in after.items() if before.get(n) != r}
+    return to_remove, to_change
+
+
+class TestHistoryStore(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.store = HistoryStore(os.path.join(self.tmp.name, "ISP.sqlite3"), snapshot_every=3)
+        self.addCleanup(self.store.close)
+
+    def states(self, count):
+        """Record ``count`` versions; returns the expected zone per version."""
+        states = [{f"h{i}.hamip.at.": a(f"44.143.0.{i}") for i in range(5)}]
+        self.store.start(ZONE, states[0])
+        for version in range(1, count + 1):
+            state = dict(states[-1])
+            state.pop(f"h{version % 5}.hamip.at.", None)
+            state[f"n{version}.hamip.at."] = a(f"44.143.1.{version}")
+            state["h4.hamip.at."] = a(f"44.143.2.{version}")
+            self.assertEqual(self.store.record(ZONE, *delta(states[-1], state), serial=version),
+                             version)
+            states.append(state)
+        return states
+
+    def test_every_version_is_reconstructed(self):
+        states = self.states(10)
+        self.assertEqual(self.store.latest_version(ZONE), 10)
+        for version, state in enumerate(states):
+            self.assertEqual(self.store.version(ZONE, version), state)
+
+    def test_snapshots_are_taken_periodically(self):
+        self.states(10)
+        db = sqlite3.connect(self.store.path)
+        snapshots = [row[0] for row in db.execute("SELECT version FROM snapshots ORDER BY 1")]
+        db.close()
+        self.assertEqual(snapshots, [0, 3, 6, 9])
+
+    def test_snapshots_are_snapshot_files(self):
+        states = self.states(3)
+        self.assertEqual(sorted(os.listdir(self.store.snapshot_dir)),
+                         ["hamip.at.0.hips", "hamip.at.3.hips"])
+        with Snapshot(os.path.join(self.store.snapshot_dir, "hamip.at.3.hips")) as snapshot:
+            self.assertEqual(dict(snapshot.items()), states[3])
+
+    def test_versions_listing(self):
+        self.states(2)
+        infos = self.store.versions(ZONE)
+        self.assertEqual([(i.version, i.serial, i.removed, i.changed) for i in infos],
+                         [(1, 1, 2, 2), (2, 2, 2, 2)])
+
+    def test_zones_are_independent(self):
+        self.states(2)
+        self.assertIsNone(self.store.latest_version("143.44.in-addr.arpa"))
+        with self.assertRaises(HistoryError):
+            self.store.record("143.44.in-addr.arpa", {}, {"x.": a("44.143.0.1")})
+
+    def test_unknown_version(self):
+        self.states(2)
+        with self.assertRaises(HistoryError):
+            self.store.version(ZONE, 3)
+        with self.assertRaises(HistoryError):
+            self.store.version(ZONE, -1)
+
+    def test_start_does_not_overwrite_history(self):
+        states = self.states(1)
+        self.store.start(ZONE, {})
+        self.assertEqual(self.store.version(ZONE, 0), states[0])
+
+
+class TestRecordedSyncAndRollback(unittest.TestCase):
+
+    GOOD = {f"h{i}.oe1xyz.hamip.at.": a(f"44.143.8.{i}") for i in range(20)}
+
+    def setUp(self):
+        self.standin = PowerDnsStandIn()
+        self.addCleanup(self.standin.close)
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.history_dir = os.path.join(self.tmp.name, "history")
+        self.target = make_target(self.tmp.name, endpoint=self.standin.endpoint)
+        self.factory = client_factory()
+
+    def sync(self, reference):
+        history = HistoryStore.for_target(self.history_dir, "HamNet")
+        try:
+            updater = ZoneUpdater(self.factory(self.target, "key", ZONE), "HamNet", history=history)
+            updater.sync(reference)
+        finally:
+            history.close()
+
+    def zone_records(self):
+        return PowerDnsClient(self.standin.endpoint, "key").fetch_records()
+
+    def test_rollback_applies_minimal_delta_to_chosen_version(self):
+        self.standin.load({"old.hamip.at.": a("44.143.0.1")})
+        self.sync(self.GOOD)
+        # A bad import: half of the hosts vanish, one changes.
+        bad = {n: r for i, (n, r) in enumerate(sorted(self.GOOD.items())) if i % 2}
+        bad["h1.oe1xyz.hamip.at."] = a("10.0.0.1")
+        self.sync(bad)
+        self.assertEqual(self.zone_records(), bad)
+
+        self.standin.requests.clear()
+        plan, deferred = cli.rollback(self.target, ZONE, 1, self.history_dir, self.factory)
+
+        self.assertEqual(self.zone_records(), self.GOOD)
+        self.assertTrue(deferred.is_empty)
+        self.assertEqual(set(plan.to_remove), {"h1.oe1xyz.hamip.at."})
+        self.assertEqual(len(plan.to_change), 11)
+        history = HistoryStore.for_target(self.history_dir, "HamNet")
+        self.addCleanup(history.close)
+        self.assertEqual(history.latest_version(ZONE), 3)
+        self.assertEqual(history.version(ZONE, 0), {"old.hamip.at.": a("44.143.0.1")})
+        self.assertEqual(history.version(ZONE, 3), self.GOOD)
+
+        plan, _ = cli.rollback(self.target, ZONE, 0, self.history_dir, self.factory)
+        self.assertEqual(plan.to_change, {"old.hamip.at.": a("44.143.0.1")})
+
+    def test_versions_carry_the_serial_after_the_apply(self):
+        self.standin.load({"old.hamip.at.": a("44.143.0.1")})
+        self.sync(self.GOOD)
+        self.sync(dict(self.GOOD, **{"new.hamip.at.": a("44.143.9.9")}))
+        history = HistoryStore.for_target(self.history_dir, "HamNet")
+        self.addCleanup(history.close)
+        self.assertEqual([info.serial for info in history.versions(ZONE)], [2, 3])
+        self.assertEqual(self.standin.serial, 3)
+
+    def test_rollback_reports_what_the_budget_deferred(self):
+        self.standin.load({"old.hamip.at.": a("44.143.0.1")})
+        self.sync(self.GOOD)
+        budgeted = client_factory(chunk_size=5, budget=RequestBudget(max_requests=2))
+        plan, deferred = cli.rollback(self.target, ZONE, 0, self.history_dir, budgeted)
+        self.assertEqual(len(plan.to_remove), 20)
+        self.assertEqual(len(deferred.to_remove), 10)
+        self.assertEqual(deferred.serial, self.standin.serial)
+
+    def test_incomplete_rollback_fails_and_writes_the_rest(self):
+        rest = ZonePlan("ISP", ZONE, 8, {"h1.hamip.at.": a("44.143.0.1")}, {})
+        out = os.path.join(self.tmp.name, "rest.ndjson")
+        with mock.patch.object(cli, "rollback", return_value=(rest, rest)):
+            with self.assertRaises(SystemExit) as ctx, self.assertLogs("hamipat.cli", "ERROR"):
+                cli.main(["--rollback", "1", "--target", "ISP", "--deferred-plan", out])
+        self.assertEqual(ctx.exception.code, 1)
+        with open(out) as handle:
+            self.assertEqual(load_plans(handle), [rest])
+
+    def test_applied_plans_are_recorded_once_per_zone(self):
+        self.standin.load(self.GOOD)
+        reference = dict(self.GOOD, **{"new.hamip.at.": a("44.143.9.9")})
+        plans = [ZoneUpdater(self.factory(self.target, "key", ZONE), "HamNet").plan(reference)]
+        cli.apply_plans(plans, (self.target,), self.factory, self.history_dir)
+
+        history = HistoryStore.for_target(self.history_dir, "HamNet")
+        self.addCleanup(history.close)
+        self.assertEqual(history.version(ZONE, 0), self.GOOD)
+        self.assertEqual(history.version(ZONE, 1), reference)
+
+
+if __name__ == "__main__":
+    unittest.main()
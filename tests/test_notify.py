@@ -0,0 +1,107 @@
+"""Tests for the NOTIFY fan-out against local UDP stand-in secondaries."""
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from hamipat import cli  # noqa: E402
+from hamipat.config import NotifySettings, Target  # noqa: E402
+from hamipat.notify import SecondaryNotifier, serial_reached  # noqa: E402
+from hamipat.plan import ZonePlan  # noqa: E402
+from dns_standin import SecondaryStandIn  # noqa: E402
+from fakes import client_factory, make_target  # noqa: E402
+from pdns_standin import PowerDnsStandIn  # noqa: E402
+
+
+class TestSerialReached(unittest.TestCase):
+
+    def test_plain_and_wrapped_serials(self):
+        self.assertTrue(serial_reached(5, 5))
+        self.assertTrue(serial_reached(6, 5))
+        self.assertFalse(serial_reached(4, 5))
+        self.assertTrue(serial_reached(1, 2**32 - 1))
+        self.assertFalse(serial_reached(2**32 - 1, 1))
+
+
+class TestSecondaryNotifier(unittest.TestCase):
+
+    def setUp(self):
+        self.nodes = []
+
+    def tearDown(self):
+        for node in self.nodes:
+            node.close()
+
+    def node(self, **kwargs):
+        node = SecondaryStandIn(serial=4, **kwargs)
+        node.primary_serial = 5
+        self.nodes.append(node)
+        return node
+
+    def test_every_secondary_reaches_the_serial(self):
+        fast, slow = self.node(), self.node(lag=0.2)
+        notifier = SecondaryNotifier([fast.address, slow.address], deadline=2.0,
+                                     poll_interval=0.02, timeout=0.5)
+        reports = notifier.notify("hamip.at", 5)
+
+        self.assertEqual([(r.address, r.port) for r in reports], [fast.address, slow.address])
+        self.assertTrue(all(r.notified and r.converged for r in reports))
+        self.assertEqual([r.serial for r in reports], [5, 5])
+        self.assertLess(reports[0].latency, reports[1].latency)
+        self.assertGreaterEqual(reports[1].latency, 0.2)
+        self.assertEqual((fast.notifies, slow.notifies), (1, 1))
+
+    def test_unresponsive_secondary_misses_the_deadline(self):
+        good, stuck = self.node(), self.node(answer_notify=False)
+        notifier = SecondaryNotifier([good.address, stuck.address], deadline=0.5,
+                                     poll_interval=0.02, timeout=0.1)
+        reports = notifier.notify("hamip.at", 5)
+
+        self.assertTrue(reports[0].converged)
+        self.assertFalse(reports[1].notified)
+        self.assertFalse(reports[1].converged)
+        self.assertEqual(reports[1].serial, 4)
+        self.assertEqual(stuck.notifies, SecondaryNotifier.NOTIFY_ATTEMPTS)
+        self.assertGreater(stuck.queries, 1)
+
+    def test_newer_serial_counts_as_propagated(self):
+        node = self.node()
+        node.primary_serial = 9
+        reports = SecondaryNotifier([node.address], deadline=1.0, poll_interval=0.02,
+                                    timeout=0.5).notify("hamip.at", 5)
+        self.assertEqual(reports[0].serial, 9)
+        self.assertTrue(reports[0].converged)
+
+
+class TestCliNotify(unittest.TestCase):
+
+    def test_applied_zone_is_notified_at_the_primary_serial(self):
+        primary = PowerDnsStandIn()
+        secondary = SecondaryStandIn(serial=1)
+        self.addCleanup(primary.close)
+        self.addCleanup(secondary.close)
+        with tempfile.TemporaryDirectory() as tmp:
+            target = make_target(tmp, endpoint=primary.endpoint,
+                                 notify=NotifySettings((secondary.address,), deadline=2.0,
+                                                       poll_interval=0.02, timeout=0.5))
+            factory = client_factory()
+            plans = [ZonePlan("HamNet", "hamip.at", 1)]
+            cli.apply_plans(plans, (target,), factory)
+            secondary.primary_serial = primary.serial
+            reports = cli.notify_secondaries(plans, (target,), factory)
+
+        self.assertEqual(primary.serial, 2)
+        [report] = reports[("HamNet", "hamip.at")]
+        self.assertTrue(report.converged)
+        self.assertEqual(report.serial, 2)
+
+    def test_targets_without_secondaries_are_skipped(self):
+        target = Target("ISP", "http://isp/api", "/nonexistent", False)
+        self.assertEqual(cli.notify_secondaries([ZonePlan("ISP", "hamip.at", 1)], (target,)), {})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,227 @@
+"""Unit tests for zone plans: serialization and plan/apply equivalence."""
+import io
+import os
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from hamipat import cli  # noqa: E402
+from hamipat.config import REVERSE_ZONE_NAME, ZONE_NAME  # noqa: E402
+from hamipat.hamnetdb import HamnetDbClient  # noqa: E402
+from hamipat.plan import ZonePlan, dump_plans, load_plans  # noqa: E402
+from hamipat.powerdns import PowerDnsClient  # noqa: E402
+from hamipat.records import ResourceRecord  # noqa: E402
+from hamipat.updater import StalePlanError, ZoneUpdater  # noqa: E402
+from fakes import HamnetDbSession, ZoneSession, client_factory, make_target  # noqa: E402
+
+
+def rr(content, rrtype="A"):
+    return ResourceRecord(rrtype, content, 600)
+
+
+CURRENT = {
+    "keep.hamip.at.": rr("44.143.0.1"),
+    "old.hamip.at.": rr("44.143.0.2"),
+    "change.hamip.at.": rr("44.143.0.3"),
+}
+REFERENCE = {
+    "keep.hamip.at.": rr("44.143.0.1"),
+    "change.hamip.at.": rr("keep.hamip.at.", "CNAME"),
+    "new.hamip.at.": rr("44.143.0.4"),
+}
+
+
+class TestZonePlan(unittest.TestCase):
+
+    def test_counts_per_type(self):
+        plan = ZonePlan("ISP", "hamip.at", 7,
+                        to_remove={"a.": rr("1.1.1.1")},
+                        to_change={"a.": rr("b.", "CNAME"), "c.": rr("2.2.2.2")})
+        self.assertEqual(plan.counts(), {
+            "A": {"remove": 1, "change": 1},
+            "CNAME": {"remove": 0, "change": 1},
+        })
+
+    def test_changes_have_before_and_after(self):
+        plan = ZonePlan("ISP", "hamip.at", 7,
+                        to_remove={"a.": rr("1.1.1.1")},
+                        to_change={"a.": rr("1.1.1.2")})
+        self.assertEqual(plan.changes(), [
+            {"name": "a.", "before": ["A", "1.1.1.1", 600], "after": ["A", "1.1.1.2", 600]},
+        ])
+
+    def test_ndjson_round_trip(self):
+        plans = [
+            ZonePlan("ISP", "hamip.at", 7, {"old.": rr("1.1.1.1")}, {"new.": rr("2.2.2.2")}),
+            ZonePlan("HamNet", "hamip.at", 3),
+        ]
+        buffer = io.StringIO()
+        dump_plans(plans, buffer)
+        self.assertEqual(len(buffer.getvalue().splitlines()), 2)
+        buffer.seek(0)
+        self.assertEqual(load_plans(buffer), plans)
+
+
+class TestPlanApply(unittest.TestCase):
+
+    def _client(self, session):
+        return PowerDnsClient("http://x/api", "key", session=session, chunk_size=2)
+
+    def test_plan_does_not_write(self):
+        session = ZoneSession(CURRENT)
+        plan = ZoneUpdater(self._client(session), "ISP").plan(REFERENCE)
+        self.assertEqual(session.writes, [])
+        self.assertEqual(plan.target, "ISP")
+        self.assertEqual(plan.serial, 7)
+        self.assertEqual(set(plan.to_remove), {"old.hamip.at.", "change.hamip.at."})
+        self.assertEqual(set(plan.to_change), {"change.hamip.at.", "new.hamip.at."})
+
+    def test_saved_plan_issues_same_writes_as_live_sync(self):
+        live = ZoneSession(CURRENT)
+        ZoneUpdater(self._client(live)).sync(REFERENCE)
+
+        buffer = io.StringIO()
+        dump_plans([ZoneUpdater(self._client(ZoneSession(CURRENT))).plan(REFERENCE)], buffer)
+        buffer.seek(0)
+
+        replay = ZoneSession(CURRENT)
+        replay.get = None  # applying a plan must not fetch the zone
+        ZoneUpdater(self._client(replay)).apply(load_plans(buffer)[0])
+
+        self.assertEqual(replay.writes, live.writes)
+
+    def test_stale_saved_plan_is_refused(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            target = make_target(tmp, "ISP")
+            zone_plan = ZoneUpdater(self._client(ZoneSession(CURRENT, serial=7))).plan(REFERENCE)
+            zone_plan.target = "ISP"
+            changed = ZoneSession(CURRENT, serial=8)
+            factory = client_factory(changed, chunk_size=2)
+
+            with self.assertRaises(StalePlanError) as ctx:
+                cli.apply_plans([zone_plan], (target,), factory, check_serial=True)
+            self.assertEqual(ctx.exception.serial, 8)
+            self.assertEqual(changed.writes, [])
+
+            changed.zone["serial"] = 7
+            cli.apply_plans([zone_plan], (target,), factory, check_serial=True)
+            self.assertEqual(changed.writes[-1], ("PUT", {"soa_edit_api": "INCREASE"}))
+
+
+class TestCliApplyPlan(unittest.TestCase):
+
+    def apply_saved(self, deferred, *extra):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "plan.ndjson")
+            out = os.path.join(tmp, "deferred.ndjson")
+            with open(path, "w") as handle:
+                dump_plans([ZonePlan("ISP", ZONE_NAME, 7, {}, {"new.": rr("1.1.1.1")})], handle)
+            with open(path) as handle:
+                reviewed = handle.read()
+            with mock.patch.object(cli, "apply_plans", return_value=deferred), \
+                    mock.patch.object(cli, "notify_secondaries"):
+                cli.main(["--apply-plan", path] + [a.format(out=out) for a in extra])
+            with open(path) as handle:
+                self.assertEqual(handle.read(), reviewed)
+            if not os.path.exists(out):
+                return None
+            with open(out) as handle:
+                return load_plans(handle)
+
+    def test_reviewed_plan_is_left_untouched(self):
+        self.assertIsNone(self.apply_saved([]))
+        self.assertIsNone(self.apply_saved([], "--deferred-plan", "{out}"))
+
+    def test_deferred_part_goes_to_its_own_file(self):
+        rest = [ZonePlan("ISP", ZONE_NAME, 8, {}, {"new.": rr("1.1.1.1")})]
+        self.assertIsNone(self.apply_saved(rest))
+        self.assertEqual(self.apply_saved(rest, "--deferred-plan", "{out}"), rest)
+
+    def test_history_is_opt_in(self):
+        with mock.patch.object(cli, "run") as run:
+            cli.main([])
+            cli.main(["--history", "/srv/history"])
+        self.assertEqual([c.kwargs["history_dir"] for c in run.call_args_list],
+                         [None, "/srv/history"])
+
+
+class TestCliPlan(unittest.TestCase):
+
+    class FakeHamnetDb:
+        def fetch_hosts(self):
+            return {"keep.hamip.at.": rr("44.143.0.1")}
+
+    def test_plan_for_every_target_without_writes(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            targets = (make_target(tmp, "ISP"), make_target(tmp, "HamNet"))
+            sessions = {target.name: ZoneSession(CURRENT) for target in targets}
+            plans = cli.plan(targets, os.path.join(tmp, "missing.yaml"),
+                             hamnetdb_client=self.FakeHamnetDb(),
+                             client_factory=client_factory(sessions))
+
+        self.assertEqual([p.target for p in plans], ["ISP", "HamNet"])
+        for zone_plan in plans:
+            self.assertIn("old.hamip.at.", zone_plan.to_remove)
+            self.assertIn("timestamp.hamip.at.", zone_plan.to_change)
+        self.assertEqual([s.writes for s in sessions.values()], [[], []])
+
+
+class TestCliReverseZone(unittest.TestCase):
+
+    HOSTS = [
+        {"site": "oe3xnr", "name": "web.oe3xnr", "ip": "44.143.60.66", "deleted": 0,
+         "aliases": "www.oe3xnr"},
+        {"site": "oe1xar", "name": "gw.oe1xar", "ip": "44.143.8.1", "deleted": 0, "aliases": ""},
+    ]
+    STALE_PTR = {
+        "66.60.143.44.in-addr.arpa.": rr("old.oe3xnr.hamip.at.", "PTR"),
+        "9.9.143.44.in-addr.arpa.": rr("gone.oe9xyz.hamip.at.", "PTR"),
+    }
+
+    def _run(self, sessions):
+        with tempfile.TemporaryDirectory() as tmp:
+            targets = (make_target(tmp, zones=(ZONE_NAME, REVERSE_ZONE_NAME)),)
+            hamnetdb = HamnetDbClient(session=HamnetDbSession(self.HOSTS))
+            return cli.run(targets, os.path.join(tmp, "missing.yaml"),
+                           hamnetdb_client=hamnetdb, client_factory=client_factory(sessions))
+
+    def test_forward_and_reverse_zones_are_synced_from_one_pass(self):
+        sessions = {ZONE_NAME: ZoneSession(CURRENT, serial=7),
+                    REVERSE_ZONE_NAME: ZoneSession(self.STALE_PTR, serial=3)}
+        plans = self._run(sessions)
+
+        self.assertEqual([(p.target, p.zone, p.serial) for p in plans],
+                         [("HamNet", ZONE_NAME, 7), ("HamNet", REVERSE_ZONE_NAME, 3)])
+        reverse = plans[1]
+        self.assertEqual(reverse.to_change, {
+            "66.60.143.44.in-addr.arpa.": rr("web.oe3xnr.hamip.at.", "PTR"),
+            "1.8.143.44.in-addr.arpa.": rr("gw.oe1xar.hamip.at.", "PTR"),
+        })
+        self.assertEqual(set(reverse.to_remove), set(self.STALE_PTR))
+        # Each zone's writes went to its own client, ending with its serial bump.
+        for session in sessions.values():
+            self.assertEqual(session.writes[-1], ("PUT", {"soa_edit_api": "INCREASE"}))
+        ptr_writes = [rrset["name"] for method, body in sessions[REVERSE_ZONE_NAME].writes
+                      if method == "PATCH" for rrset in body["rrsets"]]
+        self.assertTrue(all(name.endswith(".in-addr.arpa.") for name in ptr_writes))
+
+    def test_unchanged_reverse_zone_is_left_alone(self):
+        current_ptr = {
+            "66.60.143.44.in-addr.arpa.": rr("web.oe3xnr.hamip.at.", "PTR"),
+            "1.8.143.44.in-addr.arpa.": rr("gw.oe1xar.hamip.at.", "PTR"),
+        }
+        sessions = {ZONE_NAME: ZoneSession(CURRENT, serial=7),
+                    REVERSE_ZONE_NAME: ZoneSession(current_ptr, serial=3)}
+        plans = self._run(sessions)
+
+        self.assertEqual([p.zone for p in plans], [ZONE_NAME])
+        # No serial bump, so the secondaries do not transfer the zone again.
+        self.assertEqual(sessions[REVERSE_ZONE_NAME].writes, [])
+
+
+if __name__ == "__main__":
+    unittest.main()
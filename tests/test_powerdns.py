@@ -6,10 +6,24 @@ import unittest
 
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from hamipat.powerdns import PowerDnsClient  # noqa: E402
+from hamipat.powerdns import PowerDnsClient, RrsetEncoder  # noqa: E402
 from hamipat.records import ResourceRecord  # noqa: E402
 
 
+def rrset_dict(name, record, delete):
+    """The PowerDNS rrset object, as json.dumps would be given it."""
+    if delete:
+        return {"name": name, "type": record.type, "changetype": "DELETE"}
+    contents = record.content.split(" ") if record.type == "NS" else [record.content]
+    return {
+        "name": name,
+        "type": record.type,
+        "ttl": record.ttl,
+        "changetype": "REPLACE",
+        "records": [{"content": content, "disabled": False} for content in contents],
+    }
+
+
 class FakeResponse:
     def __init__(self, status_code=204):
         self.status_code = status_code
@@ -21,8 +35,10 @@ class RecordingSession:
 
     def __init__(self):
         self.patches = []
+        self.bodies = []
 
     def patch(self, url, headers=None, data=None):
+        self.bodies.append(data)
         self.patches.append(json.loads(data))
         return FakeResponse(204)
 
@@ -38,11 +54,40 @@ class TestParseRecords(unittest.TestCase):
             {"name": "c.hamip.at.", "type": "CNAME", "ttl": 600,
              "records": [{"content": "a.hamip.at."}]},
         ]}
-        records = PowerDnsClient.parse_records(zone)
+        records = PowerDnsClient("http://x/api", "key").parse_records(zone)
         self.assertEqual(set(records), {"a.hamip.at.", "c.hamip.at."})
         self.assertEqual(records["a.hamip.at."],
                          ResourceRecord("A", "44.1.1.1", 600))
 
+    def test_only_delegation_ns_records_are_kept(self):
+        zone = {"name": "hamip.at.", "rrsets": [
+            {"name": "hamip.at.", "type": "NS", "ttl": 3600,
+             "records": [{"content": "ns.hamip.at."}]},
+            {"name": "oe3xnr.hamip.at.", "type": "NS", "ttl": 3600,
+             "records": [{"content": "ns2.hamip.at."}, {"content": "ns1.hamip.at."}]},
+            {"name": "other.hamip.at.", "type": "NS", "ttl": 3600,
+             "records": [{"content": "ns.example.net."}]},
+        ]}
+        records = PowerDnsClient("http://x/api", "key").parse_records(zone, {"oe3xnr.hamip.at."})
+        # The whole rrset is one record, nameservers sorted.
+        self.assertEqual(records, {
+            "oe3xnr.hamip.at.": ResourceRecord("NS", "ns1.hamip.at. ns2.hamip.at.", 3600),
+        })
+        # Without delegations (an unsharded zone) no NS record is managed.
+        self.assertEqual(PowerDnsClient("http://x/api", "key").parse_records(zone), {})
+
+    def test_ptr_records_are_only_kept_in_reverse_zones(self):
+        zone = {"rrsets": [
+            {"name": "a.hamip.at.", "type": "PTR", "ttl": 600,
+             "records": [{"content": "b.example.net."}]},
+            {"name": "1.8.143.44.in-addr.arpa.", "type": "PTR", "ttl": 600,
+             "records": [{"content": "gw.oe1xar.hamip.at."}]},
+        ]}
+        self.assertEqual(PowerDnsClient("http://x/api", "key").parse_records(zone), {})
+        reverse = PowerDnsClient("http://x/api", "key", zone="143.44.in-addr.arpa")
+        self.assertEqual(set(reverse.parse_records(zone)),
+                         {"a.hamip.at.", "1.8.143.44.in-addr.arpa."})
+
 
 class TestPatchGeneration(unittest.TestCase):
 
@@ -73,6 +118,81 @@ class TestPatchGeneration(unittest.TestCase):
         self._client(session, chunk_size=2).replace_records(records)
         self.assertEqual([len(p["rrsets"]) for p in session.patches], [2, 2, 1])
 
+    def test_bulk_sends_one_patch_deletes_first(self):
+        session = RecordingSession()
+        to_remove = {
+            "old.hamip.at.": ResourceRecord("A", "44.1.1.1", 600),
+            "same.hamip.at.": ResourceRecord("A", "44.1.1.2", 600),
+            "retyped.hamip.at.": ResourceRecord("A", "44.1.1.3", 600),
+        }
+        to_change = {
+            "same.hamip.at.": ResourceRecord("A", "44.1.1.9", 600),
+            "retyped.hamip.at.": ResourceRecord("CNAME", "same.hamip.at.", 600),
+        }
+        deferred = self._client(session, chunk_size=1).apply_bulk(to_remove, to_change)
+        self.assertEqual(deferred, ({}, {}))
+        self.assertEqual(len(session.patches), 1)
+        rrsets = [(r["name"], r["type"], r["changetype"]) for r in session.patches[0]["rrsets"]]
+        # The DELETE of an rrset that is REPLACEd anyway is dropped.
+        self.assertEqual(rrsets, [
+            ("old.hamip.at.", "A", "DELETE"),
+            ("retyped.hamip.at.", "A", "DELETE"),
+            ("same.hamip.at.", "A", "REPLACE"),
+            ("retyped.hamip.at.", "CNAME", "REPLACE"),
+        ])
+
+    def test_body_matches_json_dumps(self):
+        session = RecordingSession()
+        records = {
+            "a.hamip.at.": ResourceRecord("A", "44.1.1.1", 600),
+            "timestamp.hamip.at.": ResourceRecord("TXT", '"2024-01-01_00-00-00_000"', 60),
+            "ü.hamip.at.": ResourceRecord("CNAME", "a.hamip.at.", 600),
+            "oe3xnr.hamip.at.": ResourceRecord("NS", "ns1.hamip.at. ns2.hamip.at.", 3600),
+        }
+        self._client(session).replace_records(records)
+        self._client(session).delete_records(records)
+        for delete, body in zip((False, True), session.bodies):
+            expected = json.dumps({"rrsets": [
+                rrset_dict(name, record, delete) for name, record in records.items()
+            ]}).encode()
+            self.assertEqual(body, expected)
+
+    def test_chunks_are_bounded_by_size(self):
+        session = RecordingSession()
+        records = {f"h{i}.hamip.at.": ResourceRecord("A", f"44.0.0.{i}", 600)
+                   for i in range(5)}
+        client = PowerDnsClient("http://x/api", "key", session=session, max_chunk_bytes=300)
+        client.replace_records(records)
+        self.assertEqual([len(p["rrsets"]) for p in session.patches], [2, 2, 1])
+        self.assertTrue(all(len(body) <= 300 for body in session.bodies))
+
+    def test_oversized_rrset_is_sent_alone(self):
+        session = RecordingSession()
+        client = PowerDnsClient("http://x/api", "key", session=session, max_chunk_bytes=10)
+        client.delete_records({"a.hamip.at.": ResourceRecord("A", "44.1.1.1", 600),
+                               "b.hamip.at.": ResourceRecord("A", "44.1.1.2", 600)})
+        self.assertEqual([len(p["rrsets"]) for p in session.patches], [1, 1])
+
+    def test_shared_encoder_encodes_each_rrset_once(self):
+        encoder = RrsetEncoder()
+        records = {f"h{i}.hamip.at.": ResourceRecord("A", f"44.0.0.{i}", 600)
+                   for i in range(3)}
+        first, second = RecordingSession(), RecordingSession()
+        for endpoint, session in (("http://isp/api", first), ("http://hn/api", second)):
+            client = PowerDnsClient(endpoint, "k", session=session, encoder=encoder)
+            client.replace_records(records)
+        self.assertEqual(len(encoder), 3)
+        self.assertEqual(first.bodies, second.bodies)
+
+    def test_encoder_distinguishes_record_values(self):
+        encoder = RrsetEncoder()
+        old = encoder.encode("a.", ResourceRecord("A", "44.1.1.1", 600), False)
+        new = encoder.encode("a.", ResourceRecord("A", "44.1.1.2", 600), False)
+        self.assertNotEqual(old, new)
+        # Deletes do not depend on the record's content.
+        self.assertIs(encoder.encode("a.", ResourceRecord("A", "44.1.1.1", 600), True),
+                      encoder.encode("a.", ResourceRecord("A", "44.1.1.2", 600), True))
+
     def test_empty_records_send_no_request(self):
         session = RecordingSession()
         self._client(session).replace_records({})
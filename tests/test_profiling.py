@@ -0,0 +1,85 @@
+"""Tests for opt-in per-phase profiling of a run driven by fake sessions."""
+import os
+import pstats
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from hamipat import cli, profiling  # noqa: E402
+from hamipat.hamnetdb import HamnetDbClient  # noqa: E402
+from hamipat.records import ResourceRecord  # noqa: E402
+from fakes import HamnetDbSession, ZoneSession, client_factory, make_target  # noqa: E402
+
+HOSTS = [
+    {"site": "oe3xnr", "name": "web.oe3xnr", "ip": "44.143.60.66", "deleted": 0,
+     "aliases": "www.oe3xnr"},
+    {"site": "oe1xar", "name": "gw.oe1xar", "ip": "44.143.8.1", "deleted": 0, "aliases": ""},
+]
+SUBNETS = [
+    {"deleted": 0, "ip": "44.143.60.32/28", "begin_ip": 747584544, "dhcp_range": "35-37"},
+]
+CURRENT = {"old.hamip.at.": ResourceRecord("A", "44.143.0.2", 600)}
+
+
+class TestProfiling(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.addCleanup(profiling.disable)
+
+    def run_with_fakes(self):
+        targets = (make_target(self.tmp.name, "ISP"), make_target(self.tmp.name, "HamNet"))
+        sessions = {t.name: ZoneSession(CURRENT) for t in targets}
+        hamnetdb = HamnetDbClient(session=HamnetDbSession(HOSTS, SUBNETS))
+        with mock.patch.object(cli, "USE_DHCP", True):
+            cli.run(targets, os.path.join(self.tmp.name, "missing.yaml"),
+                    hamnetdb_client=hamnetdb, client_factory=client_factory(sessions))
+
+    def test_disabled_phases_are_a_shared_no_op(self):
+        self.assertIs(profiling.phase("a"), profiling.phase("b"))
+        self.run_with_fakes()
+        self.assertIsNone(profiling.disable())
+
+    def test_every_phase_is_profiled(self):
+        directory = os.path.join(self.tmp.name, "profile")
+        profiling.enable(directory)
+        self.run_with_fakes()
+        paths = profiling.disable().write()
+
+        files = sorted(os.path.basename(path) for path in paths)
+        self.assertEqual(files, sorted([
+            "hamnetdb_fetch.pstats", "fetch_hosts.pstats", "fetch_dhcp.pstats",
+            "static_load.pstats", "validate.pstats",
+            "fetch_zone.ISP.hamip.at.pstats", "diff.ISP.hamip.at.pstats",
+            "patch.ISP.hamip.at.pstats",
+            "fetch_zone.HamNet.hamip.at.pstats", "diff.HamNet.hamip.at.pstats",
+            "patch.HamNet.hamip.at.pstats",
+            profiling.COLLAPSED_FILE,
+        ]))
+        stats = pstats.Stats(os.path.join(directory, "fetch_hosts.pstats"))
+        profiled = {name for _, _, name in stats.stats}
+        self.assertIn("fetch_hosts", profiled)
+        # The HamnetDB download inside fetch_hosts is its own phase.
+        self.assertNotIn("get", profiled)
+        self.assertIn("get", {name for _, _, name in pstats.Stats(
+            os.path.join(directory, "hamnetdb_fetch.pstats")).stats})
+
+        with open(os.path.join(directory, profiling.COLLAPSED_FILE)) as handle:
+            lines = handle.read().splitlines()
+        roots = {line.split(";", 1)[0] for line in lines}
+        self.assertTrue({"fetch_hosts", "diff.ISP.hamip.at", "patch.HamNet.hamip.at"} <= roots)
+        for line in lines:
+            stack, micros = line.rsplit(" ", 1)
+            self.assertGreater(int(micros), 0)
+            self.assertTrue(stack)
+        self.assertTrue(any("patch.ISP.hamip.at;" in line and "_send_patch" in line
+                            for line in lines))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,11 +1,12 @@
-"""Unit tests for hamipat.pubip.extract_ip_and_domain."""
+"""Unit tests for hamipat.pubip (extract_ip_and_domain, PublicIpRecords)."""
 import os
 import sys
 import unittest
 
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from hamipat.pubip import extract_ip_and_domain  # noqa: E402
+from hamipat.pubip import PublicIpRecords, extract_ip_and_domain  # noqa: E402
+from hamipat.records import ResourceRecord  # noqa: E402
 
 
 class TestExtractIpAndDomain(unittest.TestCase):
@@ -41,5 +42,43 @@ class TestExtractIpAndDomain(unittest.TestCase):
         self.assertEqual(domain, "x.hamip.at.")
 
 
+class TestPublicIpRecords(unittest.TestCase):
+
+    NAMES = [
+        "185-236-164-044-inetip.wx.oe3gwu.hamip.at.",
+        "web.oe3xnr.hamip.at.",
+        "999-1-1-1-inetip.bad.oe3xnr.hamip.at.",
+        "89-185-96-125-inetip.oe1xab.hamip.at.",
+    ]
+
+    def test_public_a_records_for_inetip_names(self):
+        records = PublicIpRecords().build(self.NAMES)
+        self.assertEqual(records, {
+            "wx.oe3gwu.hamip.at.": ResourceRecord("A", "185.236.164.44", 600),
+            "oe1xab.hamip.at.": ResourceRecord("A", "89.185.96.125", 600),
+        })
+
+    def test_name_must_start_with_the_address(self):
+        records = PublicIpRecords().build(["x185-236-164-44-inetip.wx.hamip.at."])
+        self.assertEqual(records, {})
+
+    def test_first_name_wins_for_duplicate_domains(self):
+        records = PublicIpRecords().build([
+            "1-1-1-1-inetip.wx.hamip.at.", "2-2-2-2-inetip.wx.hamip.at.",
+        ])
+        self.assertEqual(records["wx.hamip.at."].content, "1.1.1.1")
+
+    def test_only_new_names_are_rescanned(self):
+        stage = PublicIpRecords()
+        stage.build(self.NAMES)
+        self.assertEqual(stage.last_scanned, 4)
+
+        names = self.NAMES[1:] + ["1-2-3-4-inetip.new.hamip.at."]
+        records = stage.build(names)
+        self.assertEqual(stage.last_scanned, 1)
+        # The removed name's record is gone, the new one is present.
+        self.assertEqual(set(records), {"oe1xab.hamip.at.", "new.hamip.at."})
+
+
 if __name__ == "__main__":
     unittest.main()
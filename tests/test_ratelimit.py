@@ -0,0 +1,174 @@
+"""Tests for write pacing, 429 handling and per-run budgets.
+
+PowerDNS is stood in for by a local HTTP server; time is a fake clock whose
+``sleep`` advances it, so request spacing is asserted without waiting.
+"""
+import os
+import sys
+import unittest
+
+import requests
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from hamipat.plan import ZonePlan  # noqa: E402
+from hamipat.powerdns import PowerDnsClient  # noqa: E402
+from hamipat.ratelimit import RequestBudget, TokenBucket, retry_after  # noqa: E402
+from hamipat.records import ResourceRecord  # noqa: E402
+from hamipat.updater import ZoneUpdater  # noqa: E402
+from pdns_standin import PowerDnsStandIn  # noqa: E402
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+class TimedSession:
+    """A real HTTP session that notes the fake-clock time of every write."""
+
+    def __init__(self, clock):
+        self.clock = clock
+        self.sent_at = []
+        self._session = requests.Session()
+
+    def get(self, url, **kwargs):
+        return self._session.get(url, **kwargs)
+
+    def patch(self, url, **kwargs):
+        self.sent_at.append(self.clock())
+        return self._session.patch(url, **kwargs)
+
+    def put(self, url, **kwargs):
+        self.sent_at.append(self.clock())
+        return self._session.put(url, **kwargs)
+
+    def close(self):
+        self._session.close()
+
+
+def records(count):
+    return {f"h{i}.hamip.at.": ResourceRecord("A", f"44.143.0.{i}", 600) for i in range(count)}
+
+
+class TestRateLimitedClient(unittest.TestCase):
+
+    def setUp(self):
+        self.standin = PowerDnsStandIn()
+        self.clock = FakeClock()
+        self.session = TimedSession(self.clock)
+
+    def tearDown(self):
+        self.session.close()
+        self.standin.close()
+
+    def client(self, rate=None, burst=1, budget=None, chunk_size=1):
+        bucket = TokenBucket(rate, burst, clock=self.clock, sleep=self.clock.sleep)
+        return PowerDnsClient(self.standin.endpoint, "key", session=self.session,
+                              chunk_size=chunk_size, rate_limiter=bucket, budget=budget)
+
+    def test_requests_are_spaced_by_rate(self):
+        self.client(rate=2.0).replace_records(records(4))
+        self.assertEqual(self.session.sent_at, [0.0, 0.5, 1.0, 1.5])
+        self.assertEqual(len(self.standin.requests), 4)
+
+    def test_burst_is_sent_back_to_back(self):
+        self.client(rate=1.0, burst=3).replace_records(records(4))
+        self.assertEqual(self.session.sent_at, [0.0, 0.0, 0.0, 1.0])
+
+    def test_retry_after_is_honored(self):
+        self.standin.queue((429, "3"))
+        remaining = self.client(rate=10.0).replace_records(records(2))
+        self.assertEqual(remaining, {})
+        self.assertEqual(self.session.sent_at[:2], [0.0, 3.0])
+        # The retried chunk is resent, then the second chunk follows at pace.
+        sent = [body["rrsets"][0]["name"] for _, body in self.standin.requests]
+        self.assertEqual(sent, ["h0.hamip.at.", "h0.hamip.at.", "h1.hamip.at."])
+        self.assertAlmostEqual(self.session.sent_at[2], 3.1)
+
+    def test_exponential_backoff_without_retry_after(self):
+        self.standin.queue((429, None), (503, None), (429, None))
+        self.client().replace_records(records(1))
+        self.assertEqual(self.session.sent_at, [0.0, 1.0, 3.0, 7.0])
+
+    def test_budget_exhaustion_defers_remaining_records(self):
+        budget = RequestBudget(max_requests=2)
+        remaining = self.client(budget=budget).replace_records(records(5))
+        self.assertEqual(len(self.standin.requests), 2)
+        self.assertEqual(set(remaining), {"h2.hamip.at.", "h3.hamip.at.", "h4.hamip.at."})
+
+    def test_byte_budget(self):
+        budget = RequestBudget(max_bytes=400)
+        remaining = self.client(budget=budget, chunk_size=2).replace_records(records(4))
+        self.assertEqual(len(self.standin.requests), 1)
+        self.assertEqual(len(remaining), 2)
+        self.assertLessEqual(budget.bytes, 400)
+
+    def test_retries_count_against_budget(self):
+        self.standin.queue((429, "1"), (429, "1"))
+        remaining = self.client(budget=RequestBudget(max_requests=2)).replace_records(records(1))
+        self.assertEqual(len(self.standin.requests), 2)
+        self.assertEqual(set(remaining), {"h0.hamip.at."})
+
+    def test_updater_carries_deferred_delta_over(self):
+        client = self.client(budget=RequestBudget(max_requests=3))
+        plan = ZonePlan("ISP", "hamip.at", 1, to_remove=records(2),
+                        to_change={f"n{i}.hamip.at.": ResourceRecord("A", "44.143.1.1", 600)
+                                   for i in range(3)})
+        deferred = ZoneUpdater(client, "ISP").apply(plan)
+        self.assertEqual(deferred.to_remove, {})
+        self.assertEqual(set(deferred.to_change), {"n1.hamip.at.", "n2.hamip.at."})
+        # The remainder is a plan against the bumped serial.
+        self.assertEqual(deferred.serial, self.standin.serial)
+        self.assertEqual(deferred.serial, 2)
+        # The serial bump is not charged to the exhausted budget.
+        writes = [request for request in self.standin.requests if request[0] != "GET"]
+        self.assertEqual(writes[-1], ("PUT", {"soa_edit_api": "INCREASE"}))
+
+    def test_deferral_never_leaves_a_changed_name_missing(self):
+        current = records(10)
+        self.standin.load(current)
+        changed = {name: ResourceRecord("A", "44.143.9.9", 600) for name in current}
+        changed["h0.hamip.at."] = ResourceRecord("CNAME", "h1.hamip.at.", 600)
+        plan = ZonePlan("ISP", "hamip.at", 1, to_remove=current, to_change=changed)
+        deferred = ZoneUpdater(self.client(budget=RequestBudget(max_requests=3))).apply(plan)
+
+        zone = self.standin.rrsets()
+        for name in current:
+            self.assertTrue(any(key[0] == name for key in zone), name)
+        self.assertEqual(len(deferred.to_change), 7)
+        self.assertEqual(set(deferred.to_remove), set(deferred.to_change))
+        # The type change went out as DELETE + REPLACE in one PATCH.
+        first = self.standin.requests[0][1]["rrsets"]
+        self.assertEqual([(r["name"], r["type"], r["changetype"]) for r in first], [
+            ("h0.hamip.at.", "A", "DELETE"), ("h0.hamip.at.", "CNAME", "REPLACE")])
+
+
+class TestRetryAfter(unittest.TestCase):
+
+    class Response:
+        def __init__(self, value):
+            self.headers = {"Retry-After": value} if value is not None else {}
+
+    def test_seconds(self):
+        self.assertEqual(retry_after(self.Response("7")), 7.0)
+
+    def test_http_date(self):
+        delay = retry_after(self.Response("Wed, 21 Oct 2015 07:28:10 GMT"),
+                            now=lambda: 1445412480.0)
+        self.assertEqual(delay, 10.0)
+
+    def test_missing_or_malformed(self):
+        self.assertIsNone(retry_after(self.Response(None)))
+        self.assertIsNone(retry_after(self.Response("soon")))
+
+
+if __name__ == "__main__":
+    unittest.main()
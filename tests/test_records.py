@@ -0,0 +1,44 @@
+"""Unit tests for the LayeredRecordMap view."""
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from hamipat.records import LayeredRecordMap, ResourceRecord  # noqa: E402
+
+
+def rr(content):
+    return ResourceRecord("A", content, 600)
+
+
+class TestLayeredRecordMap(unittest.TestCase):
+
+    def setUp(self):
+        self.base = {"a.": rr("1.1.1.1"), "b.": rr("2.2.2.2")}
+        self.overlay = {"b.": rr("9.9.9.9"), "c.": rr("3.3.3.3")}
+        self.layered = LayeredRecordMap(self.base, self.overlay)
+
+    def test_behaves_like_the_merged_dict(self):
+        merged = self.base | self.overlay
+        self.assertEqual(dict(self.layered), merged)
+        self.assertEqual(len(self.layered), len(merged))
+        self.assertEqual(self.layered, merged)
+
+    def test_overlay_wins_on_lookup(self):
+        self.assertEqual(self.layered["b."], rr("9.9.9.9"))
+        self.assertEqual(self.layered.get("b."), rr("9.9.9.9"))
+        self.assertEqual(self.layered.get("a."), rr("1.1.1.1"))
+        self.assertIsNone(self.layered.get("x."))
+        self.assertIn("c.", self.layered)
+        with self.assertRaises(KeyError):
+            self.layered["x."]
+
+    def test_base_is_not_copied(self):
+        self.base["d."] = rr("4.4.4.4")
+        self.assertEqual(self.layered["d."], rr("4.4.4.4"))
+        self.assertIs(self.layered.base, self.base)
+
+
+if __name__ == "__main__":
+    unittest.main()
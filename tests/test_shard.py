@@ -0,0 +1,258 @@
+"""Tests for per-site child zones: splitting, delegation and sharded syncs."""
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from hamipat import cli  # noqa: E402
+from hamipat.config import ZONE_NAME, DeltaLimits, ShardSettings  # noqa: E402
+from hamipat.hamnetdb import HamnetDbClient  # noqa: E402
+from hamipat.powerdns import PowerDnsClient, PowerDnsError  # noqa: E402
+from hamipat.records import ResourceRecord  # noqa: E402
+from hamipat.shard import split_records  # noqa: E402
+from hamipat.updater import DeltaLimitError  # noqa: E402
+from fakes import HamnetDbSession, make_target  # noqa: E402
+
+SHARDS = ShardSettings((("ns1.hamip.at.", "44.143.0.53"), ("ns2.hamip.at.", "44.143.0.54"),
+                        ("ns.example.net.", None)))
+DELEGATION = ResourceRecord("NS", "ns.example.net. ns1.hamip.at. ns2.hamip.at.", 3600)
+
+
+def rr(content, rrtype="A", ttl=600):
+    return ResourceRecord(rrtype, content, ttl)
+
+
+class TestSplitRecords(unittest.TestCase):
+
+    RECORDS = {
+        "web.oe3xnr.hamip.at.": rr("44.143.60.66"),
+        "www.oe3xnr.hamip.at.": rr("web.oe3xnr.hamip.at.", "CNAME"),
+        "oe3xnr.hamip.at.": rr("www.oe3xnr.hamip.at.", "CNAME"),
+        "gw.oe1xar.hamip.at.": rr("44.143.8.1"),
+        "oe1xar.hamip.at.": rr("gw.oe1xar.hamip.at.", "CNAME"),
+        "h.oe5new.hamip.at.": rr("44.143.9.1"),
+        "x.oe0any.hamip.at.": rr("44.143.0.9"),
+        "oe7bad.hamip.at.": rr("elsewhere.example.", "CNAME"),
+        "h.oe7bad.hamip.at.": rr("44.143.7.1"),
+        "timestamp.hamip.at.": rr('"now"', "TXT", 60),
+    }
+    EXISTING = ["hamip.at", "oe3xnr.hamip.at", "oe1xar.hamip.at", "oe7bad.hamip.at",
+                "oe9gone.hamip.at", "x.oe3xnr.hamip.at", "143.44.in-addr.arpa"]
+
+    def test_sites_move_to_their_child_zones(self):
+        with self.assertLogs("hamipat.shard", "WARNING"):
+            parent, children = split_records(self.RECORDS, ZONE_NAME, SHARDS, self.EXISTING)
+        # Every site zone is a child, even one without records.
+        self.assertEqual(set(children), {"oe3xnr.hamip.at", "oe1xar.hamip.at",
+                                         "oe7bad.hamip.at", "oe9gone.hamip.at"})
+        self.assertEqual(children["oe9gone.hamip.at"], {})
+        # The apex CNAME is flattened along the chain into an A record.
+        self.assertEqual(children["oe3xnr.hamip.at"], {
+            "web.oe3xnr.hamip.at.": rr("44.143.60.66"),
+            "www.oe3xnr.hamip.at.": rr("web.oe3xnr.hamip.at.", "CNAME"),
+            "oe3xnr.hamip.at.": rr("44.143.60.66"),
+        })
+        self.assertEqual(children["oe1xar.hamip.at"]["oe1xar.hamip.at."], rr("44.143.8.1"))
+        # An apex CNAME that does not resolve is left out; the site stays sharded.
+        self.assertEqual(children["oe7bad.hamip.at"], {"h.oe7bad.hamip.at.": rr("44.143.7.1")})
+
+    def test_parent_keeps_the_rest_and_delegates(self):
+        with self.assertLogs("hamipat.shard", "WARNING"):
+            parent, _ = split_records(self.RECORDS, ZONE_NAME, SHARDS, self.EXISTING)
+        self.assertEqual(parent, {
+            # No child zone yet, not a sharded region.
+            "h.oe5new.hamip.at.": rr("44.143.9.1"),
+            "x.oe0any.hamip.at.": rr("44.143.0.9"),
+            "timestamp.hamip.at.": rr('"now"', "TXT", 60),
+            "oe3xnr.hamip.at.": DELEGATION,
+            "oe1xar.hamip.at.": DELEGATION,
+            "oe7bad.hamip.at.": DELEGATION,
+            "oe9gone.hamip.at.": DELEGATION,
+            "ns1.hamip.at.": rr("44.143.0.53", "A", 3600),
+            "ns2.hamip.at.": rr("44.143.0.54", "A", 3600),
+        })
+
+    def test_no_child_zones_no_delegation(self):
+        parent, children = split_records(self.RECORDS, ZONE_NAME, SHARDS, ["hamip.at"])
+        self.assertEqual(children, {})
+        self.assertEqual(parent, self.RECORDS)
+
+
+class ShardedServer:
+    """Zones of a fake PowerDNS; counts the records a secondary would transfer.
+
+    Every serial bump makes each secondary AXFR the whole zone (its records
+    plus SOA and NS).
+    """
+
+    def __init__(self, zones):
+        self.zones = {zone: {} for zone in zones}
+        self.serials = {zone: 1 for zone in zones}
+        self.transferred = {zone: 0 for zone in zones}
+
+    def reset_counts(self):
+        self.transferred = {zone: 0 for zone in self.zones}
+
+
+class FakeZoneClient:
+    """A PowerDNS client for one zone of a :class:`ShardedServer`."""
+
+    def __init__(self, server, zone):
+        self.server = server
+        self.zone = zone
+
+    def list_zones(self):
+        return list(self.server.zones)
+
+    def fetch_zone(self):
+        if self.zone not in self.server.zones:
+            raise PowerDnsError(f"Error fetching zone (404): {self.zone}")
+        apex = self.zone + "."
+        rrsets = [{"name": apex, "type": "NS", "ttl": 3600, "records": [{"content": "ns."}]}]
+        for name, record in self.server.zones[self.zone].items():
+            contents = record.content.split() if record.type == "NS" else [record.content]
+            rrsets.append({"name": name, "type": record.type, "ttl": record.ttl,
+                           "records": [{"content": content} for content in contents]})
+        return {"name": apex, "serial": self.server.serials[self.zone], "rrsets": rrsets}
+
+    def parse_records(self, zone, delegations=()):
+        return PowerDnsClient("http://x/api", "key", self.zone).parse_records(zone, delegations)
+
+    def delete_records(self, records):
+        for name in records:
+            self.server.zones[self.zone].pop(name, None)
+        return {}
+
+    def replace_records(self, records):
+        self.server.zones[self.zone].update(records)
+        return {}
+
+    def apply_delta(self, to_remove, to_change):
+        return self.apply_bulk(to_remove, to_change)
+
+    def apply_bulk(self, to_remove, to_change):
+        self.delete_records(to_remove)
+        self.replace_records(to_change)
+        return {}, {}
+
+    def increase_serial(self):
+        self.server.serials[self.zone] += 1
+        self.server.transferred[self.zone] += len(self.server.zones[self.zone]) + 2
+
+
+def hamnet_hosts(changed=False, dropped=()):
+    """Five hosts on each of 27 sites in three regions, except ``dropped`` sites."""
+    hosts = []
+    for region in (1, 3, 5):
+        for site_number in range(9):
+            site = f"oe{region}x{site_number:02d}"
+            if site in dropped:
+                continue
+            for host in range(5):
+                ip = f"44.143.{region * 10 + site_number}.{host + 1}"
+                if changed and site == "oe3x04" and host == 2:
+                    ip = "44.143.200.1"
+                hosts.append({"site": site, "name": f"h{host}.{site}", "ip": ip,
+                              "deleted": 0, "aliases": f"web.{site}" if host == 0 else ""})
+    return hosts
+
+
+class TestShardedSync(unittest.TestCase):
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.tmp = tmp.name
+        self.static_path = os.path.join(tmp.name, "missing.yaml")
+
+    def sync(self, server, shards, changed=False, first=False, dropped=(),
+             limits=DeltaLimits()):
+        target = make_target(self.tmp, limits=limits, shards=shards)
+
+        def factory(target, api_key, zone):
+            return FakeZoneClient(server, zone)
+
+        hamnetdb = HamnetDbClient(session=HamnetDbSession(hamnet_hosts(changed, dropped)))
+        return cli.run((target,), self.static_path, hamnetdb_client=hamnetdb,
+                       client_factory=factory, cold_start=first)
+
+    def test_single_site_change_transfers_only_parent_and_that_site(self):
+        unsharded = ShardedServer([ZONE_NAME])
+        self.sync(unsharded, None, first=True)
+        unsharded.reset_counts()
+        self.sync(unsharded, None, changed=True)
+
+        sites = sorted({host["site"] for host in hamnet_hosts()})
+        sharded = ShardedServer([ZONE_NAME] + [f"{site}.{ZONE_NAME}" for site in sites])
+        first = self.sync(sharded, SHARDS, first=True)
+        self.assertEqual(len(first), 1 + len(sites))
+        sharded.reset_counts()
+        before = dict(sharded.serials)
+        plans = self.sync(sharded, SHARDS, changed=True)
+
+        # Only the parent (timestamp) and the changed site were planned and applied.
+        self.assertEqual([p.zone for p in plans], [ZONE_NAME, "oe3x04.hamip.at"])
+        self.assertEqual(plans[1].to_change, {"h2.oe3x04.hamip.at.": rr("44.143.200.1")})
+        bumped = {zone for zone, serial in sharded.serials.items() if serial != before[zone]}
+        self.assertEqual(bumped, {ZONE_NAME, "oe3x04.hamip.at"})
+
+        # 27 sites x (5 hosts + 1 alias + site CNAME) + timestamp + SOA/NS.
+        self.assertEqual(unsharded.transferred[ZONE_NAME], 27 * 7 + 1 + 2)
+        # Parent: 27 delegations + 2 glue + timestamp; child: 7 records; each + SOA/NS.
+        self.assertEqual(sum(sharded.transferred.values()), (27 + 3 + 2) + (7 + 2))
+        self.assertEqual(unsharded.zones[ZONE_NAME]["oe3x04.hamip.at."],
+                         rr("h0.oe3x04.hamip.at.", "CNAME"))
+        self.assertEqual(sharded.zones["oe3x04.hamip.at"]["oe3x04.hamip.at."],
+                         rr("44.143.34.1"))
+        self.assertEqual(sharded.zones[ZONE_NAME]["oe3x04.hamip.at."], DELEGATION)
+
+    def test_unchanged_shards_are_not_written(self):
+        sites = sorted({host["site"] for host in hamnet_hosts()})
+        server = ShardedServer([ZONE_NAME] + [f"{site}.{ZONE_NAME}" for site in sites])
+        self.sync(server, SHARDS, first=True)
+        before = dict(server.serials)
+        plans = self.sync(server, SHARDS)
+        self.assertEqual([p.zone for p in plans], [ZONE_NAME])
+        self.assertEqual({z for z, s in server.serials.items() if s != before[z]}, {ZONE_NAME})
+
+    def test_emptied_site_zone_is_cleared_within_the_limits(self):
+        sites = sorted({host["site"] for host in hamnet_hosts()})
+        server = ShardedServer([ZONE_NAME] + [f"{site}.{ZONE_NAME}" for site in sites])
+        self.sync(server, SHARDS, first=True)
+        limits = DeltaLimits(max_removal_ratio=0.2)
+        plans = self.sync(server, SHARDS, dropped=("oe3x04",), limits=limits)
+
+        # All of the child zone goes, but that is 7 of the forward zone's records.
+        self.assertEqual([p.zone for p in plans], [ZONE_NAME, "oe3x04.hamip.at"])
+        self.assertEqual(server.zones["oe3x04.hamip.at"], {})
+        self.assertEqual(server.zones[ZONE_NAME]["oe3x04.hamip.at."], DELEGATION)
+        # Still empty: nothing to do for that zone on the next run.
+        plans = self.sync(server, SHARDS, dropped=("oe3x04",), limits=limits)
+        self.assertEqual([p.zone for p in plans], [ZONE_NAME])
+
+    def test_limits_cover_the_parent_and_child_zones_together(self):
+        sites = sorted({host["site"] for host in hamnet_hosts()})
+        server = ShardedServer([ZONE_NAME] + [f"{site}.{ZONE_NAME}" for site in sites])
+        self.sync(server, SHARDS, first=True)
+        before = {zone: dict(records) for zone, records in server.zones.items()}
+        region = tuple(site for site in sites if site.startswith("oe1"))
+        with self.assertRaises(DeltaLimitError):
+            self.sync(server, SHARDS, dropped=region, limits=DeltaLimits(max_removal_ratio=0.2))
+        self.assertEqual(server.zones, before)
+
+    def test_other_delegations_are_left_alone(self):
+        lab = rr("ns.lab.example.", "NS", 3600)
+        sites = sorted({host["site"] for host in hamnet_hosts()})
+        for shards, zones in ((None, [ZONE_NAME]),
+                              (SHARDS, [ZONE_NAME] + [f"{s}.{ZONE_NAME}" for s in sites])):
+            server = ShardedServer(zones)
+            server.zones[ZONE_NAME]["lab.hamip.at."] = lab
+            self.sync(server, shards, first=True)
+            self.assertEqual(server.zones[ZONE_NAME]["lab.hamip.at."], lab)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,126 @@
+"""Unit tests for binary RecordMap snapshots."""
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from hamipat.records import ResourceRecord  # noqa: E402
+from hamipat.snapshot import Snapshot, diff_snapshots, write_snapshot  # noqa: E402
+from hamipat.updater import diff_records  # noqa: E402
+
+RECORDS = {
+    "web.oe3xnr.hamip.at.": ResourceRecord("A", "44.143.60.66", 600),
+    "www.oe3xnr.hamip.at.": ResourceRecord("CNAME", "web.oe3xnr.hamip.at.", 600),
+    "oe3xnr.hamip.at.": ResourceRecord("CNAME", "web.oe3xnr.hamip.at.", 600),
+    "timestamp.hamip.at.": ResourceRecord("TXT", '"2024-01-01_00-00-00_000"', 60),
+    "gw.oe1xär.hamip.at.": ResourceRecord("A", "44.143.8.1", 3600),
+}
+
+
+class TestSnapshot(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+
+    def snapshot(self, records, name="zone.snap"):
+        path = os.path.join(self.tmp.name, name)
+        write_snapshot(records, path)
+        snapshot = Snapshot(path)
+        self.addCleanup(snapshot.close)
+        return snapshot
+
+    def test_round_trip(self):
+        snapshot = self.snapshot(RECORDS)
+        self.assertEqual(len(snapshot), len(RECORDS))
+        self.assertEqual(dict(snapshot.items()), RECORDS)
+        self.assertEqual(list(snapshot.values()), [RECORDS[n] for n in sorted(RECORDS)])
+        self.assertEqual(snapshot.types, ["A", "CNAME", "TXT"])
+
+    def test_lookup(self):
+        snapshot = self.snapshot(RECORDS)
+        for name, record in RECORDS.items():
+            self.assertEqual(snapshot[name], record)
+            self.assertIn(name, snapshot)
+        self.assertNotIn("missing.hamip.at.", snapshot)
+        self.assertNotIn("a", snapshot)
+        self.assertNotIn("zzz", snapshot)
+        self.assertIsNone(snapshot.get("missing.hamip.at."))
+        with self.assertRaises(KeyError):
+            snapshot["missing.hamip.at."]
+
+    def test_iteration_is_sorted(self):
+        self.assertEqual(list(self.snapshot(RECORDS)), sorted(RECORDS))
+
+    def test_strings_are_stored_once(self):
+        path = os.path.join(self.tmp.name, "zone.snap")
+        write_snapshot(RECORDS, path)
+        with open(path, "rb") as handle:
+            self.assertEqual(handle.read().count(b"web.oe3xnr.hamip.at."), 1)
+
+    def test_empty(self):
+        snapshot = self.snapshot({})
+        self.assertEqual(len(snapshot), 0)
+        self.assertEqual(list(snapshot), [])
+        self.assertNotIn("x", snapshot)
+
+    def test_diff_matches_dict_diff(self):
+        reference = dict(RECORDS)
+        del reference["oe3xnr.hamip.at."]
+        reference["www.oe3xnr.hamip.at."] = ResourceRecord("A", "44.143.60.67", 600)
+        reference["timestamp.hamip.at."] = ResourceRecord("TXT", '"later"', 60)
+        reference["a.oe1xyz.hamip.at."] = ResourceRecord("A", "44.143.8.2", 600)
+        reference["zz.oe9xyz.hamip.at."] = ResourceRecord("A", "44.143.9.2", 600)
+        old = self.snapshot(RECORDS, "old.snap")
+        new = self.snapshot(reference, "new.snap")
+        self.assertEqual(diff_snapshots(old, new), diff_records(RECORDS, reference))
+        self.assertEqual(diff_snapshots(old, old), ({}, {}))
+
+    def test_ttl_change_is_a_difference(self):
+        changed = dict(RECORDS)
+        changed["web.oe3xnr.hamip.at."] = ResourceRecord("A", "44.143.60.66", 60)
+        to_remove, to_change = diff_snapshots(self.snapshot(RECORDS, "a.snap"),
+                                              self.snapshot(changed, "b.snap"))
+        self.assertEqual(set(to_remove), {"web.oe3xnr.hamip.at."})
+        self.assertEqual(to_change["web.oe3xnr.hamip.at."].ttl, 60)
+
+    def test_close_ends_live_iterators(self):
+        path = os.path.join(self.tmp.name, "zone.snap")
+        write_snapshot(RECORDS, path)
+        with Snapshot(path) as snapshot:
+            names = iter(snapshot)
+            self.assertEqual(next(names), sorted(RECORDS)[0])
+            items = iter(snapshot.items())
+            next(items)
+        self.assertEqual(list(names), [])
+
+    def test_invalid_ttl_is_rejected(self):
+        path = os.path.join(self.tmp.name, "zone.snap")
+        for ttl in (None, -1, 2 ** 32, "600"):
+            with self.assertRaisesRegex(ValueError, "TTL"):
+                write_snapshot({"a.hamip.at.": ResourceRecord("A", "44.143.0.1", ttl)}, path)
+        self.assertFalse(os.path.exists(path))
+
+    def test_rejects_other_files(self):
+        path = os.path.join(self.tmp.name, "zone.json")
+        with open(path, "wb") as handle:
+            handle.write(b"{" + b" " * 64 + b"}")
+        with self.assertRaises(ValueError):
+            Snapshot(path)
+
+    def test_rejects_truncated_files(self):
+        path = os.path.join(self.tmp.name, "zone.snap")
+        write_snapshot(RECORDS, path)
+        with open(path, "rb") as handle:
+            data = handle.read()
+        for length in (0, 10, len(data) // 2, len(data) - 1):
+            with open(path, "wb") as handle:
+                handle.write(data[:length])
+            with self.assertRaises(ValueError):
+                Snapshot(path)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,207 @@
+"""Tests for triggered syncs: debounce, coalescing and one sync at a time.
+
+Time is a fake clock and syncs run on a manual executor, so a sync is "in
+flight" until the test finishes it.
+"""
+import io
+import os
+import sys
+import tempfile
+import threading
+import unittest
+import urllib.error
+import urllib.request
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from hamipat import cli  # noqa: E402
+from hamipat.config import Target  # noqa: E402
+from hamipat.records import ResourceRecord  # noqa: E402
+from hamipat.trigger import SyncScheduler, read_triggers, serve_http  # noqa: E402
+from fakes import ZoneSession, client_factory, make_target  # noqa: E402
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class ManualExecutor:
+    """Holds submitted syncs until :meth:`finish` runs them."""
+
+    def __init__(self):
+        self.jobs = []
+
+    def submit(self, fn, *args):
+        self.jobs.append((fn, args))
+
+    def finish(self):
+        fn, args = self.jobs.pop(0)
+        fn(*args)
+
+
+TARGETS = (Target("ISP", "http://isp/api", "/key", False),
+           Target("HamNet", "http://hamnet/api", "/key", True))
+
+
+class TestSyncScheduler(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.executor = ManualExecutor()
+        self.synced = []
+        self.scheduler = SyncScheduler(
+            lambda targets: self.synced.append(tuple(t.name for t in targets)),
+            TARGETS, debounce=5.0, max_delay=30.0, clock=self.clock, executor=self.executor,
+        )
+
+    def advance(self, seconds):
+        self.clock.now += seconds
+        return self.scheduler.start_due()
+
+    def test_burst_is_coalesced_into_one_sync(self):
+        for _ in range(10):
+            self.scheduler.trigger()
+            self.assertEqual(self.advance(1.0), [])
+        self.assertEqual(self.advance(4.0), ["ISP", "HamNet"])
+        self.executor.finish()
+        self.assertEqual(self.synced, [("ISP", "HamNet")])
+        self.assertEqual(self.advance(60.0), [])
+
+    def test_steady_triggers_sync_after_max_delay(self):
+        started_at = []
+        for _ in range(40):
+            self.scheduler.trigger(["ISP"])
+            if self.advance(1.0):
+                started_at.append(self.clock.now)
+        # The first trigger came at 0: the burst never went quiet for 5 s.
+        self.assertEqual(started_at, [30.0])
+
+    def test_triggers_during_a_sync_queue_one_follow_up(self):
+        self.scheduler.trigger(["ISP"])
+        self.assertEqual(self.advance(5.0), ["ISP"])
+        for _ in range(3):
+            self.scheduler.trigger(["ISP"])
+            self.assertEqual(self.advance(10.0), [])  # still in flight
+        self.assertEqual(len(self.executor.jobs), 1)
+        self.executor.finish()
+        self.assertEqual(self.advance(0.0), ["ISP"])
+        self.executor.finish()
+        self.assertEqual(self.synced, [("ISP",), ("ISP",)])
+        self.assertTrue(self.scheduler.idle())
+
+    def test_targets_due_during_a_sync_are_merged_into_the_next(self):
+        self.scheduler.trigger(["ISP"])
+        self.assertEqual(self.advance(5.0), ["ISP"])
+        self.scheduler.trigger(["HamNet"])
+        self.assertEqual(self.advance(5.0), [])  # the ISP sync is still running
+        self.scheduler.trigger(["ISP"])
+        self.assertEqual(self.advance(5.0), [])
+        self.assertEqual(len(self.executor.jobs), 1)
+        self.executor.finish()
+        self.assertEqual(self.advance(0.0), ["ISP", "HamNet"])
+        self.executor.finish()
+        self.assertEqual(self.synced, [("ISP",), ("ISP", "HamNet")])
+
+    def test_failed_sync_frees_the_target(self):
+        scheduler = SyncScheduler(lambda targets: 1 / 0, TARGETS, debounce=0.0,
+                                  clock=self.clock, executor=self.executor)
+        scheduler.trigger(["ISP"])
+        scheduler.start_due()
+        with self.assertLogs("hamipat.trigger", "ERROR"):
+            self.executor.finish()
+        scheduler.trigger(["ISP"])
+        self.assertEqual(scheduler.start_due(), ["ISP"])
+
+    def test_unknown_target_is_rejected(self):
+        with self.assertRaises(KeyError):
+            self.scheduler.trigger(["ISP", "nope"])
+        self.assertIsNone(self.scheduler.next_due())
+
+
+class TestTriggerSources(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.executor = ManualExecutor()
+        self.scheduler = SyncScheduler(lambda targets: None, TARGETS, debounce=5.0,
+                                       clock=self.clock, executor=self.executor)
+
+    def test_trigger_lines(self):
+        read_triggers(self.scheduler, io.StringIO("ISP\nbogus\n"))
+        self.clock.now = 5.0
+        self.assertEqual(self.scheduler.start_due(), ["ISP"])
+        read_triggers(self.scheduler, io.StringIO("all\n"))
+        self.clock.now = 10.0
+        self.assertEqual(self.scheduler.start_due(), [])  # ISP still in flight
+        self.executor.finish()
+        self.assertEqual(self.scheduler.start_due(), ["ISP", "HamNet"])
+
+    def test_http_endpoint(self):
+        server = serve_http(self.scheduler, "127.0.0.1", 0)
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        base = "http://127.0.0.1:%d" % server.server_address[1]
+
+        def post(path):
+            request = urllib.request.Request(base + path, data=b"", method="POST")
+            try:
+                with urllib.request.urlopen(request) as response:
+                    return response.status
+            except urllib.error.HTTPError as exc:
+                return exc.code
+
+        self.assertEqual(post("/sync/HamNet"), 202)
+        self.assertEqual(post("/sync/nope"), 404)
+        self.assertEqual(post("/other"), 404)
+        self.assertEqual(self.scheduler.next_due(), 5.0)
+        self.assertEqual(post("/sync"), 202)
+        self.clock.now = 5.0
+        self.assertEqual(self.scheduler.start_due(), ["ISP", "HamNet"])
+
+
+class TestTriggeredRuns(unittest.TestCase):
+
+    class FakeHamnetDb:
+        def __init__(self):
+            self.fetches = 0
+
+        def fetch_hosts(self):
+            self.fetches += 1
+            return {"keep.hamip.at.": ResourceRecord("A", "44.143.0.1", 600)}
+
+    def test_burst_of_triggers_runs_each_target_once(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            targets = tuple(make_target(tmp, t.name) for t in TARGETS)
+            hamnetdb = self.FakeHamnetDb()
+            sessions = {t.name: ZoneSession({"keep.hamip.at.": ResourceRecord(
+                "A", "44.143.0.1", 600)}) for t in targets}
+            factory = client_factory(sessions)
+
+            def sync(due):
+                cli.run(due, os.path.join(tmp, "missing.yaml"),
+                        hamnetdb_client=hamnetdb, client_factory=factory)
+
+            clock = FakeClock()
+            scheduler = SyncScheduler(sync, targets, debounce=2.0, clock=clock)
+            stop = threading.Event()
+            for _ in range(25):
+                scheduler.trigger()
+                clock.now += 0.1
+            clock.now += 2.0
+            stop.set()
+            scheduler.run_forever(stop)
+
+        self.assertEqual(scheduler.syncs, 1)
+        self.assertEqual(hamnetdb.fetches, 1)
+        for session in sessions.values():
+            serial_bumps = [w for w in session.writes if w[0] == "PUT"]
+            self.assertEqual(len(serial_bumps), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -5,9 +5,15 @@ import unittest
 
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
+from hamipat.config import DeltaLimits  # noqa: E402
 from hamipat.powerdns import PowerDnsClient, PowerDnsError  # noqa: E402
-from hamipat.records import ResourceRecord  # noqa: E402
-from hamipat.updater import ZoneUpdater  # noqa: E402
+from hamipat.records import LayeredRecordMap, ResourceRecord  # noqa: E402
+from hamipat.updater import (  # noqa: E402
+    DeltaLimitError,
+    SharedBaseDiff,
+    ZoneUpdater,
+    diff_records,
+)
 
 
 def rr(content):
@@ -29,14 +35,13 @@ class FakeClient:
 
     # ZoneUpdater calls parse_records on whatever fetch_zone returned; reuse the
     # real (static) implementation, but return our canned record set.
-    def parse_records(self, zone):
+    def parse_records(self, zone, delegations=()):
         return dict(self._current)
 
-    def delete_records(self, records):
-        self.deleted = records
-
-    def replace_records(self, records):
-        self.replaced = records
+    def apply_delta(self, to_remove, to_change):
+        self.deleted = to_remove
+        self.replaced = to_change
+        return {}, {}
 
     def increase_serial(self):
         self.serial_bumped = True
@@ -83,5 +88,115 @@ class TestZoneUpdaterSync(unittest.TestCase):
             ZoneUpdater(client).sync({"keep.hamip.at.": rr("1.1.1.1")})
 
 
+class TestDeltaLimits(unittest.TestCase):
+
+    def setUp(self):
+        self.current = {f"h{i}.hamip.at.": rr(f"44.143.0.{i}") for i in range(10)}
+
+    def assert_refused(self, reference, limits):
+        client = FakeClient(self.current)
+        with self.assertRaises(DeltaLimitError) as ctx:
+            ZoneUpdater(client, "ISP", limits).sync(reference)
+        # Nothing was written: the live zone stays the last good snapshot.
+        self.assertIsNone(client.deleted)
+        self.assertIsNone(client.replaced)
+        self.assertFalse(client.serial_bumped)
+        return ctx.exception
+
+    def test_max_removals(self):
+        reference = dict(list(self.current.items())[:7])
+        exc = self.assert_refused(reference, DeltaLimits(max_removals=2))
+        self.assertEqual(len(exc.plan.to_remove), 3)
+        self.assertIn("3 removals > 2", str(exc))
+
+    def test_max_removal_ratio(self):
+        reference = dict(list(self.current.items())[:5])
+        exc = self.assert_refused(reference, DeltaLimits(max_removal_ratio=0.3))
+        self.assertIn("50.0% of 10 records removed", str(exc))
+
+    def test_max_changes_per_type(self):
+        reference = dict(self.current)
+        reference.update({
+            f"h{i}.hamip.at.": ResourceRecord("CNAME", "www.hamip.at.", 600) for i in range(4)
+        })
+        exc = self.assert_refused(reference, DeltaLimits(max_changes_per_type=3))
+        # A retyped name counts for its old and its new type.
+        self.assertEqual(exc.violations, ["4 A changes > 3", "4 CNAME changes > 3"])
+
+    def test_additions_are_not_limited(self):
+        reference = dict(self.current)
+        reference.update({f"d{i}.hamip.at.": rr(f"44.143.1.{i}") for i in range(20)})
+        client = FakeClient(self.current)
+        ZoneUpdater(client, limits=DeltaLimits(max_changes_per_type=1)).sync(reference)
+        self.assertEqual(len(client.replaced), 20)
+
+    def test_modified_records_count_once_per_type(self):
+        reference = {name: rr("44.143.1.1") for name in self.current}
+        client = FakeClient(self.current)
+        ZoneUpdater(client, limits=DeltaLimits(max_changes_per_type=10)).sync(reference)
+        self.assertTrue(client.serial_bumped)
+        exc = self.assert_refused(reference, DeltaLimits(max_changes_per_type=9))
+        self.assertEqual(exc.violations, ["10 A changes > 9"])
+
+    def test_changed_records_are_not_counted_as_removals(self):
+        reference = {name: rr("44.143.1.1") for name in self.current}
+        client = FakeClient(self.current)
+        to_remove, to_change = ZoneUpdater(
+            client, limits=DeltaLimits(max_removals=0, max_removal_ratio=0.0)
+        ).sync(reference)
+        self.assertEqual(len(to_change), 10)
+        self.assertTrue(client.serial_bumped)
+
+    def test_within_limits_is_applied(self):
+        reference = dict(list(self.current.items())[:9])
+        client = FakeClient(self.current)
+        limits = DeltaLimits(max_removals=1, max_removal_ratio=0.1, max_changes_per_type=1)
+        to_remove, _ = ZoneUpdater(client, limits=limits).sync(reference)
+        self.assertEqual(set(to_remove), {"h9.hamip.at."})
+        self.assertTrue(client.serial_bumped)
+
+
+class TestLayeredDiff(unittest.TestCase):
+
+    def setUp(self):
+        self.base = {f"h{i}.hamip.at.": rr(f"44.143.0.{i}") for i in range(6)}
+        self.isp = {"h0.hamip.at.": rr("89.185.96.125"), "www.hamip.at.": rr("89.185.96.125")}
+        self.hamnet = {"www.hamip.at.": rr("44.143.8.131")}
+        # Both live zones agree on the base: h1 changed, h5 missing, x stale.
+        live = {name: rr(r.content) for name, r in self.base.items() if name != "h5.hamip.at."}
+        live["h1.hamip.at."] = rr("44.143.9.9")
+        live["x.hamip.at."] = rr("44.143.9.10")
+        self.live_isp = dict(live, **{"h0.hamip.at.": rr("89.185.96.125")})
+        self.live_hamnet = dict(live, **{"www.hamip.at.": rr("44.143.8.1")})
+
+    def test_matches_plain_diff(self):
+        shared = SharedBaseDiff(self.base, set(self.isp) | set(self.hamnet))
+        for overlay, live in ((self.isp, self.live_isp), (self.hamnet, self.live_hamnet)):
+            layered = diff_records(live, LayeredRecordMap(self.base, overlay), shared)
+            plain = diff_records(live, self.base | overlay)
+            self.assertEqual(layered, plain)
+
+    def test_base_diff_is_shared_when_zones_agree(self):
+        shared = SharedBaseDiff(self.base, set(self.isp) | set(self.hamnet))
+        diff_records(self.live_isp, LayeredRecordMap(self.base, self.isp), shared)
+        diff_records(self.live_hamnet, LayeredRecordMap(self.base, self.hamnet), shared)
+        self.assertEqual(shared.hits, 1)
+
+    def test_base_diff_is_recomputed_when_zones_disagree(self):
+        shared = SharedBaseDiff(self.base, set(self.isp) | set(self.hamnet))
+        self.live_hamnet["h2.hamip.at."] = rr("44.143.7.7")
+        _, to_change = diff_records(
+            self.live_hamnet, LayeredRecordMap(self.base, self.hamnet), shared)
+        diff_records(self.live_isp, LayeredRecordMap(self.base, self.isp), shared)
+        self.assertEqual(shared.hits, 0)
+        self.assertIn("h2.hamip.at.", to_change)
+
+    def test_updater_accepts_layered_reference(self):
+        client = FakeClient(self.live_isp)
+        to_remove, to_change = ZoneUpdater(client).sync(LayeredRecordMap(self.base, self.isp))
+        self.assertEqual(set(to_remove), {"h1.hamip.at.", "x.hamip.at."})
+        self.assertEqual(set(to_change), {"h1.hamip.at.", "h5.hamip.at.", "www.hamip.at."})
+
+
 if __name__ == "__main__":
     unittest.main()
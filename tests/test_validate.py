@@ -0,0 +1,152 @@
+"""Unit tests for record validation and normalization."""
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from hamipat import cli  # noqa: E402
+from hamipat.hamnetdb import HamnetDbClient  # noqa: E402
+from hamipat.records import ResourceRecord  # noqa: E402
+from hamipat.validate import validate_records  # noqa: E402
+from fakes import HamnetDbSession, ZoneSession, client_factory, make_target  # noqa: E402
+
+
+def rr(content, rrtype="A", ttl=600):
+    return ResourceRecord(rrtype, content, ttl)
+
+
+class TestValidateRecords(unittest.TestCase):
+
+    def reasons(self, records):
+        _, quarantined = validate_records(records)
+        return {item.name: item.reason for item in quarantined}
+
+    def test_valid_records_pass_unchanged(self):
+        records = {
+            "web.oe3xnr.hamip.at.": rr("44.143.60.66"),
+            "www.oe3xnr.hamip.at.": rr("web.oe3xnr.hamip.at.", "CNAME"),
+            "_dmarc.hamip.at.": rr('"v=DMARC1; p=none"', "TXT"),
+            "185-236-164-044-inetip.wx.oe3gwu.hamip.at.": rr("44.143.1.1"),
+            "*.wild.hamip.at.": rr("44.143.1.2"),
+        }
+        valid, quarantined = validate_records(records)
+        self.assertEqual(valid, records)
+        self.assertEqual(quarantined, [])
+
+    def test_names_and_targets_are_normalized(self):
+        valid, quarantined = validate_records({
+            " Web.OE3XNR.hamip.at ": rr("044.143.060.066"),
+            "WWW.oe3xnr.hamip.at.": rr("Web.OE3XNR.hamip.at", "CNAME"),
+        })
+        self.assertEqual(quarantined, [])
+        self.assertEqual(valid, {
+            "web.oe3xnr.hamip.at.": rr("44.143.60.66"),
+            "www.oe3xnr.hamip.at.": rr("web.oe3xnr.hamip.at.", "CNAME"),
+        })
+
+    def test_invalid_addresses(self):
+        reasons = self.reasons({
+            "a.hamip.at.": rr("44.143.0.256"),
+            "b.hamip.at.": rr("44.143.0"),
+            "c.hamip.at.": rr("44.143.0.x"),
+            "d.hamip.at.": rr("44.143.0.²"),
+            "e.hamip.at.": rr("44.143.0.1"),
+        })
+        self.assertEqual(set(reasons), {"a.hamip.at.", "b.hamip.at.", "c.hamip.at.", "d.hamip.at."})
+        self.assertTrue(all(r.startswith("invalid IPv4 address") for r in reasons.values()))
+
+    def test_invalid_names(self):
+        reasons = self.reasons({
+            "-bad.hamip.at.": rr("44.143.0.1"),
+            "bad-.hamip.at.": rr("44.143.0.1"),
+            "sp ace.hamip.at.": rr("44.143.0.1"),
+            "empty..hamip.at.": rr("44.143.0.1"),
+            ("x" * 64) + ".hamip.at.": rr("44.143.0.1"),
+            "ümlaut.hamip.at.": rr("44.143.0.1"),
+        })
+        self.assertEqual(set(reasons.values()), {"invalid name"})
+        self.assertEqual(len(reasons), 6)
+
+    def test_zone_type_ttl_and_txt_checks(self):
+        reasons = self.reasons({
+            "elsewhere.example.": rr("44.143.0.1"),
+            "notahamip.at.": rr("44.143.0.1"),
+            "hamip.at.": rr("web.hamip.at.", "CNAME"),
+            "mx.hamip.at.": rr("10 mail.hamip.at.", "MX"),
+            "ttl.hamip.at.": rr("44.143.0.1", ttl=-1),
+            "txt.hamip.at.": rr("unquoted", "TXT"),
+            "cname.hamip.at.": rr("bad target.", "CNAME"),
+            "none.hamip.at.": rr(None),
+            "number.hamip.at.": rr(123, "TXT"),
+        })
+        self.assertEqual(reasons, {
+            "elsewhere.example.": "name outside zone hamip.at.",
+            "notahamip.at.": "name outside zone hamip.at.",
+            "hamip.at.": "CNAME at the zone apex",
+            "mx.hamip.at.": "unsupported type MX",
+            "ttl.hamip.at.": "invalid TTL -1",
+            "txt.hamip.at.": "TXT content not quoted",
+            "cname.hamip.at.": "invalid CNAME target 'bad target.'",
+            "none.hamip.at.": "A content None is not a string",
+            "number.hamip.at.": "TXT content 123 is not a string",
+        })
+
+    def test_cname_conflict_and_duplicates_after_normalization(self):
+        valid, quarantined = validate_records({
+            "web.oe3xnr.hamip.at.": rr("44.143.60.66"),
+            "Web.oe3xnr.hamip.at.": rr("other.hamip.at.", "CNAME"),
+            "WEB.oe3xnr.hamip.at.": rr("44.143.60.67"),
+        })
+        self.assertEqual(valid, {"web.oe3xnr.hamip.at.": rr("44.143.60.66")})
+        self.assertEqual([(q.name, q.reason) for q in quarantined], [
+            ("Web.oe3xnr.hamip.at.", "CNAME conflicts with A at web.oe3xnr.hamip.at."),
+            ("WEB.oe3xnr.hamip.at.", "duplicate of web.oe3xnr.hamip.at."),
+        ])
+
+    def test_reverse_zone(self):
+        valid, quarantined = validate_records({
+            "66.60.143.44.in-addr.arpa.": rr("Web.oe3xnr.hamip.at.", "PTR"),
+            "1.1.hamip.at.": rr("web.oe3xnr.hamip.at.", "PTR"),
+        }, zone="143.44.in-addr.arpa")
+        self.assertEqual(valid, {
+            "66.60.143.44.in-addr.arpa.": rr("web.oe3xnr.hamip.at.", "PTR"),
+        })
+        self.assertEqual([q.name for q in quarantined], ["1.1.hamip.at."])
+
+
+class TestCliValidation(unittest.TestCase):
+
+    HOSTS = [
+        {"site": "oe3xnr", "name": "web.oe3xnr", "ip": "44.143.60.66", "deleted": 0,
+         "aliases": "www.oe3xnr"},
+        {"site": "oe3xnr", "name": "bad host.oe3xnr", "ip": "44.143.60.67", "deleted": 0,
+         "aliases": ""},
+        {"site": "oe3xnr", "name": "WWW.oe3xnr", "ip": "44.143.60.68", "deleted": 0,
+         "aliases": ""},
+    ]
+
+    def test_quarantined_records_are_left_out_of_the_plan(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            targets = (make_target(tmp),)
+            hamnetdb = HamnetDbClient(session=HamnetDbSession(self.HOSTS))
+            with self.assertLogs("hamipat.cli", "WARNING") as logs:
+                plans = cli.plan(targets, os.path.join(tmp, "missing.yaml"),
+                                 hamnetdb_client=hamnetdb,
+                                 client_factory=client_factory(ZoneSession({})),
+                                 cold_start=True)
+
+        names = set(plans[0].to_change)
+        self.assertIn("web.oe3xnr.hamip.at.", names)
+        self.assertEqual(plans[0].to_change["www.oe3xnr.hamip.at."],
+                         rr("web.oe3xnr.hamip.at.", "CNAME"))
+        self.assertNotIn("bad host.oe3xnr.hamip.at.", names)
+        self.assertEqual(len(logs.output), 2)
+        self.assertIn("bad host.oe3xnr.hamip.at. A: invalid name", logs.output[0])
+        self.assertIn("WWW.oe3xnr.hamip.at. A: A conflicts with CNAME", logs.output[1])
+
+
+if __name__ == "__main__":
+    unittest.main()